@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(current_dir, '..', 'preprocessing'), os.path.join(current_dir, '..', 'lstm')]
+
+from synthetic import DEFAULT_MIX, write_synthetic_features, write_synthetic_pcap
+
+STAGES = ('pcap', 'load', 'sequences', 'train', 'predict')
+DEFAULT_SIZES = [10000, 100000]
+SEQUENCE_LENGTH = 5
+# Groups in the synthetic feature files
+GROUP_COUNT = 10
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Run fn() and measure it: wall time, the peak resident size of the process so
+# far and how much the stage raised it. Memory comes from the kernel's counters
+# only, so measuring adds nothing to the timed call (tracemalloc slowed some
+# stages down several times). fn returns the number of items it processed.
+def measure(stage, size, fn):
+    rss_before = max_rss_mb()
+    start = time.perf_counter()
+    items = fn()
+    seconds = time.perf_counter() - start
+    rss_after = max_rss_mb()
+    result = {'stage': stage, 'size': size, 'items': items, 'seconds': round(seconds, 4),
+              'items_per_second': round(items / seconds, 1) if seconds > 0 else None,
+              'max_rss_mb': round(rss_after, 1), 'rss_growth_mb': round(rss_after - rss_before, 1)}
+    print(f"{stage:>9} {size:>9}: {items} items in {seconds:.3f}s "
+          f"({result['items_per_second']} /s, peak RSS {result['max_rss_mb']} MB, +{result['rss_growth_mb']} MB)")
+    return result
+
+
+# --mix entry PROTOCOL=WEIGHT
+def parse_mix_entry(value):
+    protocol, _, weight = value.partition('=')
+    protocol = protocol.upper()
+    if protocol not in DEFAULT_MIX:
+        raise argparse.ArgumentTypeError(f"unknown protocol {protocol!r}, expected one of {list(DEFAULT_MIX)}")
+    try:
+        return protocol, float(weight)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected PROTOCOL=WEIGHT, got {value!r}")
+
+
+def bench_pcap(work_dir, size, packet_rate, flow_count, mix=DEFAULT_MIX):
+    from pcaptocsv import analyze_pcap
+
+    pcap_file = write_synthetic_pcap(os.path.join(work_dir, f'bench{size}_s1-eth1_traffic.pcap'), size,
+                                     packet_rate, flow_count, mix)
+    output_csv = os.path.join(work_dir, 'pcap_features.csv')
+    return measure('pcap', size, lambda: analyze_pcap(pcap_file, output_csv)['packets'])
+
+
+# Loading, sequence building, training and prediction on a synthetic feature folder
+def bench_features(work_dir, size, stages, epochs):
+    from sklearn.preprocessing import MinMaxScaler
+
+    from feature_store import GROUP_COLUMNS
+    from lstm import SELECTED_FEATURES, load_and_preprocess_data
+    from sequences import make_sequences
+
+    data_folder = os.path.join(work_dir, f'features_{size}')
+    os.makedirs(data_folder, exist_ok=True)
+    write_synthetic_features(os.path.join(data_folder, f'bench{size}_s1-eth1_traffic_features.csv'), size, GROUP_COUNT)
+
+    results = []
+    state = {}
+
+    def load():
+        state['df'] = load_and_preprocess_data(data_folder)
+        return len(state['df'])
+    results.append(measure('load', size, load))
+
+    def sequences():
+        state['groups'] = []
+        count = 0
+        for _, group in state['df'].groupby(GROUP_COLUMNS, observed=True):
+            scaled = MinMaxScaler().fit_transform(group[SELECTED_FEATURES])
+            X, y = make_sequences(scaled, SEQUENCE_LENGTH)
+            state['groups'].append((X, y))
+            count += len(X)
+        return count
+    if 'sequences' in stages or 'train' in stages or 'predict' in stages:
+        results.append(measure('sequences', size, sequences))
+
+    if 'train' in stages or 'predict' in stages:
+        from lstm import build_lstm_model_classic
+
+        X, y = max(state['groups'], key=lambda item: len(item[0]))
+        model = build_lstm_model_classic((SEQUENCE_LENGTH, len(SELECTED_FEATURES)))
+
+        def train():
+            model.fit(X, y, epochs=epochs, batch_size=16, verbose=0)
+            return len(X) * epochs
+        if 'train' in stages:
+            results.append(measure('train', size, train))
+        else:
+            train()
+
+        if 'predict' in stages:
+            results.append(measure('predict', size, lambda: len(model.predict(X, verbose=0))))
+    return [result for result in results if result['stage'] in stages]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=current_dir, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    versions = {}
+    for name in ('numpy', 'pandas', 'sklearn', 'tensorflow', 'pyarrow'):
+        module = sys.modules.get(name)
+        if module is not None:
+            versions[name] = getattr(module, '__version__', None)
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'commit': git_commit(), 'versions': versions}
+
+
+def run_benchmarks(sizes, stages, packet_rate=1000, flow_count=50, epochs=1, mix=DEFAULT_MIX):
+    work_dir = tempfile.mkdtemp(prefix='networking2_bench_')
+    results = []
+    try:
+        for size in sizes:
+            if 'pcap' in stages:
+                results.append(bench_pcap(work_dir, size, packet_rate, flow_count, mix))
+            if set(stages) - {'pcap'}:
+                results += bench_features(work_dir, size, stages, epochs)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'environment': environment(),
+            'settings': {'sizes': sizes, 'packet_rate': packet_rate, 'flow_count': flow_count, 'mix': mix,
+                         'epochs': epochs},
+            'results': results}
+
+
+# Print the throughput change of every stage and size against an earlier run
+def compare(report, baseline_file):
+    with open(baseline_file) as f:
+        baseline = {(result['stage'], result['size']): result for result in json.load(f)['results']}
+    print(f"Compared with {baseline_file}:")
+    for result in report['results']:
+        previous = baseline.get((result['stage'], result['size']))
+        if previous is None or not previous['items_per_second'] or not result['items_per_second']:
+            continue
+        change = result['items_per_second'] / previous['items_per_second'] - 1
+        print(f"{result['stage']:>9} {result['size']:>9}: {change:+.1%} throughput")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the preprocessing and LSTM stages on synthetic data")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help="Packets per synthetic capture and rows per synthetic feature file")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--packet-rate', type=float, default=1000, help="Packets per second in synthetic captures")
+    parser.add_argument('--flows', type=int, default=50, help="Flows in synthetic captures")
+    parser.add_argument('--mix', type=parse_mix_entry, nargs='+', metavar='PROTOCOL=WEIGHT',
+                        help="Share of the flows of each protocol in synthetic captures, e.g. TCP=0.7 UDP=0.3 "
+                             "(default: TCP=0.4 UDP=0.4 HTTP=0.2)")
+    parser.add_argument('--epochs', type=int, default=1, help="Epochs of the training stage")
+    parser.add_argument('--output', help="Results file (default: results/benchmark_<time>.json)")
+    parser.add_argument('--baseline', help="Earlier results file to compare with")
+    args = parser.parse_args()
+
+    mix = dict(args.mix) if args.mix else DEFAULT_MIX
+    if sum(mix.values()) <= 0 or min(mix.values()) < 0:
+        parser.error("--mix weights must be non-negative with a positive total")
+    report = run_benchmarks(args.sizes, args.stages, args.packet_rate, args.flows, args.epochs, mix)
+    output_file = args.output or os.path.join(current_dir, 'results', f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+    with open(output_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to '{output_file}'")
+    if args.baseline:
+        compare(report, args.baseline)
@@ -0,0 +1,119 @@
+import csv
+import os
+import random
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'preprocessing'))
+
+from aggregation import COLUMNS
+
+# Same ports as network/traffic_gen.py (which cannot be imported without Mininet)
+TCP_SRC_PORTS = [50020, 50021, 50022]
+TCP_DST_PORTS = [8080, 9001, 9002]
+UDP_SRC_PORTS = [50010, 50011, 50012]
+UDP_DST_PORTS = [8000, 8001, 8002]
+HTTP_SRC_PORTS = [51000, 51001, 51002]
+HTTP_DST_PORT = 80
+
+# Share of packets per protocol, roughly what start_traffic produces
+DEFAULT_MIX = {'TCP': 0.4, 'UDP': 0.4, 'HTTP': 0.2}
+
+PCAP_HEADER = struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1)
+START_TIME = 1748419200
+
+
+def host_ip(index):
+    return bytes([10, 0, 0, index])
+
+
+def host_mac(index):
+    return bytes([0, 0, 0, 0, 0, index])
+
+
+def ipv4_checksum(header):
+    total = sum(struct.unpack('!10H', header))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+# Ethernet/IPv4/TCP or UDP frame with the given payload size
+def build_frame(protocol, src, dst, src_port, dst_port, payload_size):
+    payload = b'\x00' * payload_size
+    if protocol == 'UDP':
+        transport = struct.pack('!HHHH', src_port, dst_port, 8 + payload_size, 0)
+        ip_proto = 17
+    else:
+        transport = struct.pack('!HHIIBBHHH', src_port, dst_port, 0, 0, 5 << 4, 0x18, 65535, 0, 0)
+        ip_proto = 6
+    total_length = 20 + len(transport) + payload_size
+    header = struct.pack('!BBHHHBBH4s4s', 0x45, 0, total_length, 0, 0, 64, ip_proto, 0, host_ip(src), host_ip(dst))
+    header = header[:10] + struct.pack('!H', ipv4_checksum(header)) + header[12:]
+    return struct.pack('!6s6sH', host_mac(dst), host_mac(src), 0x0800) + header + transport + payload
+
+
+# A set of flows like the ones traffic_gen.py creates between hosts h1..h7
+def make_flows(flow_count, mix, rng):
+    protocols = list(mix)
+    weights = [mix[protocol] for protocol in protocols]
+    flows = []
+    for _ in range(flow_count):
+        protocol = rng.choices(protocols, weights)[0]
+        src, dst = rng.sample(range(1, 8), 2)
+        if protocol == 'TCP':
+            ports = (rng.choice(TCP_SRC_PORTS), rng.choice(TCP_DST_PORTS))
+        elif protocol == 'UDP':
+            ports = (rng.choice(UDP_SRC_PORTS), rng.choice(UDP_DST_PORTS))
+        else:
+            ports = (rng.choice(HTTP_SRC_PORTS), HTTP_DST_PORT)
+        flows.append((protocol, src, dst) + ports)
+    return flows
+
+
+# Write a libpcap capture of packet_count packets spread over flow_count flows
+# at packet_rate packets per second (exponential gaps), with payloads of 90-200
+# bytes like traffic_gen.py
+def write_synthetic_pcap(path, packet_count, packet_rate=1000, flow_count=50, mix=DEFAULT_MIX, seed=0):
+    rng = random.Random(seed)
+    flows = make_flows(flow_count, mix, rng)
+    frames = {}
+    timestamp = START_TIME
+    with open(path, 'wb') as f:
+        f.write(PCAP_HEADER)
+        for _ in range(packet_count):
+            timestamp += rng.expovariate(packet_rate)
+            flow = rng.choice(flows)
+            payload_size = rng.randint(90, 200)
+            frame = frames.get((flow, payload_size))
+            if frame is None:
+                frame = frames[(flow, payload_size)] = build_frame(*flow, payload_size)
+            seconds = int(timestamp)
+            f.write(struct.pack('<IIII', seconds, int((timestamp - seconds) * 1e6), len(frame), len(frame)))
+            f.write(frame)
+    return path
+
+
+# Write a feature CSV (pcaptocsv.py layout) with row_count rows spread evenly
+# over group_count (source port, destination port, protocol) groups, one row
+# per group and second with a noisy periodic throughput
+def write_synthetic_features(path, row_count, group_count=10, seed=0):
+    rng = random.Random(seed)
+    groups = []
+    for protocol, _, _, src_port, dst_port in make_flows(group_count * 4, DEFAULT_MIX, rng):
+        if (protocol, src_port, dst_port) not in groups and len(groups) < group_count:
+            groups.append((protocol, src_port, dst_port))
+    rows_per_group = max(1, row_count // len(groups))
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for second in range(rows_per_group):
+            for index, (protocol, src_port, dst_port) in enumerate(groups):
+                packets = rng.randint(1, 20)
+                size = rng.uniform(90, 200) + 54
+                throughput = packets * size * (1.5 + (second + index) % 30 / 30)
+                writer.writerow([START_TIME + second, throughput, rng.uniform(0, 0.1), size, packets,
+                                 str({protocol: 1.0}), rng.uniform(0, 1), '10.0.0.1', '10.0.0.2',
+                                 '00:00:00:00:00:01', '00:00:00:00:00:02', '', '', src_port, dst_port, protocol])
+    return path
+
@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+import time
+
+# Path the metrics of a run are written to; setting it enables instrumentation.
+# Worker processes inherit it, so they record metrics too and hand them back.
+METRICS_ENV = 'PIPELINE_METRICS'
+
+
+# Timer doing nothing, returned while metrics are disabled so an instrumented
+# block costs one attribute check
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+class Timer:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.metrics.stack().append(0.0)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+# Per-stage timers and event counters of one process. Timers nest: each one
+# records its total time and its self time, i.e. without the timers running
+# inside it, so a generator pipeline (decode -> aggregate -> write) can be
+# split into the share of each stage.
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.started = time.time()
+        self.timers = {}  # name -> [calls, total seconds, self seconds, max seconds]
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def enable(self, path=None):
+        self.enabled = True
+        self.path = path
+        if path is not None:
+            os.environ[METRICS_ENV] = path
+
+    def stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def timer(self, name):
+        return Timer(self, name) if self.enabled else NULL_TIMER
+
+    def record(self, name, elapsed):
+        stack = self.stack()
+        children = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        with self.lock:
+            timer = self.timers.setdefault(name, [0, 0.0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += elapsed
+            timer[2] += elapsed - children
+            timer[3] = max(timer[3], elapsed)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            with self.lock:
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    # Pass the items of iterable through, timing how long each one takes to produce
+    def timed(self, name, iterable):
+        if not self.enabled:
+            return iterable
+        return self.iter_timed(name, iter(iterable))
+
+    def iter_timed(self, name, iterator):
+        while True:
+            with Timer(self, name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    # Metrics recorded since the last drain, reset, to send them to the parent process
+    def drain(self):
+        with self.lock:
+            snapshot = {'timers': self.timers, 'counters': self.counters}
+            self.timers = {}
+            self.counters = {}
+        return snapshot
+
+    def merge(self, snapshot):
+        if not snapshot:
+            return
+        with self.lock:
+            for name, (calls, total, self_time, longest) in snapshot['timers'].items():
+                timer = self.timers.setdefault(name, [0, 0.0, 0.0, 0.0])
+                timer[0] += calls
+                timer[1] += total
+                timer[2] += self_time
+                timer[3] = max(timer[3], longest)
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        wall = time.time() - self.started
+        lines = [f"Metrics summary ({wall:.1f}s wall time)",
+                 f"{'stage':<24}{'calls':>10}{'total s':>11}{'self s':>11}{'max ms':>10}"]
+        for name, (calls, total, self_time, longest) in sorted(self.timers.items(), key=lambda item: -item[1][2]):
+            lines.append(f"{name:<24}{calls:>10}{total:>11.3f}{self_time:>11.3f}{longest * 1000:>10.1f}")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name:<24}{value:>10}")
+        return '\n'.join(lines)
+
+    # Prometheus text exposition format, for the textfile collector of node_exporter
+    def prometheus_text(self):
+        lines = []
+        for metric, index, help_text in (('pipeline_stage_calls_total', 0, "Calls of each pipeline stage"),
+                                         ('pipeline_stage_seconds_total', 1, "Time spent in each stage"),
+                                         ('pipeline_stage_self_seconds_total', 2,
+                                          "Time spent in each stage, without the stages it runs")):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            lines += [f'{metric}{{stage="{name}"}} {timer[index]}' for name, timer in sorted(self.timers.items())]
+        lines += ["# HELP pipeline_events_total Events counted by the pipeline", "# TYPE pipeline_events_total counter"]
+        lines += [f'pipeline_events_total{{name="{name}"}} {value}' for name, value in sorted(self.counters.items())]
+        return '\n'.join(lines) + '\n'
+
+    # Write the metrics of the run: Prometheus text if the path ends in .prom,
+    # otherwise one JSON record appended per run (a structured log)
+    def export(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if path.endswith('.prom'):
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(self.prometheus_text())
+            os.replace(tmp_path, path)
+            return
+        record = {'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                  'wall_seconds': round(time.time() - self.started, 3), 'pid': os.getpid(),
+                  'timers': {name: {'calls': calls, 'seconds': total, 'self_seconds': self_time, 'max_seconds': longest}
+                             for name, (calls, total, self_time, longest) in self.timers.items()},
+                  'counters': self.counters}
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    # End of a run: print the summary and write the metrics file
+    def finish(self):
+        if not self.enabled:
+            return
+        print(self.summary())
+        if self.path is not None:
+            self.export(self.path)
+            print(f"Metrics saved to '{self.path}'")
+
+
+metrics = Metrics()
+if os.environ.get(METRICS_ENV):
+    metrics.enable(os.environ[METRICS_ENV])
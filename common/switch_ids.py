@@ -0,0 +1,12 @@
+import os
+import re
+
+# Captures and feature files of a switch interface are named <...>_<switch>-<interface>...,
+# e.g. iteration_1_s1-eth1_traffic_features.csv
+SWITCH_PATTERN = re.compile(r'_(s\d+)-([a-z0-9]+)')
+
+
+# Extract Switch ID from a capture or feature file name
+def switch_id_from_filename(path):
+    match = SWITCH_PATTERN.search(os.path.basename(path))
+    return match.group(1) if match else "unknown"
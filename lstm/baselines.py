@@ -0,0 +1,113 @@
+import math
+
+import numpy as np
+
+# Cheap forecasters run on every group at once: the series of all groups are
+# padded into one (series, time) array, so each baseline is a handful of NumPy
+# operations over every group instead of a model per group.
+BASELINES = ['persistence', 'moving_average', 'exp_smoothing', 'autoregressive']
+# Weight of the newest window in exponential smoothing
+SMOOTHING = 0.3
+# Keeps the least squares of the autoregression solvable for constant series
+RIDGE = 1e-6
+
+
+# Ragged (rows, n) arrays as one (len(series), longest, n) array, NaN past the end of each
+def pad_series(series):
+    padded = np.full((len(series), max(len(values) for values in series), series[0].shape[1]), np.nan)
+    for i, values in enumerate(series):
+        padded[i, :len(values)] = values
+    return padded
+
+
+# One-step forecasts of x (series, time): forecast[:, t] predicts x[:, t] from x[:, :t]
+def persistence(x, window):
+    forecast = np.full_like(x, np.nan)
+    forecast[:, 1:] = x[:, :-1]
+    return forecast
+
+
+def moving_average(x, window):
+    totals = np.concatenate([np.zeros((len(x), 1)), np.cumsum(np.nan_to_num(x), axis=1)], axis=1)
+    forecast = np.full_like(x, np.nan)
+    forecast[:, window:] = (totals[:, window:-1] - totals[:, :-window - 1]) / window
+    return forecast
+
+
+def exp_smoothing(x, window):
+    forecast = np.full_like(x, np.nan)
+    level = x[:, 0]
+    for t in range(1, x.shape[1]):
+        forecast[:, t] = level
+        level = SMOOTHING * x[:, t] + (1 - SMOOTHING) * level
+    return forecast
+
+
+# Lags x[:, t - 1], ..., x[:, t - order] and a constant for every t >= order: (series, time - order, order + 1)
+def lag_matrix(x, order):
+    steps = x.shape[1] - order
+    lags = [x[:, order - 1 - j:order - 1 - j + steps] for j in range(order)]
+    return np.stack(lags + [np.ones((len(x), steps))], axis=2)
+
+
+# Linear autoregression of the given order fitted on the one-step targets
+# before train_end[i] of every series at once, by solving the normal equations
+def fit_autoregression(x, order, train_end):
+    lags = np.nan_to_num(lag_matrix(x, order))
+    targets = np.nan_to_num(x[:, order:])
+    weights = (np.arange(order, x.shape[1]) < train_end[:, None]).astype(float)
+    gram = np.einsum('sti,stj,st->sij', lags, lags, weights) + RIDGE * np.eye(order + 1)
+    moments = np.einsum('sti,st,st->si', lags, targets, weights)
+    return np.linalg.solve(gram, moments[..., None])[..., 0]
+
+
+# Forecasts of x[:, t + h] from x[:, :t] for h < horizon: (series, time, horizon).
+# The autoregression feeds its own forecasts back for the later steps, the
+# other baselines repeat their one-step forecast.
+def forecast_baseline(name, x, window, horizon, train_end):
+    if name != 'autoregressive':
+        one_step = BASELINE_FUNCTIONS[name](x, window)
+        return np.repeat(one_step[:, :, None], horizon, axis=2)
+
+    coefficients = fit_autoregression(x, window, train_end)
+    forecasts = np.full(x.shape + (horizon,), np.nan)
+    lags = lag_matrix(x, window)
+    for h in range(horizon):
+        step = np.einsum('sti,si->st', lags, coefficients)
+        forecasts[:, window:, h] = step
+        lags = np.concatenate([step[..., None], lags[..., :window - 1], lags[..., window:]], axis=2)
+    return forecasts
+
+
+BASELINE_FUNCTIONS = {'persistence': persistence, 'moving_average': moving_average, 'exp_smoothing': exp_smoothing}
+
+
+# Evaluate every baseline on the test sequences of every group, numbered and
+# split like make_sequences and split_train_test do for the LSTM. series: the
+# scaled target columns of each group, (rows, targets). The moving average and
+# the autoregression look back sequence_length windows, like the LSTM.
+# Returns (y_test per group, {baseline: y_pred per group}), each (n_test, horizon * targets)
+# with the outputs ordered like the LSTM's labels.
+def evaluate_baselines(series, sequence_length, horizon=1, test_size=0.2):
+    padded = pad_series(series)
+    n_groups, length, n_targets = padded.shape
+    sequences = np.array([len(values) for values in series]) - sequence_length - horizon + 1
+    n_test = np.array([math.ceil(test_size * n) for n in sequences])
+    origins = [sequence_length + np.arange(n - t, n) for n, t in zip(sequences, n_test)]
+
+    # Targets of a group are independent series: (groups * targets, time)
+    x = padded.transpose(0, 2, 1).reshape(n_groups * n_targets, length)
+    train_end = np.repeat(sequence_length + sequences - n_test, n_targets)
+
+    y_test = []
+    for i, starts in enumerate(origins):
+        rows = starts[:, None] + np.arange(horizon)  # (n_test, horizon)
+        y_test.append(padded[i][rows].reshape(len(starts), -1))
+
+    predictions = {}
+    for name in BASELINES:
+        forecasts = forecast_baseline(name, x, sequence_length, horizon, train_end)
+        # (groups, time, horizon, targets)
+        forecasts = forecasts.reshape(n_groups, n_targets, length, horizon).transpose(0, 2, 3, 1)
+        predictions[name] = [forecasts[i, starts].reshape(len(starts), -1) for i, starts in enumerate(origins)]
+    return y_test, predictions
@@ -0,0 +1,243 @@
+import json
+import os
+import sys
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from switch_ids import switch_id_from_filename
+
+FEATURE_FILE_EXTENSIONS = ('.csv', '.parquet', '.feather')
+LOADED_COLUMNS = ['Timestamp', 'Throughput (Bps)', 'Source Port', 'Destination Port', 'Protocol', 'Jitter (s)', 'Avg Packet Size (bytes)', 'Packet Count', 'Protocol Distribution', 'Delay (s)']
+GROUP_COLUMNS = ['Switch ID', 'Source Port', 'Destination Port', 'Protocol']
+
+INDEX_NAME = 'index.json'
+STORE_VERSION = 1
+# Small row groups let reads of a single group skip most of a part file
+STORE_ROW_GROUP_SIZE = 8192
+
+
+# Read one feature file. Columnar files are memory-mapped and only the requested
+# columns are read; they already carry a typed Switch ID column and per-protocol
+# share columns instead of the stringified 'Protocol Distribution'. CSV files
+# written by streaming.py carry a Switch ID column too, which is kept.
+def read_feature_file(path, columns):
+    if path.endswith('.csv'):
+        return pd.read_csv(path, usecols=csv_columns(columns))
+
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    columns = [column for column in columns if column != 'Protocol Distribution'] + ['Switch ID']
+    if path.endswith('.parquet'):
+        table = pq.read_table(path, columns=columns, memory_map=True)
+    else:
+        table = feather.read_table(path, columns=columns, memory_map=True)
+    return table.to_pandas()
+
+
+# usecols of a feature CSV: the requested columns and Switch ID when the file has it
+def csv_columns(columns):
+    return lambda column: column in columns or column == 'Switch ID'
+
+
+# Load one feature file, cleaned and sorted by time, with its Switch ID
+def load_feature_file(path):
+    df = clean_feature_rows(read_feature_file(path, LOADED_COLUMNS), switch_id_from_filename(path))
+    df.sort_values('Timestamp', inplace=True)
+    return df
+
+
+def clean_feature_rows(df, switch_id):
+    df.dropna(inplace=True)
+    df['Timestamp'] = pd.to_datetime(df['Timestamp'], unit='s')
+    if 'Switch ID' not in df:
+        df['Switch ID'] = switch_id
+    df['Switch ID'] = df['Switch ID'].astype(str)
+    df['Protocol'] = df['Protocol'].astype(str)
+    return df
+
+
+# Read a feature file chunk_rows rows at a time, each chunk cleaned like
+# load_feature_file. Chunks are not sorted: pcaptocsv.py writes the windows of
+# a capture in time order already.
+def iter_feature_chunks(path, chunk_rows):
+    switch_id = switch_id_from_filename(path)
+    if path.endswith('.csv'):
+        for chunk in pd.read_csv(path, usecols=csv_columns(LOADED_COLUMNS), chunksize=chunk_rows):
+            yield clean_feature_rows(chunk, switch_id)
+        return
+
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    columns = [column for column in LOADED_COLUMNS if column != 'Protocol Distribution'] + ['Switch ID']
+    if path.endswith('.parquet'):
+        batches = pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=chunk_rows, columns=columns)
+        for batch in batches:
+            yield clean_feature_rows(batch.to_pandas(), switch_id)
+        return
+    table = feather.read_table(path, columns=columns, memory_map=True)
+    for offset in range(0, table.num_rows, chunk_rows):
+        yield clean_feature_rows(table.slice(offset, chunk_rows).to_pandas(), switch_id)
+
+
+def group_name(key):
+    return '|'.join(str(part) for part in key)
+
+
+# Consolidated copy of a feature folder, partitioned by switch, with an index of
+# every (Switch ID, Source Port, Destination Port, Protocol) group: its row count,
+# time range and the part files holding it. A single group or a time range can be
+# read without loading the rest of the dataset.
+class FeatureStore:
+    def __init__(self, store_folder):
+        self.store_folder = store_folder
+        self.index_path = os.path.join(store_folder, INDEX_NAME)
+        self.index = {'version': STORE_VERSION, 'sources': {}, 'groups': {}}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    # Add every feature file of data_folder that is new or changed since the last build.
+    # Files are processed one at a time, so memory is bounded by the largest file.
+    def build(self, data_folder):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        os.makedirs(self.store_folder, exist_ok=True)
+        files = sorted(file for file in os.listdir(data_folder) if file.endswith(FEATURE_FILE_EXTENSIONS))
+        for file in files:
+            path = os.path.join(data_folder, file)
+            stat = os.stat(path)
+            source = self.index['sources'].get(file)
+            if source is not None and source['size'] == stat.st_size and source['mtime'] == stat.st_mtime:
+                continue
+            if source is not None:
+                self.remove_source(file)
+
+            df = load_feature_file(path)
+            if df.empty:
+                self.index['sources'][file] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'part': None}
+                continue
+            # Keep each group contiguous within the part, in time order
+            df = df.drop(columns=['Protocol Distribution'], errors='ignore')
+            df = df.sort_values(['Source Port', 'Destination Port', 'Protocol', 'Timestamp'], kind='stable')
+
+            switch_id = df['Switch ID'].iloc[0]
+            part = os.path.join(f"switch={switch_id}", os.path.splitext(file)[0] + '.parquet')
+            os.makedirs(os.path.join(self.store_folder, f"switch={switch_id}"), exist_ok=True)
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            pq.write_table(table, os.path.join(self.store_folder, part), row_group_size=STORE_ROW_GROUP_SIZE)
+
+            for key, group in df.groupby(GROUP_COLUMNS, sort=False, observed=True):
+                entry = self.index['groups'].setdefault(group_name(key), {
+                    'key': list(key), 'rows': 0, 'start': None, 'end': None, 'parts': {}})
+                start = group['Timestamp'].iloc[0].isoformat()
+                end = group['Timestamp'].iloc[-1].isoformat()
+                entry['rows'] += len(group)
+                entry['start'] = start if entry['start'] is None else min(entry['start'], start)
+                entry['end'] = end if entry['end'] is None else max(entry['end'], end)
+                entry['parts'][part] = len(group)
+            self.index['sources'][file] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'part': part}
+            print(f"Added {file} to feature store ({len(df)} rows)")
+            self.save()
+
+        # Forget files that disappeared from the data folder
+        for file in list(self.index['sources']):
+            if file not in files:
+                self.remove_source(file)
+        self.save()
+        return self
+
+    # Feature files of data_folder added, changed or removed since the store was last built
+    def stale_files(self, data_folder):
+        files = {file for file in os.listdir(data_folder) if file.endswith(FEATURE_FILE_EXTENSIONS)}
+        stale = sorted(set(self.index['sources']) - files)
+        for file in sorted(files):
+            stat = os.stat(os.path.join(data_folder, file))
+            source = self.index['sources'].get(file)
+            if source is None or source['size'] != stat.st_size or source['mtime'] != stat.st_mtime:
+                stale.append(file)
+        return stale
+
+    def remove_source(self, file):
+        source = self.index['sources'].pop(file)
+        part = source.get('part')
+        if part is None:
+            return
+        for name in list(self.index['groups']):
+            entry = self.index['groups'][name]
+            rows = entry['parts'].pop(part, 0)
+            entry['rows'] -= rows
+            if not entry['parts']:
+                del self.index['groups'][name]
+        part_path = os.path.join(self.store_folder, part)
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+    def save(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    # (key, row count) of every group, in key order
+    def groups(self):
+        entries = sorted(self.index['groups'].values(), key=lambda entry: [str(part) for part in entry['key']])
+        return [(tuple(entry['key']), entry['rows']) for entry in entries]
+
+    # Rows of a single group, optionally restricted to [start, end]
+    def load_group(self, key, start=None, end=None):
+        entry = self.index['groups'].get(group_name(key))
+        if entry is None:
+            return pd.DataFrame()
+        filters = [(column, '=', value) for column, value in zip(GROUP_COLUMNS, key)]
+        frames = [self.read_part(part, filters, start, end) for part in sorted(entry['parts'])]
+        return pd.concat(frames, ignore_index=True)
+
+    # Rows of every group between start and end, optionally for one switch only
+    def load_range(self, start=None, end=None, switch_id=None):
+        parts = sorted(source['part'] for source in self.index['sources'].values() if source.get('part'))
+        if switch_id is not None:
+            parts = [part for part in parts if part.startswith(f"switch={switch_id}{os.sep}")]
+        frames = [self.read_part(part, [], start, end) for part in parts]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def read_part(self, part, filters, start, end):
+        import pyarrow.parquet as pq
+
+        filters = list(filters)
+        if start is not None:
+            filters.append(('Timestamp', '>=', pd.Timestamp(start)))
+        if end is not None:
+            filters.append(('Timestamp', '<=', pd.Timestamp(end)))
+        table = pq.read_table(os.path.join(self.store_folder, part), filters=filters or None,
+                              memory_map=True, partitioning=None)
+        return table.to_pandas()
+
+
+# Print a warning when store_folder no longer matches the feature files of data_folder
+def warn_if_stale(store_folder, data_folder):
+    if not os.path.isdir(data_folder):
+        return
+    stale = FeatureStore(store_folder).stale_files(data_folder)
+    if stale:
+        print(f"Warning: the feature store '{store_folder}' is older than {len(stale)} feature files of "
+              f"'{data_folder}' (e.g. {stale[0]}); rebuild it with "
+              f"`python3 feature_store.py --data {data_folder} --store {store_folder}`")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    current_dir = os.path.dirname(__file__)
+    parser = argparse.ArgumentParser(description="Build or update the feature store of a feature folder")
+    parser.add_argument('--data', default=os.path.join(current_dir, '..', 'prediction'),
+                        help="Feature folder (default: ../prediction)")
+    parser.add_argument('--store', default=os.path.join(current_dir, '..', 'feature_store'),
+                        help="Feature store folder (default: ../feature_store)")
+    args = parser.parse_args()
+
+    store = FeatureStore(args.store).build(args.data)
+    print(f"Feature store at '{args.store}': {len(store.groups())} groups")
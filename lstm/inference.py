@@ -0,0 +1,259 @@
+import argparse
+import csv
+import json
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from registry import ModelRegistry
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from switch_ids import switch_id_from_filename
+
+# Most requests answered by one forward pass, and how long the first request of
+# a batch may wait for others to join it
+MAX_BATCH = 256
+MAX_BATCH_DELAY = 0.005
+# Seconds between latency reports
+REPORT_INTERVAL = 10
+DEFAULT_PORT = 9900
+
+
+# Key used to match incoming rows with saved groups: ports from CSV files are
+# floats and ports from columnar files ints, so they are compared as floats
+def normalize_key(key):
+    switch, source_port, dest_port, protocol = key
+    return (str(switch), float(source_port), float(dest_port), str(protocol))
+
+
+# Forward pass of a model as a graph traced for any batch size, which skips the
+# per-call setup of model.predict. It is traced here with a single window so the
+# first live request does not pay for it.
+def make_forward(tf, model, sequence_length, n_features, shared):
+    window_spec = tf.TensorSpec((None, sequence_length, n_features), tf.float32)
+    window = np.zeros((1, sequence_length, n_features), dtype=np.float32)
+    if shared:
+        forward = tf.function(lambda windows, groups: model([windows, groups], training=False),
+                              input_signature=[window_spec, tf.TensorSpec((None,), tf.int32)])
+        forward(window, np.zeros(1, dtype=np.int32))
+        return lambda inputs: forward(*inputs)
+    forward = tf.function(lambda windows: model(windows, training=False), input_signature=[window_spec])
+    forward(window)
+    return forward
+
+
+# Every model of a registry folder, with the scaler of each group. A group saved
+# with its own model is served by it, others by the shared model if there is one.
+class ModelSet:
+    def __init__(self, model_folder):
+        import tensorflow as tf
+
+        self.groups = {}  # normalized key -> (forward pass, group index or None, min, scale)
+        self.sequence_length = None
+        self.features = None
+        registry = ModelRegistry(model_folder)
+        for file, entry in registry.entries():
+            if self.sequence_length is None:
+                self.sequence_length = entry['sequence_length']
+                self.features = entry['features']
+            elif entry['sequence_length'] != self.sequence_length or entry['features'] != self.features:
+                print(f"Skipping {file} - trained with different sequences than the other models")
+                continue
+
+            model = tf.keras.models.load_model(registry.model_path(entry), compile=False)
+            shared = entry.get('shared', False)
+            forward = make_forward(tf, model, self.sequence_length, len(self.features), shared)
+            for index, (key, scaler) in enumerate(zip(entry['keys'], entry['scalers'])):
+                key = normalize_key(key)
+                if shared and key in self.groups:
+                    continue
+                self.groups[key] = (forward, index if shared else None,
+                                    np.array(scaler['min']), np.array(scaler['scale']))
+        print(f"Loaded models for {len(self.groups)} groups from '{model_folder}'")
+
+
+# Answers "what will the throughput of this group be in the next window" for
+# every new window row. Requests from any number of threads are queued, and the
+# serving thread answers all the requests that arrived together with a single
+# forward pass per model.
+class InferenceService:
+    def __init__(self, model_set, max_batch=MAX_BATCH, max_delay=MAX_BATCH_DELAY):
+        self.model_set = model_set
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.requests = queue.Queue()
+        # Last sequence_length scaled rows of each group, oldest first
+        self.buffers = {}
+        self.latencies = deque(maxlen=10000)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    # Queue a window row (a dict with the model features) of a group. The future
+    # resolves to the predicted throughput in bytes/s, or None while the group
+    # has fewer than sequence_length rows or has no saved model.
+    def submit(self, key, row):
+        future = Future()
+        self.requests.put((time.perf_counter(), normalize_key(key), row, future))
+        return future
+
+    def run(self):
+        last_report = time.perf_counter()
+        while True:
+            batch = [self.requests.get()]
+            deadline = batch[0][0] + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.requests.get(timeout=max(0.0, deadline - time.perf_counter())))
+                except queue.Empty:
+                    break
+            try:
+                self.process_batch(batch)
+            except Exception as e:
+                print(f"Error serving {len(batch)} requests: {e}")
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            if time.perf_counter() - last_report >= REPORT_INTERVAL:
+                self.report_latency()
+                last_report = time.perf_counter()
+
+    def process_batch(self, batch):
+        sequence_length = self.model_set.sequence_length
+        features = self.model_set.features
+        # forward pass -> (requests, windows, group indexes)
+        pending = {}
+        for arrival, key, row, future in batch:
+            group = self.model_set.groups.get(key)
+            if group is None:
+                future.set_result(None)
+                continue
+            forward, group_index, scale_min, scale = group
+            scaled = np.array([float(row[feature]) for feature in features]) * scale + scale_min
+
+            buffer = self.buffers.setdefault(key, deque(maxlen=sequence_length))
+            buffer.append(scaled)
+            if len(buffer) < sequence_length:
+                future.set_result(None)
+                self.latencies.append(time.perf_counter() - arrival)
+                continue
+            # Copy the window now, a later row of the same batch may move the buffer
+            requests, windows, group_indexes = pending.setdefault(forward, ([], [], []))
+            requests.append((arrival, key, future))
+            windows.append(np.array(buffer))
+            group_indexes.append(group_index)
+
+        for forward, (requests, windows, group_indexes) in pending.items():
+            inputs = np.array(windows, dtype=np.float32)
+            if group_indexes[0] is not None:
+                inputs = [inputs, np.array(group_indexes, dtype=np.int32)]
+            predictions = forward(inputs).numpy()[:, 0]
+
+            for (arrival, key, future), prediction in zip(requests, predictions):
+                _, _, scale_min, scale = self.model_set.groups[key]
+                # Undo the MinMax scaling of throughput, the first feature
+                future.set_result(float((prediction - scale_min[0]) / scale[0]))
+                self.latencies.append(time.perf_counter() - arrival)
+
+    def report_latency(self):
+        if not self.latencies:
+            return
+        latencies = np.array(self.latencies) * 1000
+        print(f"Latency over the last {len(latencies)} requests: p50 {np.percentile(latencies, 50):.2f} ms, "
+              f"p95 {np.percentile(latencies, 95):.2f} ms, max {latencies.max():.2f} ms")
+
+
+# Follow a feature CSV written by preprocessing/streaming.py --output (CsvSink)
+# and predict each new row as it is appended, printing the prediction and its
+# latency. Rows carry their Switch ID; files without that column take it from
+# the file name.
+def tail_feature_file(service, path, poll_interval=0.2, from_start=False):
+    switch_id = switch_id_from_filename(path)
+    with open(path, newline='') as f:
+        header = next(csv.reader([f.readline()]))
+        if not from_start:
+            f.seek(0, os.SEEK_END)
+        pending = ''
+        while True:
+            line = f.readline()
+            if not line:
+                time.sleep(poll_interval)
+                continue
+            pending += line
+            if not pending.endswith('\n'):
+                continue  # Row still being written
+            row = dict(zip(header, next(csv.reader([pending]))))
+            pending = ''
+            if not row.get('Source Port') or not row.get('Destination Port'):
+                continue  # Windows without ports do not belong to any group
+            key = (row.get('Switch ID', switch_id), row['Source Port'], row['Destination Port'], row['Protocol'])
+            start = time.perf_counter()
+            prediction = service.submit(key, row).result()
+            if prediction is not None:
+                latency = (time.perf_counter() - start) * 1000
+                print(f"{'|'.join(str(part) for part in key)} @ {row['Timestamp']}: "
+                      f"next throughput {prediction:.1f} Bps ({latency:.2f} ms)")
+
+
+# One JSON object per line in, one per line out. Requests carry the group
+# ('Switch ID', 'Source Port', 'Destination Port', 'Protocol') and the model
+# features of the window; replies carry the prediction and the latency.
+class PredictionHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            start = time.perf_counter()
+            try:
+                row = json.loads(line)
+                key = (row['Switch ID'], row['Source Port'], row['Destination Port'], row['Protocol'])
+                reply = {'prediction': self.server.service.submit(key, row).result()}
+            except Exception as e:
+                reply = {'error': str(e)}
+            reply['latency_ms'] = (time.perf_counter() - start) * 1000
+            self.wfile.write((json.dumps(reply) + '\n').encode())
+
+
+class PredictionServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, service, host='127.0.0.1', port=DEFAULT_PORT):
+        super().__init__((host, port), PredictionHandler)
+        self.service = service
+
+
+if __name__ == "__main__":
+    current_dir = os.path.dirname(__file__)
+    parser = argparse.ArgumentParser(description="Serve throughput predictions from saved LSTM models")
+    parser.add_argument('--models', default=os.path.join(current_dir, '..', 'models'),
+                        help="Folder of saved models (default: ../models)")
+    parser.add_argument('--tail', help="Feature CSV to follow, predicting every appended row")
+    parser.add_argument('--from-start', action='store_true', help="With --tail, also predict the rows already in the file")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help="Local port to serve JSON line requests on")
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH, help="Most requests answered by one forward pass")
+    parser.add_argument('--max-delay', type=float, default=MAX_BATCH_DELAY * 1000,
+                        help="Milliseconds a request may wait for others to batch with (default: 5)")
+    args = parser.parse_args()
+
+    service = InferenceService(ModelSet(args.models), args.max_batch, args.max_delay / 1000).start()
+    try:
+        if args.tail:
+            tail_feature_file(service, args.tail, from_start=args.from_start)
+        else:
+            with PredictionServer(service, port=args.port) as server:
+                print(f"Serving predictions on 127.0.0.1:{args.port}")
+                server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.report_latency()
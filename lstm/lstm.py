@@ -1,42 +1,86 @@
-import pandas as pd
-import numpy as np
-import tensorflow as tf
-import keras_tuner as kt
+import argparse
+import functools
+import json
 import os
-import re
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import LSTM, Dense, Dropout
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.model_selection import train_test_split
-from sklearn.model_selection import TimeSeriesSplit
-from tensorflow.keras.layers import Bidirectional
-from tensorflow.keras.regularizers import l2
-from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.layers import BatchNormalization
-import matplotlib.pyplot as plt
+import sys
+
+import numpy as np
+import pandas as pd
+
+# TensorFlow, Keras Tuner, scikit-learn and matplotlib are imported by the
+# functions that need them, so loading data or plotting does not pay for them
+
+from baselines import BASELINES, evaluate_baselines
+from feature_store import FEATURE_FILE_EXTENSIONS, GROUP_COLUMNS, FeatureStore, load_feature_file, warn_if_stale
+from registry import ModelRegistry
+from scheduler import ResultWriter, train_groups_parallel
+from sequences import make_sequences, make_window_dataset, split_train_test
+from stream_loader import DEFAULT_CHUNK_ROWS, DEFAULT_SHUFFLE_BUFFER, StreamingWindows
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from instrumentation import metrics
+
+# Features fed to the model; throughput (the first one) is predicted
+SELECTED_FEATURES = ['Throughput (Bps)', 'Jitter (s)', 'Delay (s)', 'Avg Packet Size (bytes)', 'Packet Count']
+# Features a model can forecast, by their command line name; throughput is always the first target
+TARGETS = {'throughput': 'Throughput (Bps)', 'jitter': 'Jitter (s)', 'delay': 'Delay (s)',
+           'packet_size': 'Avg Packet Size (bytes)', 'packet_count': 'Packet Count'}
+DEFAULT_TARGETS = [SELECTED_FEATURES[0]]
 
 # Loading and preprocessing data
 def load_and_preprocess_data(folder_path):
     all_data = []
     for file in os.listdir(folder_path):
-        if file.endswith(".csv"):
-            # Extract Switch ID from filename
-            match = re.search(r'_(s\d+)-([a-z0-9]+)', file)
-            if match:
-                switch_id = match.group(1)
-            else:
-                switch_id = "unknown"
-
-            # Load CSV data
-            df = pd.read_csv(os.path.join(folder_path, file))
-            df = df[['Timestamp', 'Throughput (Bps)', 'Source Port', 'Destination Port', 'Protocol', 'Jitter (s)', 'Avg Packet Size (bytes)', 'Packet Count', 'Protocol Distribution', 'Delay (s)']]
-            df.dropna(inplace=True)
-            df['Timestamp'] = pd.to_datetime(df['Timestamp'])
-            df.sort_values('Timestamp', inplace=True)
-            df['Switch ID'] = switch_id
-            all_data.append(df)
-
-    return pd.concat(all_data, ignore_index=True) if all_data else pd.DataFrame()
+        if file.endswith(FEATURE_FILE_EXTENSIONS):
+            with metrics.timer('load.file'):
+                all_data.append(load_feature_file(os.path.join(folder_path, file)))
+            metrics.count('load.files')
+
+    with metrics.timer('load.concat'):
+        return pd.concat(all_data, ignore_index=True) if all_data else pd.DataFrame()
+
+# Yield ((switch, source port, dest port, protocol), rows) for every group.
+# With a feature store only the rows of one group are in memory at a time, and
+# groups too small to train on are skipped without being read.
+def iter_groups(data_folder, feature_store=None, groups=None, min_rows=0):
+    if feature_store is None:
+        df = load_and_preprocess_data(data_folder)
+        for key, group in metrics.timed('load.groupby', df.groupby(GROUP_COLUMNS, observed=True)):
+            if groups is None or key in groups:
+                yield key, group
+        return
+
+    store = FeatureStore(feature_store)
+    for key, rows in store.groups():
+        if groups is not None and key not in groups:
+            continue
+        if rows < min_rows:
+            print(f"Skipping ({', '.join(str(part) for part in key)}) - Not enough data to generate sequences")
+            continue
+        with metrics.timer('load.group'):
+            group = store.load_group(key)
+        yield key, group
+
+# (key, row count, source) of every group large enough to train on, where source
+# is either the group's rows or the feature store folder to read them from.
+# Used by the parallel scheduler, which needs every group's size up front.
+def group_jobs(data_folder, feature_store=None, groups=None, min_rows=0):
+    if feature_store is None:
+        df = load_and_preprocess_data(data_folder)
+        entries = [(key, len(group), group[['Timestamp'] + SELECTED_FEATURES])
+                   for key, group in df.groupby(GROUP_COLUMNS, observed=True)]
+    else:
+        entries = [(key, rows, feature_store) for key, rows in FeatureStore(feature_store).groups()]
+
+    jobs = []
+    for key, rows, source in entries:
+        if groups is not None and key not in groups:
+            continue
+        if rows < min_rows:
+            print(f"Skipping ({', '.join(str(part) for part in key)}) - Not enough data to generate sequences")
+            continue
+        jobs.append((key, rows, source))
+    return jobs
 
 # Step decay function to reduce learning rate every 10 epochs
 def step_decay(epoch, lr):
@@ -45,7 +89,12 @@ def step_decay(epoch, lr):
     return lr
 
 # Bidirectional LSTM model definition
-def build_lstm_model_bidirectional(input_shape):
+def build_lstm_model_bidirectional(input_shape, outputs=1):
+    from tensorflow.keras.layers import LSTM, Bidirectional, Dense, Dropout
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.optimizers import Adam
+    from tensorflow.keras.regularizers import l2
+
     model = Sequential([
         Bidirectional(LSTM(128, return_sequences=True), input_shape=input_shape),
         Dropout(0.1),
@@ -54,14 +103,18 @@ def build_lstm_model_bidirectional(input_shape):
         Bidirectional(LSTM(32, return_sequences=False)),
         Dropout(0.1),
         Dense(16, activation='relu', kernel_regularizer=l2(0.01)),
-        Dense(1)
+        Dense(outputs)
     ])
     optimizer = Adam(learning_rate=0.01, beta_1=0.9, beta_2=0.99, epsilon=1e-8)
     model.compile(optimizer=optimizer, loss='mse')
     return model
 
 # Classic LSTM model
-def build_lstm_model_classic(input_shape):
+def build_lstm_model_classic(input_shape, outputs=1):
+    from tensorflow.keras.layers import LSTM, BatchNormalization, Dense, Dropout
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.optimizers import Adam
+
     model = Sequential([
         LSTM(128, return_sequences=True, input_shape=input_shape),
         BatchNormalization(),
@@ -73,145 +126,769 @@ def build_lstm_model_classic(input_shape):
         BatchNormalization(),
         Dense(16, activation='relu'),
         BatchNormalization(),
-        Dense(1)
+        Dense(outputs)
     ])
     optimizer = Adam(learning_rate=0.005)
     model.compile(optimizer=optimizer, loss='mse')
     return model
 
+# Classic LSTM model shared by all groups: the group index goes through an
+# embedding that is joined to the LSTM summary of the sequence, so a single
+# network learns every group while still telling them apart
+def build_lstm_model_shared(input_shape, n_groups, embedding_dim=8, outputs=1):
+    from tensorflow.keras.layers import (LSTM, BatchNormalization, Concatenate, Dense, Dropout, Embedding, Flatten,
+                                         Input)
+    from tensorflow.keras.models import Model
+    from tensorflow.keras.optimizers import Adam
+
+    sequence_input = Input(shape=input_shape)
+    group_input = Input(shape=(1,), dtype='int32')
+
+    x = LSTM(128, return_sequences=True)(sequence_input)
+    x = BatchNormalization()(x)
+    x = Dropout(0.1)(x)
+    x = LSTM(64, return_sequences=True)(x)
+    x = BatchNormalization()(x)
+    x = Dropout(0.1)(x)
+    x = LSTM(32, return_sequences=False)(x)
+    x = BatchNormalization()(x)
+
+    group_embedding = Flatten()(Embedding(n_groups, embedding_dim)(group_input))
+    x = Concatenate()([x, group_embedding])
+    x = Dense(16, activation='relu')(x)
+    x = BatchNormalization()(x)
+    output = Dense(outputs)(x)
+
+    model = Model([sequence_input, group_input], output)
+    optimizer = Adam(learning_rate=0.005)
+    model.compile(optimizer=optimizer, loss='mse')
+    return model
+
 # Simpler bidirectional model
-def build_bidirectional_lstm_model(input_shape):
+def build_bidirectional_lstm_model(input_shape, outputs=1):
+    from tensorflow.keras.layers import LSTM, Bidirectional, Dense, Dropout
+    from tensorflow.keras.models import Sequential
+
     model = Sequential([
         Bidirectional(LSTM(128, return_sequences=True), input_shape=input_shape),
         Dropout(0.2),
         Bidirectional(LSTM(64, return_sequences=False)),
         Dropout(0.2),
         Dense(32, activation='relu'),
-        Dense(1)
+        Dense(outputs)
     ])
     model.compile(optimizer='adam', loss='mse')
     return model
 
-# Hyperparameter tuning model builder
-def build_model_hp(hp):
-    model = Sequential([
-        LSTM(hp.Int('units', min_value=32, max_value=128, step=16), return_sequences=True, input_shape=(10, 1)),
-        Dropout(hp.Float('dropout_rate', min_value=0.1, max_value=0.4, step=0.1)),
-        LSTM(hp.Int('units', min_value=16, max_value=64, step=16)),
-        Dropout(hp.Float('dropout_rate', min_value=0.1, max_value=0.4, step=0.1)),
-        Dense(32, activation='relu'),
-        Dense(1)
-    ])
-    model.compile(optimizer=hp.Choice('optimizer', values=['adam', 'rmsprop']),
-                  loss='mse')
+# Hyperparameter tuning model builder, searched by tuning.py: the architecture
+# (the classic, simpler bidirectional and stacked bidirectional models above),
+# the width of the first LSTM layer (later layers halve it), dropout and learning rate
+ARCHITECTURES = ['classic', 'bidirectional', 'stacked_bidirectional']
+
+def build_model_hp(hp, input_shape=(5, len(SELECTED_FEATURES)), outputs=1):
+    from tensorflow.keras.layers import LSTM, BatchNormalization, Bidirectional, Dense, Dropout, Input
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.optimizers import Adam
+    from tensorflow.keras.regularizers import l2
+
+    architecture = hp.Choice('architecture', ARCHITECTURES)
+    units = hp.Int('units', min_value=32, max_value=128, step=16)
+    dropout_rate = hp.Float('dropout_rate', min_value=0.1, max_value=0.4, step=0.1)
+    learning_rate = hp.Float('learning_rate', min_value=1e-4, max_value=1e-2, sampling='log')
+
+    layers = [Input(shape=input_shape)]
+    if architecture == 'classic':
+        layers += [LSTM(units, return_sequences=True), BatchNormalization(), Dropout(dropout_rate),
+                   LSTM(units // 2, return_sequences=True), BatchNormalization(), Dropout(dropout_rate),
+                   LSTM(units // 4, return_sequences=False), BatchNormalization(),
+                   Dense(16, activation='relu'), BatchNormalization()]
+    elif architecture == 'bidirectional':
+        layers += [Bidirectional(LSTM(units, return_sequences=True)), Dropout(dropout_rate),
+                   Bidirectional(LSTM(units // 2, return_sequences=False)), Dropout(dropout_rate),
+                   Dense(32, activation='relu')]
+    else:
+        layers += [Bidirectional(LSTM(units, return_sequences=True)), Dropout(dropout_rate),
+                   Bidirectional(LSTM(units // 2, return_sequences=True)), Dropout(dropout_rate),
+                   Bidirectional(LSTM(units // 4, return_sequences=False)), Dropout(dropout_rate),
+                   Dense(16, activation='relu', kernel_regularizer=l2(0.01))]
+    model = Sequential(layers + [Dense(outputs)])
+    model.compile(optimizer=Adam(learning_rate=learning_rate), loss='mse')
     return model
 
-# Training and evaluation function for each group
-def train_and_evaluate_per_group(data_folder, output_folder, sequence_length=5, epochs=10, batch_size=16):
-    df = load_and_preprocess_data(data_folder)
-    results = {}
-    os.makedirs(output_folder, exist_ok=True)
-    
-    for (switch, source_port, dest_port, protocol), group in df.groupby(['Switch ID', 'Source Port', 'Destination Port', 'Protocol']):
-    #for (switch, source_port, dest_port, protocol), group in df.groupby(['Switch ID', 'Source IP', 'Destination IP', 'Protocol']):
-        min_required_length = sequence_length + 2  # o altro valore minimo
-
-        if len(group) < min_required_length:
-            print(f"Skipping ({switch}, {source_port}, {dest_port}, {protocol}) - Not enough data to generate sequences")
-            continue
-
+# Model with the given hyperparameter values, e.g. the best ones found by tuning.py
+def build_tuned_model(hyperparameters, input_shape, outputs=1):
+    import keras_tuner as kt
+
+    hp = kt.HyperParameters()
+    for name, value in hyperparameters.items():
+        hp.Fixed(name, value)
+    return build_model_hp(hp, input_shape, outputs)
+
+# Per-group model of each architecture name (the same names as in build_model_hp)
+MODEL_BUILDERS = {'classic': build_lstm_model_classic, 'bidirectional': build_bidirectional_lstm_model,
+                  'stacked_bidirectional': build_lstm_model_bidirectional}
+
+# Train and evaluate the model of a single group, returns (y_train, y_test, y_pred).
+# With model_folder the model, its scaler and metadata are saved in that registry.
+# With warm_start the group's model from the registry keeps training, on the
+# windows that arrived after the data it was trained on only, with its original
+# scaler; returns None if there are not enough new windows.
+# architecture: which model of MODEL_BUILDERS to train
+# hyperparameters: values found by tuning.py, used instead of the architecture's fixed model
+# horizon, targets: forecast the next horizon windows of every feature in targets
+#                   (throughput first) in one forward pass, instead of the next throughput
+def train_group(key, group, sequence_length=5, epochs=10, batch_size=16, input_pipeline='numpy', model_folder=None,
+                warm_start=False, hyperparameters=None, architecture='classic', horizon=1, targets=None):
+    import tensorflow as tf
+    from sklearn.preprocessing import MinMaxScaler
+
+    selected_features = SELECTED_FEATURES
+    targets = targets or DEFAULT_TARGETS
+    target_columns = [selected_features.index(target) for target in targets]
+    registry = ModelRegistry(model_folder) if model_folder is not None else None
+    previous = registry.load_group(key) if registry is not None and warm_start else None
+    if previous is not None and (previous[2].get('horizon', 1),
+                                 previous[2].get('targets', DEFAULT_TARGETS)) != (horizon, targets):
+        print(f"Saved model of ({', '.join(str(part) for part in key)}) forecasts other outputs, training a new one")
+        previous = None
+
+    if previous is not None:
+        model, scaler, entry = previous
+        data_start = entry['data_start']
+        seen = group['Timestamp'] <= pd.Timestamp(entry['data_end'])
+        new_rows = int((~seen).sum())
+        # Keep the last sequence_length known rows so the first new window is complete
+        group = pd.concat([group[seen].tail(sequence_length), group[~seen]])
+        if len(group) < sequence_length + horizon + 1:
+            print(f"Model of ({', '.join(str(part) for part in key)}) is up to date ({new_rows} new windows)")
+            return None
+        rows = entry['rows'] + new_rows
+        updates = entry.get('updates', 0) + 1
+        print(f"Updating model of ({', '.join(str(part) for part in key)}) with {new_rows} new windows")
+        with metrics.timer('train.scale'):
+            group_scaled = scaler.transform(group[selected_features].to_numpy())
+    else:
         scaler = MinMaxScaler()
-        selected_features = ['Throughput (Bps)', 'Jitter (s)', 'Delay (s)', 'Avg Packet Size (bytes)', 'Packet Count']
-        group_scaled = scaler.fit_transform(group[selected_features])
-
-        # Create sequences
-        sequences = []
-        labels = []
-        for i in range(len(group_scaled) - sequence_length):
-            sequences.append(group_scaled[i:i + sequence_length])
-            labels.append(group_scaled[i + sequence_length][0])  # predict only throughput
-        #to use time series and tuner
-        #split_index = int(0.8 * len(sequences)) 
-        #tscv = TimeSeriesSplit(n_splits=5)
-        #for train_idx, test_idx in tscv.split(sequences):
-        #    X_train, X_test = sequences[train_idx], sequences[test_idx]
-        #    y_train, y_test = labels[train_idx], labels[test_idx]
-        
-        #time_train = group.iloc[train_idx[0]:train_idx[-1]+1]['Timestamp']
-        #time_test = group.iloc[test_idx[0]:test_idx[-1]+1]['Timestamp']
-
-        #tuner = kt.Hyperband(
-        #    build_model_hp,
-        #    objective='val_loss',
-        #    max_epochs=20,
-        #    hyperband_iterations=4,
-        #    directory='my_dir',
-        #    project_name='lstm_tuning'
-        #)
-
-        #tuner.search(X_train, y_train, epochs=10, validation_data=(X_test, y_test))
-
-        #best_model = tuner.get_best_models(num_models=1)[0]
-
-        #best_model.fit(X_train, y_train, epochs=10, validation_data=(X_test, y_test))
-
-        #y_pred_best = best_model.predict(X_test)
-
-        # Convert to NumPy arrays and split into train/test (80/20)
-        sequences = np.array(sequences)
-        labels = np.array(labels)
-        X_train, X_test, y_train, y_test = train_test_split(sequences, labels, test_size=0.2, random_state=42, shuffle=False)
-
-        # Build and train the model
-        model = build_lstm_model_classic((sequence_length, len(selected_features)))
-        lr_callback = tf.keras.callbacks.LearningRateScheduler(step_decay)
-
-        model.fit(X_train, y_train, 
-                epochs=epochs, 
-                batch_size=batch_size, 
-                validation_data=(X_test, y_test),
-                callbacks=[lr_callback])
-
-        y_pred = model.predict(X_test)
+        data_start = group['Timestamp'].min()
+        rows = len(group)
+        updates = 0
+        with metrics.timer('train.scale'):
+            group_scaled = scaler.fit_transform(group[selected_features])
+
+    # Create sequences (strided views of group_scaled), labelled with the next
+    # horizon windows of every column in target_columns (throughput first)
+    with metrics.timer('train.sequences'):
+        sequences, labels = make_sequences(group_scaled, sequence_length, horizon, target_columns)
+    metrics.count('train.groups')
+    metrics.count('train.sequences', len(sequences))
+    # Hyperparameter search with TimeSeriesSplit folds: see tuning.py
+
+    # Split into train/test (80/20)
+    X_train, X_test, y_train, y_test = split_train_test(sequences, labels, test_size=0.2)
+
+    # Build and train the model
+    with metrics.timer('train.build'):
+        if previous is None and hyperparameters is not None:
+            model = build_tuned_model(hyperparameters, (sequence_length, len(selected_features)), labels[0].size)
+        elif previous is None:
+            model = MODEL_BUILDERS[architecture]((sequence_length, len(selected_features)), labels[0].size)
+    lr_callback = tf.keras.callbacks.LearningRateScheduler(step_decay)
+
+    if input_pipeline == 'tf.data':
+        # Windows are gathered batch by batch instead of materialized up front
+        train_data = make_window_dataset(group_scaled, sequence_length, batch_size, end=len(X_train), shuffle=True,
+                                         horizon=horizon, targets=target_columns)
+        test_data = make_window_dataset(group_scaled, sequence_length, batch_size, start=len(X_train),
+                                        horizon=horizon, targets=target_columns)
+        with metrics.timer('train.fit'):
+            history = model.fit(train_data,
+                    epochs=epochs,
+                    validation_data=test_data,
+                    callbacks=[lr_callback])
+        with metrics.timer('train.predict'):
+            y_pred = model.predict(test_data)
+    else:
+        with metrics.timer('train.fit'):
+            history = model.fit(X_train, y_train, 
+                    epochs=epochs, 
+                    batch_size=batch_size, 
+                    validation_data=(X_test, y_test),
+                    callbacks=[lr_callback])
+        with metrics.timer('train.predict'):
+            y_pred = model.predict(X_test)
+
+    if registry is not None:
+        with metrics.timer('registry.save'):
+            registry.save_group(key, model, scaler, sequence_length, selected_features, data_start,
+                                group['Timestamp'].max(), rows, float(history.history['val_loss'][-1]), updates,
+                                horizon, targets)
+
+    return y_train, y_test, y_pred
+
+# (real, predicted) column names of the outputs of a model: 'Real' and 'Predicted'
+# for the next throughput alone, else one pair per step and target, in output order
+def result_columns(horizon=1, targets=None):
+    targets = targets or DEFAULT_TARGETS
+    if horizon == 1 and targets == DEFAULT_TARGETS:
+        return [('Real', 'Predicted')]
+    return [(f'Real {target} t+{step}', f'Predicted {target} t+{step}')
+            for step in range(1, horizon + 1) for target in targets]
+
+# Labels or predictions as one column per output
+def output_columns(y):
+    return y if y.ndim == 2 else y.reshape(-1, 1)
+
+# Save the predictions CSV and the plot (next throughput) of a single group
+def save_group_results(output_folder, key, y_train, y_test, y_pred, horizon=1, targets=None):
+    switch, source_port, dest_port, protocol = key
+
+    # Save predictions to CSV
+    output_file = os.path.join(output_folder, f'prediction_{switch}_{source_port}_{dest_port}_{protocol}.csv')
+    y_test, y_pred = output_columns(y_test), output_columns(y_pred)
+    columns = {}
+    for i, (real, predicted) in enumerate(result_columns(horizon, targets)):
+        columns[real] = y_test[:, i]
+        columns[predicted] = y_pred[:, i]
+    pd.DataFrame(columns).to_csv(output_file, index=False)
+
+    plot_group_results(output_folder, key, output_columns(y_train)[:, 0], y_test[:, 0], y_pred[:, 0])
+
+# Error of every group on each output (step and target), on scaled values,
+# written to errors.csv with the mean over all groups printed per model and output.
+# baseline_results adds the errors of the baselines (see run_baselines), and
+# the groups of picks, predicted by a baseline, have no LSTM errors.
+def save_errors(output_folder, results, horizon=1, targets=None, baseline_results=None, picks=None):
+    targets = targets or DEFAULT_TARGETS
+    outputs = [(step, target) for step in range(1, horizon + 1) for target in targets]
+    predictions = [('lstm', key, y_test, y_pred) for key, (y_test, y_pred) in results.items()
+                   if key not in (picks or {})]
+    for key, (y_test, baseline_predictions) in (baseline_results or {}).items():
+        predictions += [(name, key, y_test, y_pred) for name, y_pred in baseline_predictions.items()]
+    rows = []
+    for model, key, y_test, y_pred in predictions:
+        errors = output_columns(y_pred) - output_columns(y_test)
+        for i, (step, target) in enumerate(outputs):
+            rows.append(dict(zip(GROUP_COLUMNS, key), **{'Model': model, 'Target': target, 'Step': step,
+                        'MAE': np.abs(errors[:, i]).mean(), 'RMSE': np.sqrt(np.square(errors[:, i]).mean())}))
+    if not rows:
+        return
+    errors = pd.DataFrame(rows)
+    errors.to_csv(os.path.join(output_folder, 'errors.csv'), index=False)
+    summary = errors.groupby(['Model', 'Target', 'Step'], sort=False)[['MAE', 'RMSE']].agg('mean')
+    summary['Groups'] = errors.groupby(['Model', 'Target', 'Step'], sort=False).size()
+    print(f"Mean error per group:\n{summary.to_string(float_format='{:.4f}'.format)}")
+
+# Forecasts of the baselines of baselines.py for every group of grouped
+# ((key, rows) pairs) at once, on the same scaled values and test sequences
+# as the LSTM: {key: (y_test, {baseline: y_pred})}
+def run_baselines(grouped, sequence_length=5, horizon=1, targets=None):
+    targets = targets or DEFAULT_TARGETS
+    keys, series = [], []
+    for key, group in grouped:
+        if len(group) < sequence_length + horizon + 1:
+            continue
+        values = group[targets].to_numpy(dtype=float)
+        # Min-max scaling of each column, as the group's MinMaxScaler does
+        low, high = values.min(axis=0), values.max(axis=0)
+        series.append((values - low) / np.where(high > low, high - low, 1))
+        keys.append(key)
+    if not keys:
+        return {}
+    with metrics.timer('baselines'):
+        y_test, predictions = evaluate_baselines(series, sequence_length, horizon)
+    print(f"Evaluated {len(BASELINES)} baselines on {len(keys)} groups")
+    return {key: (y_test[i], {name: predictions[name][i] for name in BASELINES}) for i, key in enumerate(keys)}
+
+# Best baseline of every group whose mean absolute error over all outputs is at most max_mae
+def baseline_picks(baseline_results, max_mae):
+    picks = {}
+    for key, (y_test, predictions) in baseline_results.items():
+        errors = {name: np.abs(y_pred - y_test).mean() for name, y_pred in predictions.items()}
+        best = min(errors, key=errors.get)
+        if errors[best] <= max_mae:
+            picks[key] = best
+    return picks
+
+# Plot the real and predicted throughput of a single group.
+# Uses a standalone Figure rather than pyplot so it can run on a writer thread.
+def plot_group_results(output_folder, key, y_train, y_test, y_pred):
+    from matplotlib.figure import Figure
+
+    switch, source_port, dest_port, protocol = key
+
+    # Create a coherent time axis
+    time_train = range(len(y_train)) # Indexes for training
+    time_test = range(len(y_train), len(y_train) + len(y_test))  # Indexes for test/prediction
+
+    # Plot results
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+
+    ax.plot(time_train, y_train.flatten(), label='Real Throughput (Train)', linestyle='dashed', color='blue')
+    ax.plot(time_test, y_test.flatten(), label='Real Throughput (Test)', linestyle='dashed', color='green')
+
+    ax.plot(time_test, y_pred.flatten(), label='Predicted Throughput', color='red')
+
+    ax.axvline(x=len(y_train), color='r', linestyle='--', label='Prediction Start')
+
+    ax.set_title(f'Switch: {switch}, Source Port: {source_port}, Destination Port: {dest_port}, Protocol: {protocol}')
+    ax.legend()
+
+    output_path = os.path.join(output_folder, f'plot_{switch}_{source_port}_{dest_port}_{protocol}.png')
+    print(f"Saving plot to: {output_path}")
+
+    fig.savefig(output_path)
+
+# Plot again every prediction CSV of a results folder, without training
+def plot_results_folder(results_folder):
+    count = 0
+    for file in sorted(os.listdir(results_folder)):
+        if not (file.startswith('prediction_') and file.endswith('.csv')):
+            continue
+        key = file[len('prediction_'):-len('.csv')].split('_')
+        if len(key) != 4:
+            print(f"Skipping {file} - not a prediction file of a group")
+            continue
+        predictions = pd.read_csv(os.path.join(results_folder, file))
+        # Multi-step files: plot the first output, the next throughput
+        real = next(column for column in predictions.columns if column.startswith('Real'))
+        plot_group_results(results_folder, key, np.empty(0), predictions[real].to_numpy(),
+                           predictions['Predicted' + real[len('Real'):]].to_numpy())
+        count += 1
+    return count
+
+# Predict every window of the groups that have a model in the registry (their own
+# model, else the shared one), with the scaler and sequence length saved with it,
+# and write the same prediction CSVs and plots as training. Nothing is trained.
+def predict_with_saved_models(data_folder, model_folder, output_folder, feature_store=None, groups=None,
+                              batch_size=512):
+    import tensorflow as tf
+
+    from registry import restore_scaler
 
-        results[(switch, source_port, dest_port, protocol)] = (y_test, y_pred)
+    os.makedirs(output_folder, exist_ok=True)
+    registry = ModelRegistry(model_folder)
+    entries = {}  # key -> (registry entry, group index)
+    for _, entry in registry.entries():
+        for index, key in enumerate(entry['keys']):
+            key = tuple(key)
+            if key not in entries or entries[key][0].get('shared', False):
+                entries[key] = (entry, index)
+    if not entries:
+        print(f"No saved models in '{model_folder}'")
+        return {}
+
+    # Each model's CSV columns follow the outputs it was trained to forecast
+    def save(output_folder, key, y_train, y_test, y_pred):
+        entry = entries[key][0]
+        save_group_results(output_folder, key, y_train, y_test, y_pred, entry.get('horizon', 1), entry.get('targets'))
+
+    models = {}
+    results = {}
+    with ResultWriter(output_folder, save) as writer:
+        for key, group in iter_groups(data_folder, feature_store, groups):
+            match = entries.get(key)
+            if match is None:
+                continue
+            entry, index = match
+            horizon = entry.get('horizon', 1)
+            if len(group) < entry['sequence_length'] + horizon:
+                print(f"Skipping ({', '.join(str(part) for part in key)}) - Not enough data to generate sequences")
+                continue
+            if entry['model'] not in models:
+                models[entry['model']] = tf.keras.models.load_model(registry.model_path(entry), compile=False)
+            model = models[entry['model']]
+
+            with metrics.timer('train.scale'):
+                group_scaled = restore_scaler(entry['scalers'][index]).transform(group[entry['features']].to_numpy())
+            target_columns = [entry['features'].index(target) for target in entry.get('targets', entry['features'][:1])]
+            sequences, labels = make_sequences(group_scaled, entry['sequence_length'], horizon, target_columns)
+            inputs = [sequences, np.full(len(sequences), index)] if entry.get('shared', False) else sequences
+            with metrics.timer('train.predict'):
+                y_pred = model.predict(inputs, batch_size=batch_size, verbose=0)
+            results[key] = (labels, y_pred)
+            writer.submit(key, labels[:0], labels, y_pred)
+    print(f"Predicted {len(results)} groups with the models in '{model_folder}'")
+    return results
 
-        # Save predictions to CSV
-        output_file = os.path.join(output_folder, f'prediction_{switch}_{source_port}_{dest_port}_{protocol}.csv')
-        pd.DataFrame({'Real': y_test.flatten(), 'Predicted': y_pred.flatten()}).to_csv(output_file, index=False)
+# Print what a feature folder or feature store holds: rows, time range and the
+# largest groups. Needs only pandas.
+def describe_data(data_folder, feature_store=None, top=10):
+    if feature_store is not None:
+        group_rows = dict(FeatureStore(feature_store).groups())
+        print(f"Feature store '{feature_store}': {sum(group_rows.values())} rows in {len(group_rows)} groups")
+    else:
+        df = load_and_preprocess_data(data_folder)
+        if df.empty:
+            print(f"No feature files in '{data_folder}'")
+            return
+        group_rows = df.groupby(GROUP_COLUMNS, observed=True).size().to_dict()
+        print(f"'{data_folder}': {len(df)} rows in {len(group_rows)} groups, "
+              f"{df['Switch ID'].nunique()} switches, from {df['Timestamp'].min()} to {df['Timestamp'].max()}")
+    for key, rows in sorted(group_rows.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"  ({', '.join(str(part) for part in key)}): {rows} rows")
 
-        # Create a coherent time axis
-        time_train = range(len(y_train)) # Indexes for training
-        time_test = range(len(y_train), len(y_train) + len(y_test))  # Indexes for test/prediction
+# Training and evaluation function for each group
+# feature_store: folder of a FeatureStore built from data_folder, read group by group
+# groups: optional list of (switch, source port, dest port, protocol) keys to train
+# input_pipeline: 'numpy' fits on in-memory arrays, 'tf.data' builds windows on the fly
+# workers: train that many groups at once on a process pool (see scheduler.py),
+#          each worker limited to threads_per_worker TensorFlow threads
+# model_folder: model registry (see registry.py) where every trained model, its scaler and
+#               metadata are saved, to serve them with inference.py
+# warm_start: continue training the registry's model of each group on its new windows only
+# hyperparameters: dict of values found by tuning.py (its best_hyperparameters.json)
+# architecture: per-group model of MODEL_BUILDERS, 'classic' by default
+# horizon, targets: forecast the next horizon windows of every feature in targets
+#                   (throughput first) at once; errors.csv then has one row per step
+# baselines: also evaluate the baselines of baselines.py on every group, reported in errors.csv
+# skip_lstm_mae: groups whose best baseline has at most this mean absolute error
+#                (scaled) are predicted by that baseline, without training an LSTM
+# The baselines are scored on the whole series of every group, so neither
+# option is meant for warm_start, where the LSTM only sees the new windows.
+def train_and_evaluate_per_group(data_folder, output_folder, sequence_length=5, epochs=10, batch_size=16,
+                                 feature_store=None, groups=None, input_pipeline='numpy',
+                                 workers=1, threads_per_worker=None, model_folder=None, warm_start=False,
+                                 hyperparameters=None, architecture='classic', horizon=1, targets=None,
+                                 baselines=False, skip_lstm_mae=None):
+    os.makedirs(output_folder, exist_ok=True)
+    min_required_length = sequence_length + horizon + 1  # o altro valore minimo
+    train_options = {'sequence_length': sequence_length, 'epochs': epochs, 'batch_size': batch_size,
+                     'input_pipeline': input_pipeline, 'model_folder': model_folder, 'warm_start': warm_start,
+                     'hyperparameters': hyperparameters, 'architecture': architecture, 'horizon': horizon,
+                     'targets': targets}
+    save = functools.partial(save_group_results, horizon=horizon, targets=targets)
 
-        # Plot results
-        plt.figure(figsize=(10, 5))
+    results = {}
+    baseline_results, picks, loaded = {}, {}, None
+    if baselines or skip_lstm_mae is not None:
+        grouped = iter_groups(data_folder, feature_store, groups, min_required_length)
+        if feature_store is None:
+            # The whole folder is in memory anyway: group it once for the baselines and the LSTMs
+            grouped = loaded = list(grouped)
+        baseline_results = run_baselines(grouped, sequence_length, horizon, targets)
+    if skip_lstm_mae is not None:
+        picks = baseline_picks(baseline_results, skip_lstm_mae)
+        print(f"{len(picks)} groups predicted by a baseline (MAE <= {skip_lstm_mae}), "
+              f"{len(baseline_results) - len(picks)} left for the LSTM")
+        with ResultWriter(output_folder, save) as writer:
+            for key, name in picks.items():
+                y_test, predictions = baseline_results[key]
+                results[key] = (y_test, predictions[name])
+                writer.submit(key, y_test[:0], y_test, predictions[name])
+
+    if workers > 1:
+        if loaded is not None:
+            jobs = [(key, len(group), group[['Timestamp'] + SELECTED_FEATURES]) for key, group in loaded
+                    if len(group) >= min_required_length]
+        else:
+            jobs = group_jobs(data_folder, feature_store, groups, min_required_length)
+        jobs = [job for job in jobs if job[0] not in picks]
+        results.update(train_groups_parallel(jobs, train_group, save, output_folder, workers, threads_per_worker, **train_options))
+        save_errors(output_folder, results, horizon, targets, baseline_results, picks)
+        return results
+
+    # Plots and CSVs are written in the background while the next group trains
+    with ResultWriter(output_folder, save) as writer:
+        if loaded is None:
+            loaded = iter_groups(data_folder, feature_store, groups, min_required_length)
+        for (switch, source_port, dest_port, protocol), group in loaded:
+        #for (switch, source_port, dest_port, protocol), group in df.groupby(['Switch ID', 'Source IP', 'Destination IP', 'Protocol']):
+
+            if len(group) < min_required_length:
+                print(f"Skipping ({switch}, {source_port}, {dest_port}, {protocol}) - Not enough data to generate sequences")
+                continue
+
+            key = (switch, source_port, dest_port, protocol)
+            if key in picks:
+                continue
+            result = train_group(key, group, **train_options)
+            if result is None:
+                continue
+            y_train, y_test, y_pred = result
+            results[key] = (y_test, y_pred)
+            writer.submit(key, y_train, y_test, y_pred)
+
+    save_errors(output_folder, results, horizon, targets, baseline_results, picks)
+    return results
 
-        plt.plot(time_train, y_train.flatten(), label='Real Throughput (Train)', linestyle='dashed', color='blue')
-        plt.plot(time_test, y_test.flatten(), label='Real Throughput (Test)', linestyle='dashed', color='green')
+# Train one shared model over every group at once instead of one model per group.
+# Each group keeps its own MinMaxScaler and 80/20 split; the train sets are
+# stacked with the group index as a second input and fitted in large batches.
+# fine_tune_epochs > 0 then continues training a copy of the shared model on
+# each group alone before predicting it. Returns the same results dict and
+# writes the same CSVs and plots as train_and_evaluate_per_group; with
+# model_folder the shared model (not the fine-tuned copies) and the scalers are saved.
+def train_and_evaluate_shared(data_folder, output_folder, sequence_length=5, epochs=10, batch_size=512,
+                              feature_store=None, groups=None, fine_tune_epochs=0, embedding_dim=8,
+                              model_folder=None, horizon=1, targets=None):
+    import tensorflow as tf
+    from sklearn.preprocessing import MinMaxScaler
+    from tensorflow.keras.models import clone_model
+    from tensorflow.keras.optimizers import Adam
 
-        plt.plot(time_test, y_pred.flatten(), label='Predicted Throughput', color='red')
+    os.makedirs(output_folder, exist_ok=True)
+    min_required_length = sequence_length + horizon + 1
+    target_columns = [SELECTED_FEATURES.index(target) for target in targets or DEFAULT_TARGETS]
 
-        plt.axvline(x=len(y_train), color='r', linestyle='--', label='Prediction Start')
+    keys, scalers, splits, time_ranges, lengths = [], [], [], [], []
+    for key, group in iter_groups(data_folder, feature_store, groups, min_required_length):
+        if len(group) < min_required_length:
+            print(f"Skipping ({', '.join(str(part) for part in key)}) - Not enough data to generate sequences")
+            continue
+        scaler = MinMaxScaler()
+        with metrics.timer('train.scale'):
+            group_scaled = scaler.fit_transform(group[SELECTED_FEATURES])
+        with metrics.timer('train.sequences'):
+            sequences, labels = make_sequences(group_scaled, sequence_length, horizon, target_columns)
+        metrics.count('train.groups')
+        metrics.count('train.sequences', len(sequences))
+        keys.append(key)
+        scalers.append(scaler)
+        time_ranges.append((group['Timestamp'].min(), group['Timestamp'].max()))
+        lengths.append(len(group))
+        splits.append(split_train_test(sequences, labels, test_size=0.2))
+    if not keys:
+        return {}
+
+    X_train = np.concatenate([split[0] for split in splits])
+    X_test = np.concatenate([split[1] for split in splits])
+    y_train = np.concatenate([split[2] for split in splits])
+    y_test = np.concatenate([split[3] for split in splits])
+    g_train = np.repeat(np.arange(len(keys)), [len(split[0]) for split in splits])
+    g_test = np.repeat(np.arange(len(keys)), [len(split[1]) for split in splits])
+    print(f"Training a shared model on {len(keys)} groups ({len(X_train)} sequences)")
+
+    with metrics.timer('train.build'):
+        model = build_lstm_model_shared((sequence_length, len(SELECTED_FEATURES)), len(keys), embedding_dim,
+                                        y_train[0].size)
+    lr_callback = tf.keras.callbacks.LearningRateScheduler(step_decay)
+    with metrics.timer('train.fit'):
+        history = model.fit([X_train, g_train], y_train,
+                  epochs=epochs,
+                  batch_size=batch_size,
+                  shuffle=True,
+                  validation_data=([X_test, g_test], y_test),
+                  callbacks=[lr_callback])
+    # A single forward pass for the test sequences of every group
+    with metrics.timer('train.predict'):
+        y_pred_all = model.predict([X_test, g_test], batch_size=batch_size)
+    if model_folder is not None:
+        with metrics.timer('registry.save'):
+            ModelRegistry(model_folder).save_shared(keys, model, scalers, sequence_length, SELECTED_FEATURES,
+                                                min(time_ranges)[0], max(end for _, end in time_ranges),
+                                                sum(lengths), float(history.history['val_loss'][-1]),
+                                                horizon, targets)
 
-        plt.title(f'Switch: {switch}, Source Port: {source_port}, Destination Port: {dest_port}, Protocol: {protocol}')
-        plt.legend()
+    results = {}
+    test_offsets = np.cumsum([0] + [len(split[1]) for split in splits])
+    save = functools.partial(save_group_results, horizon=horizon, targets=targets)
+    with ResultWriter(output_folder, save) as writer:
+        for i, key in enumerate(keys):
+            group_X_train, group_X_test, group_y_train, group_y_test = splits[i]
+            y_pred = y_pred_all[test_offsets[i]:test_offsets[i + 1]]
+
+            if fine_tune_epochs > 0 and len(group_X_test) > 0:
+                tuned = clone_model(model)
+                tuned.set_weights(model.get_weights())
+                tuned.compile(optimizer=Adam(learning_rate=0.001), loss='mse')
+                group_ids = np.full(len(group_X_train), i)
+                with metrics.timer('train.fine_tune'):
+                    tuned.fit([group_X_train, group_ids], group_y_train, epochs=fine_tune_epochs, batch_size=16)
+                with metrics.timer('train.predict'):
+                    y_pred = tuned.predict([group_X_test, np.full(len(group_X_test), i)])
+
+            results[key] = (group_y_test, y_pred)
+            writer.submit(key, group_y_train, group_y_test, y_pred)
+
+    save_errors(output_folder, results, horizon, targets)
+    return results
 
-        output_path = os.path.join(output_folder, f'plot_{switch}_{source_port}_{dest_port}_{protocol}.png')
-        print(f"Saving plot to: {output_path}")
+# train_and_evaluate_shared for feature folders larger than memory: the sequences
+# are streamed from the feature files in chunks (see stream_loader.py) instead
+# of being loaded together, and shuffled within a buffer of shuffle_buffer
+# sequences. Writes the same results and registry entry; only the labels and
+# predictions (one value per sequence) are kept in memory. Per-group
+# fine-tuning is not available, as it would read the whole dataset per group.
+def train_and_evaluate_shared_streaming(data_folder, output_folder, sequence_length=5, epochs=10, batch_size=512,
+                                        groups=None, embedding_dim=8, model_folder=None,
+                                        chunk_rows=DEFAULT_CHUNK_ROWS, shuffle_buffer=DEFAULT_SHUFFLE_BUFFER,
+                                        horizon=1, targets=None):
+    import tensorflow as tf
 
-        plt.savefig(output_path)
-        plt.close()
+    os.makedirs(output_folder, exist_ok=True)
+    target_columns = [SELECTED_FEATURES.index(target) for target in targets or DEFAULT_TARGETS]
+    stream = StreamingWindows(data_folder, sequence_length, SELECTED_FEATURES, chunk_rows, groups=groups,
+                              min_rows=sequence_length + horizon + 1, horizon=horizon, targets=target_columns)
+    keys = stream.keys
+    if not keys:
+        return {}
+    metrics.count('train.groups', len(keys))
+    print(f"Training a shared model on {len(keys)} groups ({int(stream.train_sequences.sum())} sequences, "
+          f"streamed from {len(stream.files)} files)")
+
+    with metrics.timer('train.build'):
+        model = build_lstm_model_shared((sequence_length, len(SELECTED_FEATURES)), len(keys), embedding_dim,
+                                        stream.outputs)
+    lr_callback = tf.keras.callbacks.LearningRateScheduler(step_decay)
+    with metrics.timer('train.fit'):
+        history = model.fit(stream.dataset(batch_size, train=True, shuffle_buffer=shuffle_buffer),
+                  epochs=epochs,
+                  validation_data=stream.dataset(batch_size, train=False),
+                  callbacks=[lr_callback])
+    if model_folder is not None:
+        with metrics.timer('registry.save'):
+            ModelRegistry(model_folder).save_shared(keys, model, stream.scalers, sequence_length, SELECTED_FEATURES,
+                                                min(start for start, _ in stream.time_ranges),
+                                                max(end for _, end in stream.time_ranges),
+                                                int(stream.rows.sum()), float(history.history['val_loss'][-1]),
+                                                horizon, targets)
+
+    # Last pass: predict the test sequences chunk by chunk and gather every group's labels
+    y_train, y_test, y_pred = ([[] for _ in keys] for _ in range(3))
+    for windows, group_ids, labels, is_train in stream.iter_chunks():
+        predicted = np.full((len(labels), stream.outputs), np.nan, dtype=np.float32)
+        if not is_train.all():
+            with metrics.timer('train.predict'):
+                predicted[~is_train] = model.predict([windows[~is_train], group_ids[~is_train]],
+                                                     batch_size=batch_size, verbose=0)
+        # The sequences of a group are contiguous within a chunk
+        starts = np.flatnonzero(np.diff(group_ids, prepend=-1))
+        for start, end in zip(starts, np.append(starts[1:], len(labels))):
+            i = group_ids[start]
+            train = is_train[start:end]
+            y_train[i].append(labels[start:end][train])
+            y_test[i].append(labels[start:end][~train])
+            y_pred[i].append(predicted[start:end][~train])
 
+    results = {}
+    save = functools.partial(save_group_results, horizon=horizon, targets=targets)
+    with ResultWriter(output_folder, save) as writer:
+        for i, key in enumerate(keys):
+            group_y_test, group_y_pred = np.concatenate(y_test[i]), np.concatenate(y_pred[i])
+            results[key] = (group_y_test, group_y_pred)
+            writer.submit(key, np.concatenate(y_train[i]), group_y_test, group_y_pred)
+
+    save_errors(output_folder, results, horizon, targets)
     return results
 
-# Run the function on the provided dataset
-current_dir = os.path.dirname(__file__)
-
-# Go up one directory and into 'preprocessing/prediction'
-data_folder = os.path.join(current_dir, '..', 'prediction')
-output_folder = os.path.join(current_dir, '..', 'results')
-results = train_and_evaluate_per_group(
-    data_folder,
-    output_folder
-)
+# Key of a group given on the command line as SWITCH,SOURCE_PORT,DEST_PORT,PROTOCOL
+def parse_group(value):
+    parts = value.split(',')
+    if len(parts) != 4:
+        raise argparse.ArgumentTypeError(f"expected SWITCH,SOURCE_PORT,DEST_PORT,PROTOCOL, got {value}")
+    try:
+        return (parts[0], float(parts[1]), float(parts[2]), parts[3])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"ports must be numbers, got {value}")
+
+if __name__ == "__main__":
+    current_dir = os.path.dirname(__file__)
+    data_folder = os.path.join(current_dir, '..', 'prediction')
+    output_folder = os.path.join(current_dir, '..', 'results')
+
+    parser = argparse.ArgumentParser(description="Train, evaluate and run the LSTM throughput models")
+    subparsers = parser.add_subparsers(dest='command', metavar='{load,train,predict,plot}',
+                                       help="Command to run (default: train)")
+
+    data_parser = argparse.ArgumentParser(add_help=False)
+    data_parser.add_argument('--data', default=data_folder, help="Feature folder (default: ../prediction)")
+    data_parser.add_argument('--feature-store', help="Read groups from this feature store instead")
+    data_parser.add_argument('--group', type=parse_group, action='append', dest='groups',
+                             metavar='SWITCH,SRC,DST,PROTO', help="Only use this group (can be repeated)")
+    data_parser.add_argument('--metrics', metavar='FILE', help="Time every stage and save the metrics to FILE")
+
+    load_parser = subparsers.add_parser('load', parents=[data_parser], help="Summarize the feature data")
+    load_parser.add_argument('--top', type=int, default=10, help="Number of largest groups to list")
+
+    train_parser = subparsers.add_parser('train', parents=[data_parser], help="Train and evaluate the models")
+    train_parser.add_argument('--output', default=output_folder, help="Folder of prediction CSVs and plots")
+    train_parser.add_argument('--model', choices=list(MODEL_BUILDERS) + ['shared'], default='classic',
+                              help="Per-group architecture, or one model shared by all groups")
+    train_parser.add_argument('--sequence-length', type=int, default=5)
+    train_parser.add_argument('--epochs', type=int, default=10)
+    train_parser.add_argument('--batch-size', type=int, help="Default: 16, or 512 with --model shared")
+    train_parser.add_argument('--input-pipeline', choices=['numpy', 'tf.data', 'streaming'], default='numpy',
+                              help="'streaming' (with --model shared) reads the feature files in chunks on every "
+                                   "epoch instead of loading them, for datasets larger than memory")
+    train_parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+                              help="With --input-pipeline streaming, rows read from a feature file at a time")
+    train_parser.add_argument('--shuffle-buffer', type=int, default=DEFAULT_SHUFFLE_BUFFER,
+                              help="With --input-pipeline streaming, sequences shuffled together")
+    train_parser.add_argument('--workers', type=int, default=1, help="Groups trained at once on worker processes")
+    train_parser.add_argument('--threads-per-worker', type=int)
+    train_parser.add_argument('--models', help="Model registry folder to save the trained models to")
+    train_parser.add_argument('--warm-start', action='store_true',
+                              help="Continue training the saved models on new windows only (needs --models)")
+    train_parser.add_argument('--hyperparameters', help="best_hyperparameters.json written by tuning.py")
+    train_parser.add_argument('--fine-tune-epochs', type=int, default=0, help="With --model shared, per-group fine-tuning")
+    train_parser.add_argument('--embedding-dim', type=int, default=8, help="With --model shared, group embedding size")
+    train_parser.add_argument('--horizon', type=int, default=1,
+                              help="Forecast this many future windows in one forward pass (default: the next one)")
+    train_parser.add_argument('--extra-targets', nargs='+', default=[],
+                              choices=[name for name in TARGETS if name != 'throughput'],
+                              help="Forecast these features too, besides throughput")
+    train_parser.add_argument('--baselines', action='store_true',
+                              help="Also evaluate persistence, moving average, exponential smoothing and "
+                                   "autoregression baselines on every group, reported in errors.csv")
+    train_parser.add_argument('--skip-lstm-mae', type=float, metavar='MAE',
+                              help="Predict groups whose best baseline has at most this mean absolute error "
+                                   "(on scaled values) with that baseline, without training their LSTM")
+
+    predict_parser = subparsers.add_parser('predict', parents=[data_parser],
+                                           help="Predict with saved models, without training")
+    predict_parser.add_argument('--models', required=True, help="Model registry folder")
+    predict_parser.add_argument('--output', default=output_folder, help="Folder of prediction CSVs and plots")
+    predict_parser.add_argument('--batch-size', type=int, default=512)
+
+    plot_parser = subparsers.add_parser('plot', help="Plot again the prediction CSVs of a results folder")
+    plot_parser.add_argument('--output', default=output_folder, help="Results folder (default: ../results)")
+
+    args = parser.parse_args()
+    if args.command is None:
+        args = parser.parse_args(['train'])
+    if getattr(args, 'metrics', None):
+        metrics.enable(args.metrics)
+    if args.command == 'train':
+        targets = [TARGETS[name] for name in ['throughput'] + args.extra_targets]
+    if getattr(args, 'feature_store', None):
+        warn_if_stale(args.feature_store, args.data)
+
+    if args.command == 'load':
+        describe_data(args.data, args.feature_store, args.top)
+    elif args.command == 'plot':
+        print(f"Plotted {plot_results_folder(args.output)} prediction files")
+    elif args.command == 'predict':
+        predict_with_saved_models(args.data, args.models, args.output, args.feature_store, args.groups,
+                                  args.batch_size)
+    elif args.warm_start and not args.models:
+        parser.error("--warm-start continues the models saved in --models, which is missing")
+    elif args.model == 'shared' and (args.warm_start or args.hyperparameters or args.workers > 1
+                                     or args.threads_per_worker):
+        parser.error("--warm-start, --hyperparameters, --workers and --threads-per-worker apply to the per-group models")
+    elif (args.baselines or args.skip_lstm_mae is not None) and args.model == 'shared':
+        parser.error("--baselines and --skip-lstm-mae apply to the per-group models")
+    elif (args.baselines or args.skip_lstm_mae is not None) and args.warm_start:
+        # A warm-started LSTM is scored on its new windows only, the baselines on the whole series
+        parser.error("--baselines and --skip-lstm-mae compare against models trained from scratch, not --warm-start")
+    elif args.input_pipeline == 'streaming':
+        if args.model != 'shared' or args.feature_store or args.fine_tune_epochs:
+            parser.error("--input-pipeline streaming trains --model shared on the files of --data, "
+                         "without --feature-store or --fine-tune-epochs")
+        train_and_evaluate_shared_streaming(args.data, args.output, args.sequence_length, args.epochs,
+                                            args.batch_size or 512, args.groups, args.embedding_dim, args.models,
+                                            args.chunk_rows, args.shuffle_buffer, args.horizon, targets)
+    elif args.model == 'shared':
+        train_and_evaluate_shared(args.data, args.output, args.sequence_length, args.epochs, args.batch_size or 512,
+                                  args.feature_store, args.groups, args.fine_tune_epochs, args.embedding_dim,
+                                  args.models, args.horizon, targets)
+    else:
+        hyperparameters = None
+        if args.hyperparameters:
+            with open(args.hyperparameters) as f:
+                hyperparameters = json.load(f)
+        train_and_evaluate_per_group(args.data, args.output, args.sequence_length, args.epochs, args.batch_size or 16,
+                                     args.feature_store, args.groups, args.input_pipeline, args.workers,
+                                     args.threads_per_worker, args.models, args.warm_start, hyperparameters,
+                                     args.model, args.horizon, targets, args.baselines, args.skip_lstm_mae)
+    metrics.finish()
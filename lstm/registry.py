@@ -0,0 +1,113 @@
+import json
+import os
+import time
+
+import numpy as np
+
+SHARED_MODEL_NAME = 'shared'
+
+
+def model_file_name(key):
+    return '_'.join(str(part) for part in key)
+
+
+# A fitted MinMaxScaler as plain numbers: scaled = row * scale + min
+def scaler_params(scaler):
+    return {'min': scaler.min_.tolist(), 'scale': scaler.scale_.tolist(),
+            'data_min': scaler.data_min_.tolist(), 'data_max': scaler.data_max_.tolist(),
+            'feature_range': list(scaler.feature_range)}
+
+
+# MinMaxScaler fitted as described by scaler_params, without refitting it
+def restore_scaler(params):
+    from sklearn.preprocessing import MinMaxScaler
+
+    scaler = MinMaxScaler(feature_range=tuple(params['feature_range']))
+    scaler.min_ = np.array(params['min'])
+    scaler.scale_ = np.array(params['scale'])
+    scaler.data_min_ = np.array(params['data_min'])
+    scaler.data_max_ = np.array(params['data_max'])
+    scaler.data_range_ = scaler.data_max_ - scaler.data_min_
+    scaler.n_features_in_ = len(scaler.min_)
+    scaler.n_samples_seen_ = 0
+    return scaler
+
+
+def save_json(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def timestamp_text(timestamp):
+    import pandas as pd
+
+    return pd.Timestamp(timestamp).isoformat()
+
+
+# Folder of trained models. Every model is saved as <name>.keras next to
+# <name>.json holding its metadata: the groups it serves (keys[i] is fed as
+# group index i to a shared model) and their scalers, the features, sequence
+# length and forecast (horizon and targets), the time range and number of rows
+# it was trained on, its last validation loss and when it was trained. Each
+# group has its own files, so parallel training workers can save without
+# coordinating.
+class ModelRegistry:
+    def __init__(self, model_folder):
+        self.model_folder = model_folder
+
+    def entries(self):
+        if not os.path.isdir(self.model_folder):
+            return
+        for file in sorted(os.listdir(self.model_folder)):
+            if file.endswith('.json'):
+                with open(os.path.join(self.model_folder, file)) as f:
+                    yield file, json.load(f)
+
+    def entry(self, key):
+        path = os.path.join(self.model_folder, model_file_name(key) + '.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def model_path(self, entry):
+        return os.path.join(self.model_folder, entry['model'])
+
+    # (model, scaler, metadata) of the group's own model, or None if it has none.
+    # The model comes back compiled with the optimizer state it was saved with.
+    def load_group(self, key):
+        import tensorflow as tf
+
+        entry = self.entry(key)
+        if entry is None:
+            return None
+        model = tf.keras.models.load_model(self.model_path(entry))
+        return model, restore_scaler(entry['scalers'][0]), entry
+
+    # horizon and targets: the model outputs the next horizon windows of every
+    # feature in targets, step by step (the next throughput alone by default)
+    def save_group(self, key, model, scaler, sequence_length, features, data_start, data_end, rows, val_loss,
+                   updates=0, horizon=1, targets=None):
+        name = model_file_name(key)
+        self.save(name, model, {
+            'keys': [list(key)], 'model': name + '.keras', 'sequence_length': sequence_length,
+            'features': features, 'scalers': [scaler_params(scaler)], 'data_start': timestamp_text(data_start),
+            'data_end': timestamp_text(data_end), 'rows': rows, 'val_loss': val_loss, 'updates': updates,
+            'horizon': horizon, 'targets': targets or features[:1]})
+
+    def save_shared(self, keys, model, scalers, sequence_length, features, data_start, data_end, rows, val_loss,
+                    horizon=1, targets=None):
+        self.save(SHARED_MODEL_NAME, model, {
+            'keys': [list(key) for key in keys], 'model': SHARED_MODEL_NAME + '.keras', 'shared': True,
+            'sequence_length': sequence_length, 'features': features,
+            'scalers': [scaler_params(scaler) for scaler in scalers], 'data_start': timestamp_text(data_start),
+            'data_end': timestamp_text(data_end), 'rows': rows, 'val_loss': val_loss, 'updates': 0,
+            'horizon': horizon, 'targets': targets or features[:1]})
+
+    def save(self, name, model, metadata):
+        os.makedirs(self.model_folder, exist_ok=True)
+        metadata['trained_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        model.save(os.path.join(self.model_folder, name + '.keras'))
+        save_json(os.path.join(self.model_folder, name + '.json'), metadata)
@@ -0,0 +1,104 @@
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from instrumentation import metrics
+
+# Trained groups waiting to be written before training blocks on the writer
+MAX_PENDING_WRITES = 16
+
+
+# Writes prediction CSVs and plots on a background thread, so saving one group's
+# results overlaps with training the next ones
+class ResultWriter:
+    def __init__(self, output_folder, save, max_pending=MAX_PENDING_WRITES):
+        self.output_folder = output_folder
+        self.save = save
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def submit(self, key, y_train, y_test, y_pred):
+        self.queue.put((key, y_train, y_test, y_pred))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            key = item[0]
+            try:
+                with metrics.timer('results.write'):
+                    self.save(self.output_folder, *item)
+            except Exception as e:
+                print(f"Error saving results of {key}: {e}")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.queue.put(None)
+        self.thread.join()
+        return False
+
+
+# Limit the TensorFlow thread pools of a worker, so that workers running side
+# by side do not oversubscribe the cores
+def init_worker(threads):
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    import tensorflow as tf
+
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(min(threads, 2))
+
+
+# Runs in a worker: read the group if it lives in a feature store, then train
+# it. Returns the result with the metrics the worker recorded for the group.
+def train_job(train, key, source, train_options):
+    from feature_store import FeatureStore
+
+    with metrics.timer('load.group'):
+        group = FeatureStore(source).load_group(key) if isinstance(source, str) else source
+    result = train(key, group, **train_options)
+    return result, metrics.drain() if metrics.enabled else None
+
+
+# Train the groups of jobs ((key, row count, source) as built by lstm.group_jobs)
+# with train(key, group, **train_options) on a pool of worker processes, save each
+# result with save(output_folder, key, y_train, y_test, y_pred) and return the
+# same {key: (y_test, y_pred)} dict as the sequential loop. Largest groups are
+# submitted first so a big group does not start last and leave the other
+# workers idle. Groups that fail to train, or that train_group returns None
+# for, are left out.
+def train_groups_parallel(jobs, train, save, output_folder, workers, threads_per_worker=None, **train_options):
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+    jobs = sorted(jobs, key=lambda job: job[1], reverse=True)
+    print(f"Training {len(jobs)} groups on {workers} workers ({threads_per_worker} threads each)")
+
+    results = {}
+    # TensorFlow is not fork-safe, so workers are always spawned
+    context = multiprocessing.get_context('spawn')
+    with ResultWriter(output_folder, save) as writer, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                initializer=init_worker, initargs=(threads_per_worker,)) as executor:
+        futures = {executor.submit(train_job, train, key, source, train_options): key for key, _, source in jobs}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                result, worker_metrics = future.result()
+            except Exception as e:
+                print(f"Error training {key}: {e}")
+                continue
+            metrics.merge(worker_metrics)
+            if result is None:
+                continue
+            y_train, y_test, y_pred = result
+            results[key] = (y_test, y_pred)
+            writer.submit(key, y_train, y_test, y_pred)
+
+    return results
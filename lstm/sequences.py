@@ -0,0 +1,59 @@
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+# Build the (n, sequence_length, n_features) LSTM inputs and the next-step
+# throughput labels (column 0) as strided views of data, without copying it.
+# With horizon > 1 or other target columns, the labels are the next horizon
+# steps of every target column instead, step by step: (n, horizon * len(targets)).
+def make_sequences(data, sequence_length, horizon=1, targets=(0,)):
+    data = np.asarray(data)
+    # sliding_window_view puts the window axis last: (n - L + 1, n_features, L)
+    windows = sliding_window_view(data, sequence_length, axis=0).transpose(0, 2, 1)
+    if horizon == 1 and tuple(targets) == (0,):
+        # The last window has no following step to predict
+        return windows[:-1], data[sequence_length:, 0]
+    # (n - L - horizon + 1, n_targets, horizon): the last windows lack some of their future steps
+    future = sliding_window_view(data[sequence_length:, list(targets)], horizon, axis=0)
+    return windows[:len(future)], future.transpose(0, 2, 1).reshape(len(future), -1)
+
+
+# Same split as train_test_split(test_size=..., shuffle=False), but with slices
+# so the train and test sets stay views of the original data
+def split_train_test(sequences, labels, test_size=0.2):
+    n_test = math.ceil(test_size * len(sequences))
+    n_train = len(sequences) - n_test
+    return sequences[:n_train], sequences[n_train:], labels[:n_train], labels[n_train:]
+
+
+# tf.data pipeline producing the same windows and labels on the fly, for
+# sequences start..end-1 (as numbered by make_sequences). Only data itself is
+# held in memory; each batch gathers its windows by index. With shuffle the
+# window order is reshuffled every epoch, like model.fit does for arrays.
+def make_window_dataset(data, sequence_length, batch_size, start=0, end=None, shuffle=False, horizon=1,
+                        targets=(0,)):
+    import tensorflow as tf
+
+    data = tf.constant(np.asarray(data, dtype=np.float32))
+    end = int(data.shape[0]) - sequence_length - horizon + 1 if end is None else end
+    offsets = tf.range(sequence_length, dtype=tf.int64)
+    steps = tf.range(horizon, dtype=tf.int64)
+    target_data = tf.gather(data, list(targets), axis=1)
+    single_output = horizon == 1 and tuple(targets) == (0,)
+
+    def gather(indices):
+        windows = tf.gather(data, indices[:, None] + offsets)
+        if single_output:
+            return windows, tf.gather(data[:, 0], indices + sequence_length)
+        labels = tf.gather(target_data, indices[:, None] + sequence_length + steps)
+        return windows, tf.reshape(labels, (-1, horizon * len(targets)))
+
+    indices = tf.data.Dataset.range(start, end)
+    if shuffle:
+        indices = indices.shuffle(end - start, reshuffle_each_iteration=True)
+    return (indices
+            .batch(batch_size)
+            .map(gather, num_parallel_calls=tf.data.AUTOTUNE)
+            .prefetch(tf.data.AUTOTUNE))
@@ -0,0 +1,137 @@
+import os
+import sys
+
+import numpy as np
+
+from feature_store import FEATURE_FILE_EXTENSIONS, GROUP_COLUMNS, iter_feature_chunks
+from sequences import make_sequences
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from instrumentation import metrics
+
+# Rows read from a feature file at a time
+DEFAULT_CHUNK_ROWS = 100000
+# Sequences shuffled together while training
+DEFAULT_SHUFFLE_BUFFER = 10000
+
+
+# Training sequences of every group streamed from the feature files, for the
+# shared model, so memory depends on the chunk size and the shuffle buffer and
+# not on the size of the dataset. A first pass over the files counts the rows
+# of every group and fits its MinMaxScaler from the running minimum and maximum;
+# after that, every pass reads the files chunk by chunk, scales the rows and
+# builds the windows of each group on the fly, carrying the rows its last
+# windows still need over to the next chunk. Groups, scaling, labels (as built
+# by make_sequences with horizon and targets) and the 80/20 split of every
+# group are the same as when the whole dataset is loaded.
+class StreamingWindows:
+    def __init__(self, data_folder, sequence_length, features, chunk_rows=DEFAULT_CHUNK_ROWS, test_size=0.2,
+                 groups=None, min_rows=0, horizon=1, targets=(0,)):
+        self.files = sorted(os.path.join(data_folder, file) for file in os.listdir(data_folder)
+                            if file.endswith(FEATURE_FILE_EXTENSIONS))
+        self.sequence_length = sequence_length
+        self.features = features
+        self.chunk_rows = chunk_rows
+        self.horizon = horizon
+        self.targets = targets
+        self.outputs = horizon * len(targets)
+        self.fit(test_size, groups, min_rows)
+
+    def chunks(self):
+        for path in self.files:
+            chunks = iter_feature_chunks(path, self.chunk_rows)
+            for chunk in metrics.timed('stream.read', chunks):
+                metrics.count('stream.chunks')
+                metrics.count('stream.rows', len(chunk))
+                yield chunk
+
+    # First pass: row count, time range and per-feature minimum and maximum of every group
+    def fit(self, test_size, groups, min_rows):
+        from sklearn.preprocessing import MinMaxScaler
+
+        stats = {}
+        for chunk in self.chunks():
+            grouped = chunk.groupby(GROUP_COLUMNS, observed=True, sort=False)
+            minimums = grouped[self.features].min()
+            maximums = grouped[self.features].max()
+            times = grouped['Timestamp'].agg(['min', 'max'])
+            for key, rows in grouped.size().items():
+                low, high = minimums.loc[key].to_numpy(), maximums.loc[key].to_numpy()
+                start, end = times.loc[key]
+                if key not in stats:
+                    stats[key] = [rows, low, high, start, end]
+                    continue
+                entry = stats[key]
+                entry[0] += rows
+                entry[1] = np.minimum(entry[1], low)
+                entry[2] = np.maximum(entry[2], high)
+                entry[3] = min(entry[3], start)
+                entry[4] = max(entry[4], end)
+
+        self.keys = []
+        for key in sorted(stats):
+            if groups is not None and key not in groups:
+                continue
+            if stats[key][0] < min_rows:
+                print(f"Skipping ({', '.join(str(part) for part in key)}) - Not enough data to generate sequences")
+                continue
+            self.keys.append(key)
+        self.index = {key: i for i, key in enumerate(self.keys)}
+        self.rows = np.array([stats[key][0] for key in self.keys])
+        self.time_ranges = [(stats[key][3], stats[key][4]) for key in self.keys]
+        # Fitting on the minimum and maximum rows gives the same scaler as fitting on all rows
+        self.scalers = [MinMaxScaler().fit(np.vstack([stats[key][1], stats[key][2]])) for key in self.keys]
+        self.scale = np.array([scaler.scale_ for scaler in self.scalers], dtype=np.float32)
+        self.offset = np.array([scaler.min_ for scaler in self.scalers], dtype=np.float32)
+        self.sequences = self.rows - self.sequence_length - self.horizon + 1
+        self.train_sequences = self.sequences - np.ceil(test_size * self.sequences).astype(int)
+
+    # Yield (windows, group indices, labels, is_train) for every chunk, with the
+    # windows of all its groups together
+    def iter_chunks(self):
+        tails = {}  # Group index -> its last scaled rows, the start of its next windows
+        tail_rows = self.sequence_length + self.horizon - 1
+        produced = np.zeros(len(self.keys), dtype=int)  # Sequences of each group so far
+        for chunk in self.chunks():
+            parts = []
+            for key, rows in chunk.groupby(GROUP_COLUMNS, observed=True, sort=False):
+                i = self.index.get(key)
+                if i is None:
+                    continue
+                scaled = rows[self.features].to_numpy(dtype=np.float32) * self.scale[i] + self.offset[i]
+                if i in tails:
+                    scaled = np.concatenate([tails[i], scaled])
+                tails[i] = scaled[-tail_rows:]
+                if len(scaled) <= tail_rows:
+                    continue
+                windows, labels = make_sequences(scaled, self.sequence_length, self.horizon, self.targets)
+                positions = produced[i] + np.arange(len(labels))
+                produced[i] += len(labels)
+                parts.append((windows, np.full(len(labels), i, dtype=np.int32), labels,
+                              positions < self.train_sequences[i]))
+            if parts:
+                yield tuple(np.concatenate(arrays) for arrays in zip(*parts))
+
+    def iter_split(self, train):
+        for windows, group_ids, labels, is_train in self.iter_chunks():
+            selected = is_train if train else ~is_train
+            if selected.any():
+                yield (windows[selected], group_ids[selected]), labels[selected]
+
+    # tf.data pipeline of ((window, group index), label) batches of the train or
+    # test sequences, read again from disk on every epoch
+    def dataset(self, batch_size, train=True, shuffle_buffer=DEFAULT_SHUFFLE_BUFFER):
+        import tensorflow as tf
+
+        labels = (None,) if self.outputs == 1 and tuple(self.targets) == (0,) else (None, self.outputs)
+        signature = ((tf.TensorSpec((None, self.sequence_length, len(self.features)), tf.float32),
+                      tf.TensorSpec((None,), tf.int32)),
+                     tf.TensorSpec(labels, tf.float32))
+        dataset = tf.data.Dataset.from_generator(lambda: self.iter_split(train), output_signature=signature).unbatch()
+        # The first pass counted the sequences, so Keras knows the length of an epoch
+        train_sequences = int(self.train_sequences.sum())
+        test_sequences = int(self.sequences.sum()) - train_sequences
+        dataset = dataset.apply(tf.data.experimental.assert_cardinality(train_sequences if train else test_sequences))
+        if train and shuffle_buffer:
+            dataset = dataset.shuffle(shuffle_buffer, reshuffle_each_iteration=True)
+        return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
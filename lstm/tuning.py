@@ -0,0 +1,207 @@
+import argparse
+import functools
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+
+import numpy as np
+
+from feature_store import warn_if_stale
+from lstm import SELECTED_FEATURES, build_model_hp, iter_groups
+from sequences import make_sequences
+
+# Epochs without val_loss improvement before a fold stops training
+EARLY_STOPPING_PATIENCE = 3
+BEST_HYPERPARAMETERS_NAME = 'best_hyperparameters.json'
+
+
+# Scaled sequences and labels of every group with enough rows, largest groups
+# first, at most max_groups of them
+def load_group_sequences(data_folder, sequence_length, feature_store=None, groups=None, max_groups=None,
+                         min_sequences=2):
+    from sklearn.preprocessing import MinMaxScaler
+
+    group_sequences = []
+    for key, group in iter_groups(data_folder, feature_store, groups, sequence_length + min_sequences):
+        if len(group) < sequence_length + min_sequences:
+            continue
+        group_scaled = MinMaxScaler().fit_transform(group[SELECTED_FEATURES])
+        group_sequences.append(make_sequences(group_scaled, sequence_length))
+    group_sequences.sort(key=lambda item: len(item[1]), reverse=True)
+    return group_sequences[:max_groups]
+
+
+# TimeSeriesSplit folds across groups: fold i trains on the first part of every
+# group and validates on the windows that follow it, so no group is validated on
+# data older than what it was trained on
+def time_series_folds(group_sequences, n_splits):
+    from sklearn.model_selection import TimeSeriesSplit
+
+    splitter = TimeSeriesSplit(n_splits=n_splits)
+    folds = [([], [], [], []) for _ in range(n_splits)]
+    for sequences, labels in group_sequences:
+        if len(sequences) <= n_splits:
+            continue
+        for fold, (train_idx, val_idx) in zip(folds, splitter.split(sequences)):
+            fold[0].append(sequences[train_idx])
+            fold[1].append(labels[train_idx])
+            fold[2].append(sequences[val_idx])
+            fold[3].append(labels[val_idx])
+    return [tuple(np.concatenate(part) for part in fold) for fold in folds if fold[0]]
+
+
+# Hyperband whose trials are scored by the mean best validation loss over the
+# time series folds, and each fold stops once val_loss stops improving. Every
+# fold keeps its best weights in the trial folder, so a configuration promoted
+# to the next Hyperband round continues from them (from tuner/initial_epoch)
+# instead of training from scratch. Defined on first use, so that importing
+# this module does not start TensorFlow.
+@functools.lru_cache(maxsize=None)
+def time_series_hyperband():
+    import keras_tuner as kt
+    import tensorflow as tf
+
+    class TimeSeriesHyperband(kt.Hyperband):
+        def fold_checkpoint(self, trial_id, fold):
+            return os.path.join(self.get_trial_dir(trial_id), f'fold_{fold}.weights.h5')
+
+        def run_trial(self, trial, folds, epochs=10, batch_size=16, **fit_kwargs):
+            hp = trial.hyperparameters
+            epochs = hp.values.get('tuner/epochs', epochs)
+            parent = hp.values.get('tuner/trial_id')
+            os.makedirs(self.get_trial_dir(trial.trial_id), exist_ok=True)
+            results = []
+            for fold, (X_train, y_train, X_val, y_val) in enumerate(folds):
+                model = self.hypermodel.build(hp)
+                initial_epoch = 0
+                if parent is not None and os.path.exists(self.fold_checkpoint(parent, fold)):
+                    model.load_weights(self.fold_checkpoint(parent, fold))
+                    initial_epoch = hp.values.get('tuner/initial_epoch', 0)
+                callbacks = [
+                    tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=EARLY_STOPPING_PATIENCE),
+                    tf.keras.callbacks.ModelCheckpoint(self.fold_checkpoint(trial.trial_id, fold), monitor='val_loss',
+                                                       save_best_only=True, save_weights_only=True),
+                ]
+                history = model.fit(X_train, y_train, epochs=epochs, initial_epoch=initial_epoch,
+                                    batch_size=batch_size, validation_data=(X_val, y_val), callbacks=callbacks,
+                                    verbose=0)
+                results.append({'val_loss': min(history.history['val_loss'])})
+            return results
+
+    return TimeSeriesHyperband
+
+
+def make_tuner(directory, project_name, sequence_length=5, max_epochs=20, overwrite=False):
+    return time_series_hyperband()(
+        functools.partial(build_model_hp, input_shape=(sequence_length, len(SELECTED_FEATURES))),
+        objective='val_loss',
+        max_epochs=max_epochs,
+        hyperband_iterations=1,
+        directory=directory,
+        project_name=project_name,
+        overwrite=overwrite,
+    )
+
+
+# Save the best hyperparameter values found so far to best_hyperparameters.json
+def save_best_hyperparameters(tuner, directory, project_name):
+    best = {name: value for name, value in tuner.get_best_hyperparameters(1)[0].values.items()
+            if not name.startswith('tuner/')}
+    output_file = os.path.join(directory, project_name, BEST_HYPERPARAMETERS_NAME)
+    with open(output_file, 'w') as f:
+        json.dump(best, f, indent=2)
+    print(f"Best hyperparameters saved to '{output_file}': {best}")
+    return best
+
+
+# Search the hyperparameters of build_model_hp. Trial state lives in
+# directory/project_name, so an interrupted search picks up where it stopped
+# unless overwrite is set. Returns the best hyperparameter values, which are
+# also saved for train_and_evaluate_per_group(hyperparameters=...).
+def tune(data_folder, directory, project_name='lstm_tuning', sequence_length=5, max_epochs=20, n_splits=5,
+         batch_size=16, feature_store=None, groups=None, max_groups=None, overwrite=False):
+    tuner = make_tuner(directory, project_name, sequence_length, max_epochs, overwrite)
+    if os.environ.get('KERASTUNER_TUNER_ID') == 'chief':
+        # The chief only hands out trials to the workers, it needs no data
+        tuner.search()
+        return None
+
+    group_sequences = load_group_sequences(data_folder, sequence_length, feature_store, groups, max_groups)
+    folds = time_series_folds(group_sequences, n_splits)
+    if not folds:
+        print("Not enough data to build time series folds")
+        return None
+    print(f"Tuning on {len(group_sequences)} groups, {len(folds)} folds")
+    tuner.search(folds, epochs=max_epochs, batch_size=batch_size)
+    if 'KERASTUNER_TUNER_ID' in os.environ:
+        return None  # Parallel workers leave the result to the launching process
+    return save_best_hyperparameters(tuner, directory, project_name)
+
+
+# Run the search on several processes with Keras Tuner's distributed mode: a
+# chief process holds the oracle, which hands trials to the worker processes.
+# Every process runs this script with script_args and its share of the cores.
+def tune_parallel(workers, script_args):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    threads = str(max(1, (os.cpu_count() or 1) // workers))
+
+    def launch(tuner_id):
+        env = dict(os.environ, KERASTUNER_TUNER_ID=tuner_id, KERASTUNER_ORACLE_IP='127.0.0.1',
+                   KERASTUNER_ORACLE_PORT=str(port), TF_NUM_INTRAOP_THREADS=threads, TF_NUM_INTEROP_THREADS='1')
+        return subprocess.Popen([sys.executable, os.path.abspath(__file__)] + script_args, env=env)
+
+    chief = launch('chief')
+    processes = [launch(f'tuner{i}') for i in range(workers)]
+    for process in processes:
+        process.wait()
+    try:
+        chief.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        chief.terminate()
+        chief.wait()
+    return all(process.returncode == 0 for process in processes)
+
+
+if __name__ == "__main__":
+    current_dir = os.path.dirname(__file__)
+    parser = argparse.ArgumentParser(description="Hyperparameter search for the LSTM model")
+    parser.add_argument('--data', default=os.path.join(current_dir, '..', 'prediction'), help="Feature folder")
+    parser.add_argument('--feature-store', help="Read groups from this feature store instead")
+    parser.add_argument('--directory', default=os.path.join(current_dir, '..', 'tuning'),
+                        help="Where trial state is kept (default: ../tuning)")
+    parser.add_argument('--project', default='lstm_tuning')
+    parser.add_argument('--sequence-length', type=int, default=5)
+    parser.add_argument('--max-epochs', type=int, default=20)
+    parser.add_argument('--splits', type=int, default=5, help="TimeSeriesSplit folds per trial")
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--max-groups', type=int, help="Only tune on the largest groups")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes running trials in parallel")
+    parser.add_argument('--overwrite', action='store_true', help="Start over instead of resuming a previous search")
+    args = parser.parse_args()
+
+    if args.feature_store and 'KERASTUNER_TUNER_ID' not in os.environ:
+        warn_if_stale(args.feature_store, args.data)
+    if args.workers > 1 and 'KERASTUNER_TUNER_ID' not in os.environ:
+        # A requested overwrite happens once here; the chief and workers resume
+        if args.overwrite:
+            shutil.rmtree(os.path.join(args.directory, args.project), ignore_errors=True)
+        script_args = ['--data', args.data, '--directory', args.directory, '--project', args.project,
+                       '--sequence-length', str(args.sequence_length), '--max-epochs', str(args.max_epochs),
+                       '--splits', str(args.splits), '--batch-size', str(args.batch_size)]
+        if args.feature_store:
+            script_args += ['--feature-store', args.feature_store]
+        if args.max_groups:
+            script_args += ['--max-groups', str(args.max_groups)]
+        if not tune_parallel(args.workers, script_args):
+            sys.exit(1)
+        tuner = make_tuner(args.directory, args.project, args.sequence_length, args.max_epochs)
+        save_best_hyperparameters(tuner, args.directory, args.project)
+        sys.exit(0)
+
+    tune(args.data, args.directory, args.project, args.sequence_length, args.max_epochs, args.splits,
+         args.batch_size, args.feature_store, max_groups=args.max_groups, overwrite=args.overwrite)
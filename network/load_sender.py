@@ -0,0 +1,213 @@
+import argparse
+import fcntl
+import http.client
+import json
+import os
+import random
+import socket
+import socketserver
+import struct
+import sys
+import termios
+import threading
+import time
+
+# Long-lived traffic source run inside a Mininet host by traffic_gen.py's
+# concurrent engine: one process sends a whole flow (fixed source and
+# destination port) at a target rate with in-process sockets, instead of one
+# dd | socat, hping3 or curl process per packet. Prints its stats as one JSON
+# line when the flow ends. The rate can follow a profile of segments, which is
+# how scenarios.py describes on/off, bursty and diurnal flows.
+
+RECEIVE_SIZE = 65536
+# Longest wait for the peer to acknowledge the last data of a flow before resetting it
+DRAIN_TIMEOUT = 1.0
+
+
+# Yield once per packet following profile, a list of [offset, rate] segments
+# sorted by offset (seconds since the start, packets per second; rate 0 pauses
+# the flow until the next segment), until duration has passed. Sends are
+# scheduled on a fixed timeline, so a late send is followed by quicker ones
+# instead of lowering the rate.
+def paced(profile, duration):
+    start = time.monotonic()
+    next_send = 0.0  # Seconds since start
+    segment = 0
+    while next_send < duration:
+        while segment + 1 < len(profile) and profile[segment + 1][0] <= next_send:
+            segment += 1
+        rate = profile[segment][1]
+        if rate <= 0:
+            if segment + 1 == len(profile):
+                return
+            next_send = profile[segment + 1][0]
+            continue
+        delay = start + next_send - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        yield
+        next_send += 1.0 / rate
+        # Do not try to make up for more than a second of backlog
+        next_send = max(next_send, time.monotonic() - start - 1.0)
+
+
+def bound_socket(kind, src_port):
+    sock = socket.socket(socket.AF_INET, kind)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(('', src_port))
+    return sock
+
+
+# Close a TCP socket with a reset once everything sent has been acknowledged, so
+# its source port does not sit in TIME_WAIT and the next flow can reuse it at once
+def reset_close(sock):
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    unacked = bytearray(4)
+    try:
+        while time.monotonic() < deadline:
+            fcntl.ioctl(sock, termios.TIOCOUTQ, unacked)
+            if int.from_bytes(unacked, sys.byteorder) == 0:
+                break
+            time.sleep(0.01)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    except OSError:
+        pass
+    sock.close()
+
+
+def send_udp(target, src_port, dst_port, profile, duration, payload_min, payload_max, rng):
+    stats = {'packets': 0, 'bytes': 0, 'errors': 0}
+    payload = memoryview(os.urandom(payload_max))
+    with bound_socket(socket.SOCK_DGRAM, src_port) as sock:
+        for _ in paced(profile, duration):
+            size = rng.randint(payload_min, payload_max)
+            try:
+                sock.sendto(payload[:size], (target, dst_port))
+            except OSError:
+                stats['errors'] += 1  # e.g. ICMP port unreachable reported on a later send
+                continue
+            stats['packets'] += 1
+            stats['bytes'] += size
+    return stats
+
+
+# One TCP connection for the whole flow; every send is one message (segment,
+# with Nagle disabled). A dropped connection is opened again from the same port.
+def send_tcp(target, src_port, dst_port, profile, duration, payload_min, payload_max, rng):
+    stats = {'packets': 0, 'bytes': 0, 'errors': 0}
+    payload = memoryview(os.urandom(payload_max))
+    sock = None
+    try:
+        for _ in paced(profile, duration):
+            size = rng.randint(payload_min, payload_max)
+            try:
+                if sock is None:
+                    sock = bound_socket(socket.SOCK_STREAM, src_port)
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    sock.connect((target, dst_port))
+                sock.sendall(payload[:size])
+            except OSError:
+                stats['errors'] += 1
+                if sock is not None:
+                    reset_close(sock)
+                    sock = None
+                continue
+            stats['packets'] += 1
+            stats['bytes'] += size
+    finally:
+        if sock is not None:
+            reset_close(sock)
+    return stats
+
+
+# HTTP connection from a fixed source port. It is reset instead of closed (the
+# reply has been read by then), so the next request can reuse the port at once.
+class BoundHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, host, port, src_port, timeout=5):
+        super().__init__(host, port, timeout=timeout)
+        self.src_port = src_port
+
+    def connect(self):
+        self.sock = bound_socket(socket.SOCK_STREAM, self.src_port)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        self.sock.settimeout(self.timeout)
+        self.sock.connect((self.host, self.port))
+
+
+# GET requests to the host's http.server; it closes the connection after each
+# reply, so every request opens a new connection from the same source port
+def send_http(target, src_port, dst_port, profile, duration, payload_min=None, payload_max=None, rng=None):
+    stats = {'packets': 0, 'bytes': 0, 'errors': 0}
+    for _ in paced(profile, duration):
+        connection = BoundHTTPConnection(target, dst_port, src_port)
+        try:
+            connection.request('GET', '/')
+            stats['bytes'] += len(connection.getresponse().read())
+            stats['packets'] += 1
+        except (OSError, http.client.HTTPException):
+            stats['errors'] += 1
+        finally:
+            connection.close()
+    return stats
+
+
+SENDERS = {'tcp': send_tcp, 'udp': send_udp, 'http': send_http}
+
+
+# Reads and drops everything a client sends
+class DiscardHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while self.request.recv(RECEIVE_SIZE):
+            pass
+
+
+class DiscardServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+# TCP sink on every port, one thread per connection, so many concurrent flows
+# can send to the same port (nc -lk serves one connection at a time)
+def serve_discard(ports):
+    servers = [DiscardServer(('', port), DiscardHandler) for port in ports]
+    threads = [threading.Thread(target=server.serve_forever, daemon=True) for server in servers]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send one flow at a target rate, or run a TCP discard sink")
+    parser.add_argument('protocol', choices=list(SENDERS) + ['sink'])
+    parser.add_argument('target', nargs='?', help="Destination IP")
+    parser.add_argument('--src-port', type=int, default=0)
+    parser.add_argument('--dst-port', type=int, nargs='+', help="Destination port (sink: ports to listen on)")
+    parser.add_argument('--rate', type=float, default=10, help="Packets (HTTP: requests) per second")
+    parser.add_argument('--profile', type=json.loads,
+                        help="Rate over time instead of --rate, as JSON [[offset seconds, rate], ...]")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds to send for")
+    parser.add_argument('--payload-min', type=int, default=90)
+    parser.add_argument('--payload-max', type=int, default=200)
+    parser.add_argument('--seed', type=int, help="Seed of the payload sizes")
+    args = parser.parse_args()
+
+    if args.protocol == 'sink':
+        serve_discard(args.dst_port)
+        sys.exit(0)
+    if args.target is None or not args.dst_port:
+        parser.error("a target and --dst-port are required to send")
+
+    start = time.monotonic()
+    profile = args.profile or [[0, args.rate]]
+    stats = SENDERS[args.protocol](args.target, args.src_port, args.dst_port[0], profile, args.duration,
+                                   args.payload_min, args.payload_max, random.Random(args.seed))
+    stats['seconds'] = round(time.monotonic() - start, 3)
+    print(json.dumps(stats), flush=True)
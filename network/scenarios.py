@@ -0,0 +1,205 @@
+import json
+import math
+import random
+
+# Traffic scenarios for traffic_gen.py's concurrent engine. A scenario is a JSON
+# file describing the load; build_schedule() expands it with its seed into the
+# exact list of flows of every iteration (start time, hosts, ports, duration,
+# payload sizes and rate over time). The same scenario always gives the same
+# schedule, and a schedule dumped to a file can be replayed as it is.
+#
+# {
+#   "seed": 42,
+#   "iterations": 4,
+#   "duration": 300,                 # seconds per iteration, or [min, max]
+#   "rate_scale": [1, 2, 4, 8],      # rates of iteration i are multiplied by rate_scale[i] (last value repeats)
+#   "flows": [
+#     {"protocol": "udp", "count": 4, "rate": 200},
+#     {"protocol": "tcp", "count": 2, "rate": 500, "pattern": "on_off", "on": [1, 5], "off": [1, 3]},
+#     {"protocol": "udp", "count": 2, "rate": 300, "pattern": "bursty", "burst_rate": 3000, "burst_probability": 0.1},
+#     {"protocol": "http", "count": 1, "rate": 10, "pattern": "diurnal", "period": 300, "min_factor": 0.2}
+#   ]
+# }
+#
+# Every entry of "flows" is run by "count" slots in parallel; each slot starts
+# flows one after another between random hosts for the whole iteration.
+# Optional keys of an entry: "flow_duration" (seconds, [min, max]), "gap"
+# (seconds between the flows of a slot, [min, max]), "payload" ([min, max]
+# bytes) and "step" (seconds between rate changes of bursty/diurnal flows).
+# Numbers given as [min, max] are drawn uniformly for every use.
+
+SCHEDULE_VERSION = 1
+PATTERNS = ['constant', 'on_off', 'bursty', 'diurnal']
+PROTOCOLS = ['tcp', 'udp', 'http']
+FLOW_DEFAULTS = {'rate': 10, 'count': 1, 'pattern': 'constant', 'flow_duration': [5, 30], 'gap': [0, 1],
+                 'payload': [90, 200], 'step': 1, 'on': [1, 5], 'off': [1, 5], 'burst_rate': None,
+                 'burst_probability': 0.1, 'period': None, 'min_factor': 0.1}
+
+
+class ScenarioError(ValueError):
+    pass
+
+
+def draw(value, rng):
+    if isinstance(value, (list, tuple)):
+        return rng.uniform(value[0], value[1])
+    return value
+
+
+# Smallest value a number or [min, max] range can take
+def lowest(value):
+    return min(value) if isinstance(value, (list, tuple)) else value
+
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def check_scenario(scenario):
+    if not scenario.get('flows'):
+        raise ScenarioError("a scenario needs at least one entry in 'flows'")
+    for entry in scenario['flows']:
+        if entry.get('protocol') not in PROTOCOLS:
+            raise ScenarioError(f"unknown protocol {entry.get('protocol')!r}, expected one of {PROTOCOLS}")
+        if entry.get('pattern', 'constant') not in PATTERNS:
+            raise ScenarioError(f"unknown pattern {entry.get('pattern')!r}, expected one of {PATTERNS}")
+        entry = dict(FLOW_DEFAULTS, **entry)
+        # A zero step or flow duration would never move a slot past its start
+        for key in ('step', 'flow_duration'):
+            if lowest(entry[key]) <= 0:
+                raise ScenarioError(f"'{key}' must be positive, got {entry[key]!r}")
+        for key in ('gap', 'count'):
+            if lowest(entry[key]) < 0:
+                raise ScenarioError(f"'{key}' must not be negative, got {entry[key]!r}")
+
+
+# Merge consecutive segments with the same rate
+def compact(profile):
+    merged = []
+    for offset, rate in profile:
+        if not merged or merged[-1][1] != rate:
+            merged.append([round(offset, 3), round(rate, 3)])
+    return merged
+
+
+# Rate profile ([offset, rate] segments) of one flow starting at start seconds
+# into the iteration
+def rate_profile(entry, start, duration, iteration_duration, scale, rng):
+    rate = entry['rate'] * scale
+    pattern = entry['pattern']
+    if pattern == 'constant':
+        return [[0, round(rate, 3)]]
+
+    profile = []
+    offset = 0.0
+    if pattern == 'on_off':
+        on = True
+        while offset < duration:
+            profile.append([offset, rate if on else 0])
+            offset += draw(entry['on'] if on else entry['off'], rng)
+            on = not on
+        return compact(profile)
+
+    step = entry['step']
+    period = entry['period'] or iteration_duration
+    burst_rate = (entry['burst_rate'] or entry['rate'] * 10) * scale
+    while offset < duration:
+        if pattern == 'bursty':
+            profile.append([offset, burst_rate if rng.random() < entry['burst_probability'] else rate])
+        else:
+            # One day per period: lowest at the start, highest half way
+            phase = (1 - math.cos(2 * math.pi * (start + offset) / period)) / 2
+            profile.append([offset, rate * (entry['min_factor'] + (1 - entry['min_factor']) * phase)])
+        offset += step
+    return compact(profile)
+
+
+# Hosts' source ports in use over time, so flows overlapping in time never
+# share a source port on the same host
+class PortCalendar:
+    def __init__(self):
+        self.busy_until = {}
+
+    def acquire(self, host, protocol, ports, start, end, rng):
+        free = [port for port in ports if self.busy_until.get((host, protocol, port), -1) <= start]
+        if not free:
+            return None
+        port = rng.choice(free)
+        self.busy_until[(host, protocol, port)] = end
+        return port
+
+
+# Flows of one iteration, sorted by start time. hosts: names of the hosts,
+# web_hosts: the ones serving HTTP, ports: {protocol: (source ports, destination ports)}
+def iteration_flows(scenario, duration, scale, hosts, web_hosts, ports, rng):
+    calendar = PortCalendar()
+    flows = []
+    for entry_index, entry in enumerate(scenario['flows']):
+        entry = dict(FLOW_DEFAULTS, **entry)
+        targets = web_hosts if entry['protocol'] == 'http' else hosts
+        src_ports, dst_ports = ports[entry['protocol']]
+        for _ in range(entry['count']):
+            start = draw(entry['gap'], rng)
+            while start < duration:
+                flow_duration = min(draw(entry['flow_duration'], rng), duration - start)
+                dst = rng.choice(targets)
+                src = rng.choice([host for host in hosts if host != dst])
+                src_port = calendar.acquire(src, entry['protocol'], src_ports, start, start + flow_duration, rng)
+                if src_port is None:
+                    start += entry['step']  # Every source port of this host is busy
+                    continue
+                flows.append({
+                    'start': round(start, 3), 'duration': round(flow_duration, 3), 'entry': entry_index,
+                    'protocol': entry['protocol'], 'src': src, 'dst': dst, 'src_port': src_port,
+                    'dst_port': rng.choice(dst_ports), 'payload': list(entry['payload']),
+                    'seed': rng.randrange(2 ** 31),
+                    'profile': rate_profile(entry, start, flow_duration, duration, scale, rng)})
+                start += flow_duration + draw(entry['gap'], rng)
+    flows.sort(key=lambda flow: flow['start'])
+    return flows
+
+
+# Expand a scenario into the full schedule of every iteration
+def build_schedule(scenario, hosts, web_hosts, ports):
+    check_scenario(scenario)
+    rng = random.Random(scenario.get('seed', 0))
+    rate_scale = scenario.get('rate_scale', [1])
+    iterations = []
+    for i in range(scenario.get('iterations', 1)):
+        duration = round(draw(scenario.get('duration', 300), rng), 3)
+        scale = rate_scale[min(i, len(rate_scale) - 1)]
+        iterations.append({'duration': duration, 'rate_scale': scale,
+                           'flows': iteration_flows(scenario, duration, scale, hosts, web_hosts, ports, rng)})
+    return {'version': SCHEDULE_VERSION, 'scenario': scenario, 'iterations': iterations}
+
+
+def load_schedule(path):
+    schedule = load_json(path)
+    if schedule.get('version') != SCHEDULE_VERSION:
+        raise ScenarioError(f"{path} is not a schedule of version {SCHEDULE_VERSION}")
+    return schedule
+
+
+# Packets (HTTP: requests) a flow is scheduled to send
+def scheduled_packets(flow):
+    profile = flow['profile']
+    ends = [offset for offset, _ in profile[1:]] + [flow['duration']]
+    return sum(rate * max(0, min(end, flow['duration']) - offset) for (offset, rate), end in zip(profile, ends))
+
+
+def describe_schedule(schedule):
+    for i, iteration in enumerate(schedule['iterations']):
+        flows = iteration['flows']
+        per_protocol = {}
+        for flow in flows:
+            per_protocol[flow['protocol']] = per_protocol.get(flow['protocol'], 0) + scheduled_packets(flow)
+        load = ', '.join(f"{protocol.upper()} {packets / iteration['duration']:.0f}/s"
+                         for protocol, packets in sorted(per_protocol.items()))
+        print(f"Iteration {i + 1}: {iteration['duration']}s, {len(flows)} flows, "
+              f"rate x{iteration['rate_scale']} ({load})")
@@ -1,10 +1,18 @@
 import os
+import sys
 import time
+import json
 import threading
 import random
 import subprocess
 import logging
+import argparse
+import fnmatch
+import gzip
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from scenarios import build_schedule, describe_schedule, load_json, load_schedule, save_json
 from comnetsemu.net import Containernet
 from mininet.link import TCLink
 from mininet.log import setLogLevel, info
@@ -24,6 +32,45 @@ TCP_SRC_PORTS = [50020, 50021, 50022]#, 50023, 50024]
 TCP_DST_PORTS = [8080, 9001, 9002]
 UDP_SRC_PORTS = [50010, 50011, 50012]
 UDP_DST_PORTS = [8000, 8001, 8002]
+HTTP_SRC_PORTS = [51000, 51001, 51002]
+HTTP_DST_PORT = 80
+HOSTS = [f"h{i}" for i in range(1, 8)]
+WEB_HOSTS = ["h5", "h6", "h7"]
+
+# --- Concurrent load engine ---
+LOAD_SENDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "load_sender.py")
+# Flows of each protocol running at the same time, packets (HTTP: requests) per
+# second of each flow, and payload size range in bytes
+DEFAULT_LOAD = {
+    "tcp": {"flows": 4, "rate": 100, "payload": (90, 200)},
+    "udp": {"flows": 4, "rate": 200, "payload": (90, 200)},
+    "http": {"flows": 2, "rate": 5, "payload": (0, 0)},
+}
+# Range of the length of one flow in seconds
+FLOW_DURATION = (5, 30)
+# Source and destination ports of each protocol, as used by scenarios.py
+PROTOCOL_PORTS = {
+    "tcp": (TCP_SRC_PORTS, TCP_DST_PORTS),
+    "udp": (UDP_SRC_PORTS, UDP_DST_PORTS),
+    "http": (HTTP_SRC_PORTS, [HTTP_DST_PORT]),
+}
+SCHEDULE_NAME = "schedule.json"
+
+# --- Capture profiles ---
+# snaplen: bytes kept of every packet (None: whole packets). The features only
+# read headers, and tcpdump records the wire length of a packet whatever it keeps.
+# filters: BPF filter of each interface, by interface name pattern (first match wins)
+# rotate_mb / rotate_seconds: start a new file once the current one reaches this
+# size / every this many seconds, so closed files can be converted during the run
+# compress: gzip every file once it is closed (tcpdump -z on rotation, then
+# compress_last_captures for the file each tcpdump was writing when stopped)
+CAPTURE_PROFILES = {
+    "full": {},
+    # Ethernet, VLAN, IP and TCP headers with options fit in 160 bytes
+    "headers": {"snaplen": 160},
+    "rotating": {"snaplen": 160, "rotate_seconds": 60, "compress": True},
+    "flows": {"snaplen": 160, "filters": {"*": "tcp or udp"}},
+}
 
 class MyTopo:
     def build(self, net):
@@ -31,7 +78,7 @@ class MyTopo:
         s2 = net.addSwitch("s2", protocols="OpenFlow13")
         s3 = net.addSwitch("s3", protocols="OpenFlow13")
         s4 = net.addSwitch("s4", protocols="OpenFlow13")
-        hosts = [net.addHost(f"h{i}", ip=f"10.0.0.{i}") for i in range(1, 8)]
+        hosts = [net.addHost(name, ip=f"10.0.0.{i}") for i, name in enumerate(HOSTS, 1)]
         for i in range(2):
             net.addLink(hosts[i], s1, cls=TCLink, bw=40, delay="10ms")
             net.addLink(hosts[i + 2], s2, cls=TCLink, bw=40, delay="10ms")
@@ -57,21 +104,44 @@ def start_ryu_controller():
         logging.error(f"Failed to start Ryu controller: {e}")
         raise
 
-def start_tcpdump(net, dump_dir):
+# tcpdump command capturing interface to dump_file with a capture profile. Files
+# rotated by time are named dump_file.<date-time>, followed by .1, .2, ... when
+# they are rotated by size too; preprocessing reads them back as one capture.
+def tcpdump_command(interface, dump_file, profile):
+    cmd = ["tcpdump", "-i", interface, "-U"]
+    if profile.get("snaplen"):
+        cmd += ["-s", str(profile["snaplen"])]
+    if profile.get("rotate_mb") or profile.get("rotate_seconds"):
+        cmd += ["-Z", "root"]  # Otherwise tcpdump drops to its own user and cannot open the next file
+    if profile.get("rotate_mb"):
+        cmd += ["-C", str(profile["rotate_mb"])]
+    if profile.get("rotate_seconds"):
+        cmd += ["-G", str(profile["rotate_seconds"])]
+        dump_file += ".%Y%m%d-%H%M%S" + ("." if profile.get("rotate_mb") else "")
+    if profile.get("compress"):
+        cmd += ["-z", "gzip"]
+    cmd += ["-w", dump_file]
+    for pattern, bpf_filter in profile.get("filters", {}).items():
+        if fnmatch.fnmatch(interface, pattern):
+            cmd.append(bpf_filter)
+            break
+    return cmd
+
+def start_tcpdump(net, dump_dir, profile=CAPTURE_PROFILES["full"]):
     if not os.path.exists(dump_dir):
         os.makedirs(dump_dir)
     processes = {}
+    # tcpdump is run directly rather than in the background of a shell, so that
+    # stop_tcpdump terminates it and it closes its last file
     for host in net.hosts:
         interface = host.defaultIntf().name
         dump_file = os.path.join(dump_dir, f"{host.name}_traffic.pcap")
-        cmd = f"tcpdump -i {interface} -w {dump_file} -U &"
-        processes[host.name] = host.popen(cmd, shell=True)
+        processes[host.name] = host.popen(tcpdump_command(interface, dump_file, profile))
     for switch in net.switches:
         for intf in switch.intfList():
             if intf.name != "lo":
                 dump_file = os.path.join(dump_dir, f"{switch.name}_{intf.name}_traffic.pcap")
-                cmd = f"tcpdump -i {intf.name} -w {dump_file} -U &"
-                processes[f"{switch.name}_{intf.name}"] = switch.popen(cmd, shell=True)
+                processes[f"{switch.name}_{intf.name}"] = switch.popen(tcpdump_command(intf.name, dump_file, profile))
     return processes
 
 def stop_tcpdump(processes):
@@ -79,6 +149,24 @@ def stop_tcpdump(processes):
         process.terminate()
         process.wait()
 
+# tcpdump -z only compresses the files it rotates out, so gzip the newest
+# uncompressed file of every capture in dump_dir once tcpdump has stopped. The
+# older ones may still be compressed by tcpdump's own gzip and are left to it.
+def compress_last_captures(dump_dir):
+    newest = {}
+    for name in os.listdir(dump_dir):
+        if ".pcap" not in name or name.endswith(".gz"):
+            continue
+        path = os.path.join(dump_dir, name)
+        capture = name.split(".pcap")[0]
+        if capture not in newest or os.path.getmtime(path) > os.path.getmtime(newest[capture]):
+            newest[capture] = path
+    for path in newest.values():
+        with open(path, "rb") as source, gzip.open(path + ".gz", "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.remove(path)
+    logging.info(f"Compressed the last file of {len(newest)} captures in {dump_dir}")
+
 def generate_tcp_traffic(source_host, target_host, payload_size, num_packets, stats):
     packets = 0
     bytes_sent = 0
@@ -118,7 +206,6 @@ def generate_udp_traffic(source_host, target_host, payload_size, num_packets, st
 def generate_http_traffic(source_host, target_host, num_requests, stats):
     packets = 0
     # Use a range of unpredictable source ports for HTTP
-    HTTP_SRC_PORTS = [51000, 51001, 51002]#, 51003, 51004]
     for _ in range(num_requests):
         source_port = random.choice(HTTP_SRC_PORTS)
         # Use --local-port to set the source port for curl
@@ -138,7 +225,14 @@ def start_web_servers(net):
         host.cmd(cmd)
         logging.info(f"Started HTTP server on {host_name} (IP: {host.IP()})")
 
-def start_tcp_servers(net):
+def start_tcp_servers(net, engine="sequential"):
+    if engine == "concurrent":
+        # nc -lk serves one connection at a time, concurrent flows need a threaded sink
+        for host in net.hosts:
+            ports = " ".join(str(port) for port in TCP_DST_PORTS)
+            host.cmd(f"nohup {sys.executable} {LOAD_SENDER} sink --dst-port {ports} > /dev/null 2>&1 &")
+            logging.info(f"Started TCP sink on {host.name}:{ports}")
+        return
     for host in net.hosts:
         for port in TCP_DST_PORTS:
             # Start a TCP server in the background that discards all input
@@ -169,21 +263,175 @@ def start_traffic(net, duration):
 
     logging.info(f"Traffic generation finished. Stats: {stats}")
 
-def repeat_experiment(net, iterations, dump_base_dir):
+# Source ports in use on each host, so two concurrent flows never share one
+class PortPool:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_use = set()
+
+    def acquire(self, host, proto, ports):
+        with self.lock:
+            free = [port for port in ports if (host.name, proto, port) not in self.in_use]
+            if not free:
+                return None
+            port = random.choice(free)
+            self.in_use.add((host.name, proto, port))
+            return port
+
+    def release(self, host, proto, port):
+        with self.lock:
+            self.in_use.discard((host.name, proto, port))
+
+# Run one flow with load_sender.py inside the source host and return its stats.
+# popen starts a separate process in the host's namespace, unlike host.cmd it
+# does not go through the host's single shell, so flows need no lock.
+# profile: [[offset, rate], ...] rate over the flow's lifetime
+def run_flow(src, dst, proto, src_port, dst_port, profile, duration, payload, seed=None):
+    cmd = [sys.executable, LOAD_SENDER, proto, dst.IP(), "--src-port", str(src_port), "--dst-port", str(dst_port),
+           "--profile", json.dumps(profile), "--duration", str(duration),
+           "--payload-min", str(payload[0]), "--payload-max", str(payload[1])]
+    if seed is not None:
+        cmd += ["--seed", str(seed)]
+    process = src.popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    output, error = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(error.strip() or f"exit code {process.returncode}")
+    return json.loads(output.strip().splitlines()[-1])
+
+# One flow slot of the concurrent engine: start flows of proto between random
+# hosts, one after another, until the deadline
+def flow_slot(net, proto, config, deadline, ports, stats, stats_lock):
+    hosts = net.hosts
+    targets = [net.get(name) for name in WEB_HOSTS] if proto == "http" else hosts
+    while time.time() < deadline:
+        dst = random.choice(targets)
+        src = random.choice([host for host in hosts if host != dst])
+        if proto == "tcp":
+            src_ports, dst_port = TCP_SRC_PORTS, random.choice(TCP_DST_PORTS)
+        elif proto == "udp":
+            src_ports, dst_port = UDP_SRC_PORTS, random.choice(UDP_DST_PORTS)
+        else:
+            src_ports, dst_port = HTTP_SRC_PORTS, HTTP_DST_PORT
+        src_port = ports.acquire(src, proto, src_ports)
+        if src_port is None:
+            time.sleep(0.1)  # Every source port of this host is busy, try another pair
+            continue
+        duration = min(random.uniform(*FLOW_DURATION), deadline - time.time())
+        try:
+            if duration <= 0:
+                break
+            result = run_flow(src, dst, proto, src_port, dst_port, [[0, config["rate"]]], duration, config["payload"])
+        except Exception as e:
+            logging.error(f"{proto.upper()} flow {src.name}:{src_port} -> {dst.name}:{dst_port} failed: {e}")
+            time.sleep(1)
+            continue
+        finally:
+            ports.release(src, proto, src_port)
+        with stats_lock:
+            totals = stats[proto].setdefault((src.name, dst.name), {"flows": 0, "packets": 0, "bytes": 0, "errors": 0})
+            totals["flows"] += 1
+            for name in ("packets", "bytes", "errors"):
+                totals[name] += result[name]
+        logging.info(f"{proto.upper()} flow {src.name}:{src_port} -> {dst.name}:{dst_port}: "
+                     f"{result['packets']} packets, {result['bytes']} bytes in {result['seconds']}s")
+
+# Concurrent load engine: load[proto]["flows"] flows of every protocol run at the
+# same time for duration seconds, each a long-lived load_sender.py process
+# sending at load[proto]["rate"] packets (HTTP: requests) per second
+def start_traffic_concurrent(net, duration, load=DEFAULT_LOAD):
+    deadline = time.time() + duration
+    stats = {proto: {} for proto in load}
+    stats_lock = threading.Lock()
+    ports = PortPool()
+    slots = [(proto, config) for proto, config in load.items() for _ in range(config["flows"])]
+    with ThreadPoolExecutor(max_workers=max(1, len(slots))) as pool:
+        futures = [pool.submit(flow_slot, net, proto, config, deadline, ports, stats, stats_lock)
+                   for proto, config in slots]
+        for future in futures:
+            future.result()
+    for proto, pairs in stats.items():
+        packets = sum(totals["packets"] for totals in pairs.values())
+        nbytes = sum(totals["bytes"] for totals in pairs.values())
+        logging.info(f"{proto.upper()} load: {packets} packets, {nbytes} bytes "
+                     f"({nbytes * 8 / duration / 1e6:.2f} Mbit/s on average)")
+    logging.info(f"Traffic generation finished. Stats: {stats}")
+    return stats
+
+# Run the flows of one iteration of a schedule (see scenarios.py), each started
+# at its scheduled time on its own thread
+def run_schedule_iteration(net, iteration):
+    flows = iteration["flows"]
+    stats = {}
+    stats_lock = threading.Lock()
+    # As many threads as flows overlap at most
+    events = sorted([(flow["start"], 1) for flow in flows] + [(flow["start"] + flow["duration"], -1) for flow in flows],
+                    key=lambda event: (event[0], event[1]))
+    running = peak = 0
+    for _, change in events:
+        running += change
+        peak = max(peak, running)
+
+    def run(flow):
+        src, dst = net.get(flow["src"]), net.get(flow["dst"])
+        try:
+            result = run_flow(src, dst, flow["protocol"], flow["src_port"], flow["dst_port"], flow["profile"],
+                              flow["duration"], flow["payload"], flow["seed"])
+        except Exception as e:
+            logging.error(f"{flow['protocol'].upper()} flow {flow['src']}:{flow['src_port']} -> "
+                          f"{flow['dst']}:{flow['dst_port']} failed: {e}")
+            return
+        with stats_lock:
+            totals = stats.setdefault(flow["protocol"], {"flows": 0, "packets": 0, "bytes": 0, "errors": 0})
+            totals["flows"] += 1
+            for name in ("packets", "bytes", "errors"):
+                totals[name] += result[name]
+
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, peak)) as pool:
+        for flow in flows:
+            delay = start_time + flow["start"] - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(run, flow)
+    for proto, totals in sorted(stats.items()):
+        logging.info(f"{proto.upper()} load: {totals['flows']} flows, {totals['packets']} packets, {totals['bytes']} bytes "
+                     f"({totals['bytes'] * 8 / iteration['duration'] / 1e6:.2f} Mbit/s on average), {totals['errors']} errors")
+    return stats
+
+# Schedule of a scenario file for this topology
+def schedule_for(net_hosts, scenario_file):
+    return build_schedule(load_json(scenario_file), [host.name for host in net_hosts], WEB_HOSTS, PROTOCOL_PORTS)
+
+def repeat_experiment(net, iterations, dump_base_dir, engine="sequential", load=DEFAULT_LOAD, schedule=None,
+                      capture=CAPTURE_PROFILES["full"]):
+    if schedule is not None:
+        # Keep the exact schedule next to the captures it produced, to replay it later
+        save_json(os.path.join(dump_base_dir, SCHEDULE_NAME), schedule)
+        iterations = len(schedule["iterations"])
     for i in range(iterations):
-        duration = random.randint(90, 300)  # Generate a new random duration for each iteration
+        if schedule is not None:
+            duration = schedule["iterations"][i]["duration"]
+        else:
+            duration = random.randint(90, 300)  # Generate a new random duration for each iteration
         logging.info(f"Starting iteration {i + 1}/{iterations} (duration: {duration}s)...")
         dump_dir = os.path.join(dump_base_dir, f"iteration_{i + 1}")
-        tcpdump_processes = start_tcpdump(net, dump_dir)
+        tcpdump_processes = start_tcpdump(net, dump_dir, capture)
         time.sleep(2)
         try:
             logging.info(f"Generating traffic for iteration {i + 1} (duration: {duration}s)...")
-            start_traffic(net, duration)
+            if schedule is not None:
+                run_schedule_iteration(net, schedule["iterations"][i])
+            elif engine == "concurrent":
+                start_traffic_concurrent(net, duration, load)
+            else:
+                start_traffic(net, duration)
         except Exception as e:
             logging.error(f"Traffic generation failed in iteration {i + 1}: {e}")
         finally:
             stop_tcpdump(tcpdump_processes)
             logging.info(f"Tcpdump processes for iteration {i + 1} stopped.")
+            if capture.get("compress"):
+                compress_last_captures(dump_dir)
         time.sleep(5)
     logging.info("All iterations completed.")
 
@@ -194,7 +442,11 @@ def check_hping3_installed(net):
             raise RuntimeError(f"hping3 is not installed on {host.name}. Please install it before proceeding.")
         logging.info(f"hping3 is installed on {host.name}.")
 
-def start():
+# scenario: scenario file (see scenarios.py) expanded into a schedule once the hosts exist
+# schedule: schedule dumped by an earlier run, replayed exactly
+# capture: capture profile of tcpdump (see CAPTURE_PROFILES)
+def start(iterations=40, engine="sequential", load=DEFAULT_LOAD, scenario=None, schedule=None, dump_schedule=None,
+          capture=CAPTURE_PROFILES["full"]):
     setLogLevel("info")
     os.system("sudo mn -c")
     ryu_process = start_ryu_controller()
@@ -211,15 +463,21 @@ def start():
         time.sleep(5)
         check_hping3_installed(net)
         start_web_servers(net)
-        start_tcp_servers(net)  # Start TCP servers on all hosts
-        iterations = 40
+        if scenario is not None:
+            schedule = schedule_for(net.hosts, scenario)
+        if schedule is not None:
+            engine = "concurrent"
+            describe_schedule(schedule)
+            if dump_schedule:
+                save_json(dump_schedule, schedule)
+        start_tcp_servers(net, engine)  # Start TCP servers on all hosts
         current_time = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
         base_dir = os.path.join(os.getcwd(), "traffic_records")
         if not os.path.exists(base_dir):
             os.makedirs(base_dir)
         dump_base_dir = os.path.join(base_dir, current_time)
         os.makedirs(dump_base_dir, exist_ok=True)
-        repeat_experiment(net, iterations, dump_base_dir)  
+        repeat_experiment(net, iterations, dump_base_dir, engine, load, schedule, capture)
     finally:
         net.stop()
         logging.info("Network stopped and cleaned up.")
@@ -227,6 +485,56 @@ def start():
             ryu_process.terminate()
 
 if __name__ == "__main__":
-    start()
+    parser = argparse.ArgumentParser(description="Run the SDN topology, generate traffic and capture it")
+    parser.add_argument("--iterations", type=int, default=40)
+    parser.add_argument("--engine", choices=["sequential", "concurrent"], default="sequential",
+                        help="'sequential' sends one flow at a time with a process per packet, "
+                             "'concurrent' runs many long-lived flows at the target rates below")
+    for proto, config in DEFAULT_LOAD.items():
+        unit = "requests" if proto == "http" else "packets"
+        parser.add_argument(f"--{proto}-flows", type=int, default=config["flows"],
+                            help=f"Concurrent {proto.upper()} flows (default: {config['flows']})")
+        parser.add_argument(f"--{proto}-rate", type=float, default=config["rate"],
+                            help=f"{unit.capitalize()} per second of each {proto.upper()} flow (default: {config['rate']})")
+    parser.add_argument("--seed", type=int, help="Seed of the random choices of the sequential and concurrent engines")
+    parser.add_argument("--scenario", help="Run the traffic described by this scenario file (see scenarios.py)")
+    parser.add_argument("--replay", metavar="SCHEDULE", help="Replay a schedule.json saved by an earlier scenario run")
+    parser.add_argument("--dump-schedule", metavar="FILE", help="Also save the generated schedule to FILE")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="With --scenario, only print and save the schedule, without starting the network")
+    parser.add_argument("--capture-profile", choices=CAPTURE_PROFILES, default="full",
+                        help="tcpdump settings: 'full' keeps whole packets in one file per interface, 'headers' only "
+                             "headers, 'rotating' headers in gzipped files of a minute, 'flows' only TCP/UDP headers")
+    parser.add_argument("--snaplen", type=int, help="Bytes kept of every packet, overriding the profile")
+    parser.add_argument("--capture-filter", metavar="BPF", help="BPF filter of every interface, overriding the profile")
+    parser.add_argument("--rotate-mb", type=int, help="Start a new capture file every this many MB")
+    parser.add_argument("--rotate-seconds", type=int, help="Start a new capture file every this many seconds")
+    parser.add_argument("--compress", action="store_true", help="gzip every capture file once it is closed")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    schedule = load_schedule(args.replay) if args.replay else None
+    if args.dry_run:
+        if not args.scenario:
+            parser.error("--dry-run needs --scenario")
+        schedule = build_schedule(load_json(args.scenario), HOSTS, WEB_HOSTS, PROTOCOL_PORTS)
+        describe_schedule(schedule)
+        if args.dump_schedule:
+            save_json(args.dump_schedule, schedule)
+        sys.exit(0)
+
+    load = {proto: dict(config, flows=getattr(args, f"{proto}_flows"), rate=getattr(args, f"{proto}_rate"))
+            for proto, config in DEFAULT_LOAD.items()}
+    load = {proto: config for proto, config in load.items() if config["flows"] > 0 and config["rate"] > 0}
+    capture = dict(CAPTURE_PROFILES[args.capture_profile])
+    for key in ("snaplen", "rotate_mb", "rotate_seconds"):
+        if getattr(args, key) is not None:
+            capture[key] = getattr(args, key)
+    if args.capture_filter:
+        capture["filters"] = {"*": args.capture_filter}
+    if args.compress:
+        capture["compress"] = True
+    start(args.iterations, args.engine, load, args.scenario, schedule, args.dump_schedule, capture)
     
     
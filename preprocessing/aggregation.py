@@ -0,0 +1,265 @@
+from array import array
+from collections import OrderedDict, defaultdict
+
+COLUMNS = ['Timestamp', 'Throughput (Bps)', 'Jitter (s)', 'Avg Packet Size (bytes)', 'Packet Count', 'Protocol Distribution',
+           'Delay (s)', 'Source IP', 'Destination IP', 'Source MAC', 'Destination MAC', 'Ingress Port', 'Egress Port',
+           'Source Port', 'Destination Port', 'Protocol']
+
+AGGREGATIONS = ('flow', 'window')
+
+# Flows with no packet for this many seconds are dropped from the flow table
+FLOW_IDLE_TIMEOUT = 60
+# Upper bound on tracked flows; the least recently seen idle flow makes room for a new one
+MAX_FLOWS = 65536
+
+
+# Short name of a window size, e.g. 0.1 -> '100ms', 10 -> '10s'
+def window_label(window_size):
+    if window_size < 1:
+        return f"{window_size * 1000:g}ms"
+    return f"{window_size:g}s"
+
+
+# Aggregates packets into fixed time windows using running sums only, so memory
+# does not depend on how many packets fall into a window
+class WindowAggregator:
+    def __init__(self, window_size=1):
+        self.window_size = window_size
+        self.current_window = None
+        self.last_timestamp = None
+        self.reset()
+
+    def reset(self):
+        self.byte_count = 0
+        self.packet_count = 0
+        self.gap_sum = 0.0
+        self.window_last_timestamp = None
+        self.protocol_counts = defaultdict(int)
+        self.last_delay = 0
+        self.last_packet = None
+        self.last_protocol = None
+
+    # Add a packet; returns the rows of the previous window if this packet closed it
+    def add(self, packet):
+        timestamp = packet.timestamp
+        # UDP packets are always reported as UDP, whatever they carry
+        protocol = 'UDP' if packet.transport == 'UDP' else packet.protocol
+
+        delay = (timestamp - self.last_timestamp) if self.last_timestamp is not None else 0
+        self.last_timestamp = timestamp
+
+        rows = []
+        window = window_index(timestamp, self.window_size)
+        if self.current_window is not None and window != self.current_window:
+            rows = self.flush()
+        self.current_window = window
+
+        self.byte_count += packet.length
+        self.packet_count += 1
+        if self.window_last_timestamp is not None:
+            self.gap_sum += abs(timestamp - self.window_last_timestamp)
+        self.window_last_timestamp = timestamp
+        self.protocol_counts[protocol] += 1
+        self.last_delay = delay
+        self.last_packet = packet
+        self.last_protocol = protocol
+        return rows
+
+    # Close the current window and return its row (none if it is empty)
+    def flush(self):
+        if self.packet_count == 0:
+            return []
+
+        throughput = self.byte_count / self.window_size
+        avg_packet_size = self.byte_count / self.packet_count
+        # Jitter is the mean absolute gap between consecutive packets of the window
+        jitter = self.gap_sum / (self.packet_count - 1) if self.packet_count > 1 else 0
+        protocol_distribution = {k: v / self.packet_count for k, v in self.protocol_counts.items()}
+
+        p = self.last_packet
+        row = [window_start(self.current_window, self.window_size), throughput, jitter, avg_packet_size,
+               self.packet_count, protocol_distribution, self.last_delay, p.src_ip, p.dst_ip, p.src_mac, p.dst_mac,
+               p.ingress_port, p.egress_port, p.src_port, p.dst_port, self.last_protocol]
+        self.reset()
+        return [row]
+
+
+# Aggregates packets per flow (src IP, dst IP, src port, dst port, protocol) and
+# per window, emitting one row for every flow seen in a window.
+# Flow counters live in a slot-based table: each flow owns a slot index into
+# column arrays, and slots of flows evicted for being idle are reused.
+class FlowAggregator:
+    def __init__(self, window_size=1, idle_timeout=FLOW_IDLE_TIMEOUT, max_flows=MAX_FLOWS):
+        self.window_size = window_size
+        self.idle_timeout = idle_timeout
+        self.max_flows = max_flows
+        self.current_window = None
+        self.slots = OrderedDict()  # flow key -> slot, least recently seen first
+        self.free = []
+        self.active = []  # slots with packets in the current window, in order of arrival
+
+        self.keys = []
+        self.byte_count = array('q')
+        self.packet_count = array('q')
+        self.gap_sum = array('d')
+        self.window_last_timestamp = array('d')
+        self.last_timestamp = array('d')
+        self.last_delay = array('d')
+        self.protocol_counts = []
+        self.last_packet = []
+
+    # Add a packet; returns the rows of the previous window if this packet closed it
+    def add(self, packet):
+        timestamp = packet.timestamp
+        # UDP packets are always reported as UDP, whatever they carry
+        protocol = 'UDP' if packet.transport == 'UDP' else packet.protocol
+
+        rows = []
+        window = window_index(timestamp, self.window_size)
+        if self.current_window is not None and window != self.current_window:
+            rows = self.flush()
+        self.current_window = window
+
+        key = (packet.src_ip, packet.dst_ip, packet.src_port, packet.dst_port, packet.transport or protocol)
+        slot = self.slot_for(key, timestamp)
+        if self.packet_count[slot] == 0:
+            self.active.append(slot)
+        else:
+            self.gap_sum[slot] += abs(timestamp - self.window_last_timestamp[slot])
+        self.window_last_timestamp[slot] = timestamp
+        # Delay is measured from the previous packet of the same flow
+        self.last_delay[slot] = timestamp - self.last_timestamp[slot]
+        self.last_timestamp[slot] = timestamp
+
+        self.byte_count[slot] += packet.length
+        self.packet_count[slot] += 1
+        self.protocol_counts[slot][protocol] += 1
+        self.last_packet[slot] = packet
+        return rows
+
+    # Close the current window and return one row per flow active in it
+    def flush(self):
+        if not self.active:
+            return []
+        start = window_start(self.current_window, self.window_size)
+        rows = [self.flow_row(slot, start) for slot in self.active]
+        for slot in self.active:
+            self.byte_count[slot] = 0
+            self.packet_count[slot] = 0
+            self.gap_sum[slot] = 0.0
+            self.protocol_counts[slot] = defaultdict(int)
+        self.active = []
+        self.evict_idle((self.current_window + 1) * self.window_size)
+        return rows
+
+    def flow_row(self, slot, start):
+        packet_count = self.packet_count[slot]
+        byte_count = self.byte_count[slot]
+        jitter = self.gap_sum[slot] / (packet_count - 1) if packet_count > 1 else 0
+        protocol_distribution = {k: v / packet_count for k, v in self.protocol_counts[slot].items()}
+        src_ip, dst_ip, src_port, dst_port, protocol = self.keys[slot]
+        p = self.last_packet[slot]
+        return [start, byte_count / self.window_size, jitter, byte_count / packet_count, packet_count,
+                protocol_distribution, self.last_delay[slot], src_ip, dst_ip, p.src_mac, p.dst_mac, p.ingress_port,
+                p.egress_port, src_port, dst_port, protocol]
+
+    def slot_for(self, key, timestamp):
+        slot = self.slots.get(key)
+        if slot is not None:
+            self.slots.move_to_end(key)
+            return slot
+
+        if len(self.slots) >= self.max_flows:
+            self.evict_oldest()
+        if self.free:
+            slot = self.free.pop()
+            self.byte_count[slot] = 0
+            self.packet_count[slot] = 0
+            self.gap_sum[slot] = 0.0
+            self.keys[slot] = key
+            self.protocol_counts[slot] = defaultdict(int)
+        else:
+            slot = len(self.keys)
+            self.byte_count.append(0)
+            self.packet_count.append(0)
+            self.gap_sum.append(0.0)
+            self.window_last_timestamp.append(0.0)
+            self.last_timestamp.append(0.0)
+            self.last_delay.append(0.0)
+            self.keys.append(key)
+            self.protocol_counts.append(defaultdict(int))
+            self.last_packet.append(None)
+        self.last_timestamp[slot] = timestamp
+        self.slots[key] = slot
+        return slot
+
+    # Drop flows that have been silent for longer than the idle timeout
+    def evict_idle(self, now):
+        while self.slots:
+            key, slot = next(iter(self.slots.items()))
+            if now - self.last_timestamp[slot] <= self.idle_timeout:
+                break
+            self.release(key)
+
+    # Make room for a new flow. If even the least recently seen flow has packets
+    # in the current window then all of them do, and the table is allowed to grow.
+    def evict_oldest(self):
+        key, slot = next(iter(self.slots.items()))
+        if self.packet_count[slot] == 0:
+            self.release(key)
+
+    def release(self, key):
+        slot = self.slots.pop(key)
+        self.keys[slot] = None
+        self.protocol_counts[slot] = None
+        self.last_packet[slot] = None
+        self.free.append(slot)
+
+
+# Window a timestamp falls into, computed on integer microseconds: float
+# division misplaces packets at sub-second boundaries (1700000000.3 / 0.1
+# floors to ...002 instead of ...003)
+def window_index(timestamp, window_size):
+    return round(timestamp * 1e6) // round(window_size * 1e6)
+
+
+# Start time of a window; integer window sizes keep integer timestamps
+def window_start(index, window_size):
+    start = index * window_size
+    return start if isinstance(start, int) else round(start, 9)
+
+
+def make_aggregator(window_size, aggregation='flow'):
+    if aggregation == 'flow':
+        return FlowAggregator(window_size)
+    if aggregation == 'window':
+        return WindowAggregator(window_size)
+    raise ValueError(f"Unknown aggregation '{aggregation}', expected one of {AGGREGATIONS}")
+
+
+# Turn a stream of packets into a stream of rows (in COLUMNS order), yielding
+# each window as soon as the first packet of the next one arrives.
+# 'flow' aggregation gives one row per flow and window, 'window' one row per window.
+def iter_windows(packets, window_size=1, source=None, aggregation='flow'):
+    for _, row in iter_windows_multi(packets, [window_size], source, aggregation):
+        yield row
+
+
+# Aggregate the same packets at several window sizes in a single pass,
+# yielding (window_size, row) pairs
+def iter_windows_multi(packets, window_sizes, source=None, aggregation='flow'):
+    aggregators = [make_aggregator(window_size, aggregation) for window_size in window_sizes]
+    for packet in packets:
+        for aggregator in aggregators:
+            try:
+                rows = aggregator.add(packet)
+            except Exception as e:
+                print(f"Error analyzing a packet in {source}: {e}")
+                continue  # Only this aggregator drops the packet
+            for row in rows:
+                yield aggregator.window_size, row
+
+    # Process any remaining data after the last packet
+    for aggregator in aggregators:
+        for row in aggregator.flush():
+            yield aggregator.window_size, row
@@ -0,0 +1,129 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from switch_ids import switch_id_from_filename
+
+OUTPUT_FORMATS = ('csv', 'parquet', 'feather')
+FORMAT_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+
+# Protocols that get their own share column; anything else is summed into 'Other'
+SHARE_PROTOCOLS = ['TCP', 'UDP', 'HTTP', 'DATA', 'ARP', 'STP', 'ICMP', 'ICMPV6', 'LLDP', 'OPENFLOW_V4']
+SHARE_COLUMNS = [f'Protocol Share {name}' for name in SHARE_PROTOCOLS] + ['Protocol Share Other']
+
+# Rows per Parquet row group / Arrow record batch
+COLUMNAR_BATCH_ROWS = 65536
+
+
+def feature_schema():
+    import pyarrow as pa
+
+    category = pa.dictionary(pa.int32(), pa.string())
+    fields = [
+        ('Timestamp', pa.float64()),
+        ('Throughput (Bps)', pa.float64()),
+        ('Jitter (s)', pa.float64()),
+        ('Avg Packet Size (bytes)', pa.float64()),
+        ('Packet Count', pa.int64()),
+        ('Delay (s)', pa.float64()),
+        ('Source IP', pa.string()),
+        ('Destination IP', pa.string()),
+        ('Source MAC', pa.string()),
+        ('Destination MAC', pa.string()),
+        ('Ingress Port', pa.int64()),  # OpenFlow reserved ports (OFPP_*) exceed int32
+        ('Egress Port', pa.int64()),
+        ('Source Port', pa.int32()),
+        ('Destination Port', pa.int32()),
+        ('Protocol', category),
+        ('Switch ID', category),
+    ]
+    fields += [(name, pa.float64()) for name in SHARE_COLUMNS]
+    return pa.schema(fields)
+
+
+def optional_int(value):
+    return None if value is None or value == '' else int(value)
+
+
+# Typed columnar counterpart of the CSV FeatureWriter: numeric ports, categorical
+# protocol/switch columns and the protocol distribution spread over share columns.
+# Rows are written in record batches as they arrive, to a .tmp file renamed at the end.
+class ColumnarFeatureWriter:
+    def __init__(self, output_file, file_format):
+        if file_format not in ('parquet', 'feather'):
+            raise ValueError(f"Unsupported columnar format '{file_format}'")
+        self.output_file = output_file
+        self.tmp_file = output_file + '.tmp'
+        self.file_format = file_format
+        self.switch_id = switch_id_from_filename(output_file)
+        self.schema = None
+        self.writer = None
+        self.batch = []
+
+    def __enter__(self):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(f"pyarrow is required to write {self.file_format} feature files") from None
+
+        os.makedirs(os.path.dirname(self.output_file) or '.', exist_ok=True)
+        self.schema = feature_schema()
+        if self.file_format == 'parquet':
+            self.writer = pq.ParquetWriter(self.tmp_file, self.schema, compression='zstd')
+        else:
+            # Uncompressed Arrow IPC (Feather v2) so readers can memory-map it
+            self.writer = pa.ipc.new_file(self.tmp_file, self.schema)
+        return self
+
+    def write(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= COLUMNAR_BATCH_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        import pyarrow as pa
+
+        rows = self.batch
+        columns = [
+            [row[0] for row in rows],
+            [row[1] for row in rows],
+            [row[2] for row in rows],
+            [row[3] for row in rows],
+            [row[4] for row in rows],
+            [row[6] for row in rows],
+            [row[7] for row in rows],
+            [row[8] for row in rows],
+            [row[9] for row in rows],
+            [row[10] for row in rows],
+            [optional_int(row[11]) for row in rows],
+            [optional_int(row[12]) for row in rows],
+            [optional_int(row[13]) for row in rows],
+            [optional_int(row[14]) for row in rows],
+            [row[15] for row in rows],
+            [self.switch_id] * len(rows),
+        ]
+        shares = [[0.0] * len(rows) for _ in SHARE_COLUMNS]
+        other = len(SHARE_PROTOCOLS)
+        for i, row in enumerate(rows):
+            for protocol, share in row[5].items():
+                index = SHARE_PROTOCOLS.index(protocol) if protocol in SHARE_PROTOCOLS else other
+                shares[index][i] += share
+        columns += shares
+
+        arrays = [pa.array(values, type=field.type) for values, field in zip(columns, self.schema)]
+        self.writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+        self.batch = []
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.writer.close()
+            os.remove(self.tmp_file)
+            return False
+        self.flush()
+        self.writer.close()
+        os.replace(self.tmp_file, self.output_file)
+        print(f"Data saved to '{self.output_file}'")
+        return False
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = '.features_manifest.json'
+
+# Bump whenever the extracted features or the output layout change, so that
+# existing outputs are regenerated on the next run
+FEATURES_VERSION = 3
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_state(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+# State and hash of a capture made of one or more segments (rotated tcpdump
+# files); a single file gives the same values as source_state and file_digest,
+# so existing manifest entries stay valid
+def capture_state(segments):
+    if len(segments) == 1:
+        return source_state(segments[0])
+    states = [source_state(segment) for segment in segments]
+    return {'size': sum(state['size'] for state in states), 'mtime': max(state['mtime'] for state in states),
+            'segments': len(segments)}
+
+
+def capture_digest(segments):
+    if len(segments) == 1:
+        return file_digest(segments[0])
+    digest = hashlib.sha256()
+    for segment in segments:
+        digest.update(file_digest(segment).encode())
+    return digest.hexdigest()
+
+
+# Index of the feature files in an output folder and of the captures they were
+# built from, used to skip captures that have already been converted
+class FeatureManifest:
+    def __init__(self, output_folder):
+        self.output_folder = output_folder
+        self.path = os.path.join(output_folder, MANIFEST_NAME)
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f).get('outputs', {})
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable manifest {self.path}: {e}")
+
+    def key(self, output_file):
+        return os.path.relpath(output_file, self.output_folder)
+
+    # An output is up to date if it was fully written from the same capture
+    # with the same settings. Size and mtime are checked first; the content
+    # hash is only computed when the capture was touched but may be unchanged.
+    # segments: files of a rotated capture, if it is not input_file alone.
+    def is_up_to_date(self, input_file, output_file, settings, segments=None):
+        segments = segments or [input_file]
+        entry = self.entries.get(self.key(output_file))
+        if entry is None or entry.get('features_version') != FEATURES_VERSION or entry.get('settings') != settings:
+            return False
+        if entry.get('source') != os.path.abspath(input_file):
+            return False
+        if not os.path.exists(output_file) or os.path.getsize(output_file) != entry.get('output_size'):
+            return False
+
+        state = capture_state(segments)
+        if state['size'] != entry.get('size') or state.get('segments', 1) != entry.get('segments', 1):
+            return False
+        if state['mtime'] != entry.get('mtime'):
+            if capture_digest(segments) != entry.get('sha256'):
+                return False
+            entry['mtime'] = state['mtime']
+        return True
+
+    def record(self, input_file, output_file, settings, state, sha256):
+        entry = self.entries[self.key(output_file)] = {
+            'source': os.path.abspath(input_file),
+            'size': state['size'],
+            'mtime': state['mtime'],
+            'sha256': sha256,
+            'settings': settings,
+            'features_version': FEATURES_VERSION,
+            'output_size': os.path.getsize(output_file),
+        }
+        if 'segments' in state:
+            entry['segments'] = state['segments']
+
+    def forget(self, output_file):
+        self.entries.pop(self.key(output_file), None)
+
+    # Written to a temporary file first so an interrupted run never leaves a broken manifest
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'features_version': FEATURES_VERSION, 'outputs': self.entries}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,555 @@
+import gzip
+import io
+import os
+import re
+import socket
+import struct
+import time
+from collections import namedtuple
+
+# Fields extracted from every packet, whatever engine decoded it
+Packet = namedtuple('Packet', ['timestamp', 'length', 'protocol', 'transport', 'src_ip', 'dst_ip', 'src_mac', 'dst_mac',
+                               'ingress_port', 'egress_port', 'src_port', 'dst_port'])
+
+ENGINES = ('native', 'pyshark')
+
+# libpcap / pcapng constants
+PCAP_MAGIC_USEC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_IDB = 0x00000001
+PCAPNG_PB = 0x00000002
+PCAPNG_SPB = 0x00000003
+PCAPNG_EPB = 0x00000006
+
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+ETH_P_IP = 0x0800
+ETH_P_ARP = 0x0806
+ETH_P_IPV6 = 0x86dd
+ETH_P_LLDP = 0x88cc
+ETH_P_VLAN = (0x8100, 0x88a8, 0x9100)
+
+OPENFLOW_PORTS = (6633, 6653)
+OPENFLOW_LAYERS = ('openflow', 'openflow_v1', 'openflow_v4', 'openflow_v5')
+OPENFLOW_VERSIONS = {1: 'OPENFLOW_V1', 4: 'OPENFLOW_V4', 5: 'OPENFLOW_V5'}
+STP_MAC = b'\x01\x80\xc2\x00\x00\x00'
+
+# Application layer names reported for well-known ports, mirroring tshark's highest layer
+TCP_APPLICATIONS = {80: 'HTTP'}
+UDP_APPLICATIONS = {53: 'DNS', 67: 'DHCP', 68: 'DHCP', 123: 'NTP', 546: 'DHCPV6', 547: 'DHCPV6', 1900: 'SSDP', 5353: 'MDNS'}
+IPV6_EXTENSION_HEADERS = (0, 43, 60)
+
+READ_BUFFER_SIZE = 1 << 20
+
+ETH_HEADER = struct.Struct('!6s6sH')
+IPV4_HEADER = struct.Struct('!BBHHHBBH4s4s')
+IPV6_HEADER = struct.Struct('!IHBB16s16s')
+PORTS_HEADER = struct.Struct('!HH')
+SLL_HEADER = struct.Struct('!HHH8sH')
+SLL2_HEADER = struct.Struct('!HHIHBB8s')
+
+# Files tcpdump writes for one capture: name.pcap, then name.pcap1, name.pcap2, ...
+# when rotating by size (-C), name.pcap.<date-time> when rotating by time (-G,
+# as traffic_gen.py names them), each optionally gzipped (-z gzip)
+SEGMENT_PATTERN = re.compile(r'^(?P<capture>.+\.pcap)(?P<suffix>[\d.-]*)(?P<gz>\.gz)?$')
+
+
+# Open a capture and yield Packet records using the selected engine
+def read_packets(pcap_file, engine='native'):
+    if engine == 'native':
+        return read_packets_native(pcap_file)
+    if engine == 'pyshark':
+        return read_packets_pyshark(pcap_file)
+    raise ValueError(f"Unknown pcap reader engine '{engine}', expected one of {ENGINES}")
+
+
+# Rotation number and/or date-time of a segment, compared as numbers (name.pcap2
+# comes before name.pcap10)
+def segment_order(path):
+    suffix = SEGMENT_PATTERN.match(os.path.basename(path)).group('suffix')
+    return tuple(int(number) for number in re.findall(r'\d+', suffix))
+
+
+# Segments of a capture in the order they were written. With settle_seconds, the
+# last segment is left out while it was modified that recently, since tcpdump may
+# still be writing it; closed segments of a running capture can be read already.
+def capture_segments(capture_path, settle_seconds=0):
+    folder = os.path.dirname(capture_path) or '.'
+    name = os.path.basename(capture_path)
+    filenames = set(os.listdir(folder))
+    segments = []
+    for filename in filenames:
+        match = SEGMENT_PATTERN.match(filename)
+        if match is None or match.group('capture') != name:
+            continue
+        # A .gz next to its uncompressed segment is still being written by gzip
+        if match.group('gz') and filename[:-3] in filenames:
+            continue
+        segments.append(os.path.join(folder, filename))
+    segments.sort(key=segment_order)
+    if settle_seconds and segments and not segments[-1].endswith('.gz') \
+            and time.time() - os.path.getmtime(segments[-1]) < settle_seconds:
+        segments.pop()
+    return segments
+
+
+# Read the segments of a rotated capture back to back as one packet stream. The
+# first one is opened right away, so a broken capture fails like read_packets.
+def read_capture(segments, engine='native'):
+    return chain_segments(read_packets(segments[0], engine), segments[1:], engine)
+
+
+def chain_segments(first, segments, engine):
+    yield from first
+    for segment in segments:
+        yield from read_packets(segment, engine)
+
+
+# --- pyshark engine (full tshark dissection of every packet) ---
+
+def read_packets_pyshark(pcap_file):
+    import pyshark
+
+    capture = pyshark.FileCapture(pcap_file, keep_packets=False)
+    try:
+        for packet in capture:
+            try:
+                decoded = packet_from_pyshark(packet)
+            except AttributeError:
+                print(f"Packet skipped due to missing or corrupted data in file {pcap_file}.")
+                continue
+            except Exception as e:
+                print(f"Error analyzing a packet in {pcap_file}: {e}")
+                continue
+            yield decoded
+    finally:
+        capture.close()
+
+
+def packet_from_pyshark(packet):
+    transport = None
+    src_port = None
+    dst_port = None
+    if hasattr(packet, 'udp'):
+        transport = 'UDP'
+        src_port = packet.udp.srcport
+        dst_port = packet.udp.dstport
+    elif hasattr(packet, 'tcp'):
+        transport = 'TCP'
+        src_port = packet.tcp.srcport
+        dst_port = packet.tcp.dstport
+    ingress_port, egress_port = openflow_ports(packet)
+
+    return Packet(
+        timestamp=float(packet.sniff_timestamp),
+        length=int(packet.length),
+        protocol=packet.highest_layer,
+        transport=transport,
+        src_ip=packet.ip.src if hasattr(packet, 'ip') else None,
+        dst_ip=packet.ip.dst if hasattr(packet, 'ip') else None,
+        src_mac=packet.eth.src if hasattr(packet, 'eth') else None,
+        dst_mac=packet.eth.dst if hasattr(packet, 'eth') else None,
+        ingress_port=ingress_port,
+        egress_port=egress_port,
+        src_port=src_port,
+        dst_port=dst_port,
+    )
+
+
+# Look for in_port/out_port in whichever OpenFlow layer tshark produced
+def openflow_ports(packet):
+    for layer_name in OPENFLOW_LAYERS:
+        if hasattr(packet, layer_name):
+            layer = getattr(packet, layer_name)
+            ingress_port = layer.in_port if hasattr(layer, 'in_port') else None
+            egress_port = layer.out_port if hasattr(layer, 'out_port') else None
+            return ingress_port, egress_port
+    return None, None
+
+
+# Dissects OpenFlow frames with tshark, but only if the capture contains any.
+# The tshark process is started on the first request and filtered to OpenFlow
+# frames, so regular data-plane traffic never goes through full dissection.
+class OpenFlowDissector:
+    def __init__(self, pcap_file):
+        self.pcap_file = pcap_file
+        self.capture = None
+        self.packets = None
+        self.pending = None
+        self.available = True
+
+    def ports(self, frame_number):
+        if not self.available:
+            return None, None
+        if self.packets is None:
+            try:
+                import pyshark
+                self.capture = pyshark.FileCapture(self.pcap_file, keep_packets=False,
+                                                   display_filter=' || '.join(OPENFLOW_LAYERS[1:]))
+                self.packets = iter(self.capture)
+            except Exception as e:
+                print(f"OpenFlow dissection unavailable for {self.pcap_file}: {e}")
+                self.available = False
+                return None, None
+
+        # Both readers walk the file in order, so advance until the frame numbers meet
+        while True:
+            if self.pending is None:
+                self.pending = next(self.packets, None)
+                if self.pending is None:
+                    return None, None
+            number = int(self.pending.number)
+            if number > frame_number:
+                return None, None
+            packet, self.pending = self.pending, None
+            if number == frame_number:
+                return openflow_ports(packet)
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.close()
+
+
+# --- native engine (struct-based libpcap/pcapng parsing) ---
+
+def read_packets_native(pcap_file):
+    # Headers are checked right away so unreadable files fail when opened, not halfway through
+    if pcap_file.endswith('.gz'):
+        f = gzip.open(pcap_file, 'rb')
+    else:
+        f = open(pcap_file, 'rb', buffering=READ_BUFFER_SIZE)
+    try:
+        records = open_records(f, pcap_file)
+    except Exception:
+        f.close()
+        raise
+    return iter_native_packets(f, records, pcap_file)
+
+
+# Follow a capture that is still being written (tcpdump -w ... -U) and yield its
+# packets as they are appended. Reading stops once stop is set or no data arrived
+# for idle_timeout seconds. OpenFlow frames are not dissected with tshark here,
+# since it could only see the part of the file written when it started.
+def read_packets_live(pcap_file, poll_interval=0.1, idle_timeout=None, stop=None):
+    while not os.path.exists(pcap_file):
+        if stop is not None and stop.is_set():
+            return iter(())
+        time.sleep(poll_interval)
+    f = FollowFile(open(pcap_file, 'rb', buffering=READ_BUFFER_SIZE), poll_interval, idle_timeout, stop)
+    try:
+        records = open_records(f, pcap_file)
+    except Exception:
+        f.close()
+        raise
+    return iter_native_packets(f, records, pcap_file, openflow=False)
+
+
+# File wrapper whose reads wait for the requested bytes to be written instead
+# of returning short at the current end of the file
+class FollowFile:
+    def __init__(self, f, poll_interval=0.1, idle_timeout=None, stop=None):
+        self.f = f
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.stop = stop
+
+    def read(self, size):
+        chunks = []
+        remaining = size
+        last_data = time.monotonic()
+        while remaining > 0:
+            data = self.f.read(remaining)
+            if data:
+                chunks.append(data)
+                remaining -= len(data)
+                last_data = time.monotonic()
+                continue
+            if self.stop is not None and self.stop.is_set():
+                break
+            if self.idle_timeout is not None and time.monotonic() - last_data > self.idle_timeout:
+                break
+            time.sleep(self.poll_interval)
+        return b''.join(chunks)
+
+    def close(self):
+        self.f.close()
+
+
+def iter_native_packets(f, records, pcap_file, openflow=True):
+    openflow = OpenFlowDissector(pcap_file) if openflow else None
+    try:
+        for frame_number, (timestamp, orig_len, linktype, data) in enumerate(records, start=1):
+            try:
+                packet = decode_frame(timestamp, orig_len, linktype, data)
+            except (struct.error, IndexError):
+                print(f"Packet skipped due to missing or corrupted data in file {pcap_file}.")
+                continue
+            if packet is None:
+                continue
+            if openflow is not None and packet.protocol.startswith('OPENFLOW'):
+                ingress_port, egress_port = openflow.ports(frame_number)
+                packet = packet._replace(ingress_port=ingress_port, egress_port=egress_port)
+            yield packet
+    finally:
+        if openflow is not None:
+            openflow.close()
+        f.close()
+
+
+# Read the file header and return an iterator of (timestamp, original length, link type, captured bytes)
+def open_records(f, pcap_file):
+    head = f.read(4)
+    if len(head) < 4:
+        raise ValueError(f"{pcap_file} is empty or truncated")
+    if struct.unpack('<I', head)[0] == PCAPNG_SHB:
+        return iter_pcapng_records(f, pcap_file)
+
+    for endian in ('<', '>'):
+        magic = struct.unpack(endian + 'I', head)[0]
+        if magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+            break
+    else:
+        raise ValueError(f"{pcap_file} is not a pcap or pcapng file")
+
+    rest = f.read(20)
+    if len(rest) < 20:
+        raise ValueError(f"{pcap_file} has a truncated pcap header")
+    linktype = struct.unpack(endian + 'HHiIII', rest)[5] & 0x0FFFFFFF
+    divisor = 1e9 if magic == PCAP_MAGIC_NSEC else 1e6
+    return iter_pcap_records(f, pcap_file, endian, linktype, divisor)
+
+
+def iter_pcap_records(f, pcap_file, endian, linktype, divisor):
+    record_header = struct.Struct(endian + 'IIII')
+    header_size = record_header.size
+
+    while True:
+        header = f.read(header_size)
+        if len(header) < header_size:
+            return
+        ts_sec, ts_frac, incl_len, orig_len = record_header.unpack(header)
+        data = f.read(incl_len)
+        if len(data) < incl_len:
+            print(f"Truncated packet record at the end of {pcap_file}.")
+            return
+        yield ts_sec + ts_frac / divisor, orig_len, linktype, data
+
+
+# Bytes left to read in f, or None when that is not known up front
+# (compressed or still growing captures, where a short read shows the end instead)
+def remaining_bytes(f):
+    if not isinstance(f, io.BufferedReader):
+        return None
+    return os.fstat(f.fileno()).st_size - f.tell()
+
+
+# Smallest body of each block type that carries packets or interfaces
+PCAPNG_MIN_BODY = {PCAPNG_IDB: 8, PCAPNG_EPB: 20, PCAPNG_PB: 20, PCAPNG_SPB: 4}
+
+
+def iter_pcapng_records(f, pcap_file):
+    endian = '<'
+    interfaces = []
+    last_timestamp = 0.0
+    block_type = PCAPNG_SHB
+    while True:
+        length_bytes = f.read(4)
+        if len(length_bytes) < 4:
+            return
+        header_length = 12
+        if block_type == PCAPNG_SHB:
+            # Every section header may switch byte order and resets the interface list
+            body_start = f.read(4)
+            if len(body_start) < 4:
+                print(f"Truncated block at the end of {pcap_file}.")
+                return
+            endian = '<' if struct.unpack('<I', body_start)[0] == PCAPNG_BYTE_ORDER_MAGIC else '>'
+            header_length = 16
+        total_length = struct.unpack(endian + 'I', length_bytes)[0]
+        remaining = remaining_bytes(f)
+        if (total_length < header_length or total_length % 4
+                or (remaining is not None and total_length - header_length + 4 > remaining)):
+            print(f"Truncated block at the end of {pcap_file}.")
+            return
+        body = f.read(total_length - header_length)
+        if block_type == PCAPNG_SHB:
+            body = body_start + body
+            interfaces = []
+        trailer = f.read(4)
+        if len(body) < total_length - header_length or len(trailer) < 4:
+            print(f"Truncated block at the end of {pcap_file}.")
+            return
+        if len(body) < PCAPNG_MIN_BODY.get(block_type, 0):
+            print(f"Corrupted block in {pcap_file}.")
+            return
+
+        if block_type == PCAPNG_IDB:
+            linktype, _, snaplen = struct.unpack(endian + 'HHI', body[:8])
+            interfaces.append((linktype, pcapng_ts_divisor(body[8:], endian), snaplen))
+        elif block_type in (PCAPNG_EPB, PCAPNG_PB, PCAPNG_SPB):
+            if block_type == PCAPNG_EPB:
+                interface_id, ts_high, ts_low, cap_len, orig_len = struct.unpack(endian + 'IIIII', body[:20])
+            elif block_type == PCAPNG_PB:
+                interface_id, _, ts_high, ts_low, cap_len, orig_len = struct.unpack(endian + 'HHIIII', body[:20])
+            else:
+                interface_id = 0
+            if interface_id >= len(interfaces):
+                print(f"Packet block for an undeclared interface in {pcap_file}.")
+                return
+            linktype, divisor, snaplen = interfaces[interface_id]
+            if block_type == PCAPNG_SPB:
+                # Simple packet blocks carry no timestamp, reuse the previous one
+                orig_len = struct.unpack(endian + 'I', body[:4])[0]
+                cap_len = min(orig_len, snaplen) if snaplen else orig_len
+                yield last_timestamp, orig_len, linktype, body[4:4 + cap_len]
+            else:
+                last_timestamp = ((ts_high << 32) | ts_low) / divisor
+                yield last_timestamp, orig_len, linktype, body[20:20 + cap_len]
+
+        type_bytes = f.read(4)
+        if len(type_bytes) < 4:
+            return
+        block_type = struct.unpack(endian + 'I', type_bytes)[0]
+
+
+# Timestamp resolution of an interface (if_tsresol option, default microseconds)
+def pcapng_ts_divisor(options, endian):
+    offset = 0
+    while offset + 4 <= len(options):
+        code, length = struct.unpack(endian + 'HH', options[offset:offset + 4])
+        if code == 0:
+            break
+        if code == 9 and length >= 1 and offset + 4 < len(options):
+            resolution = options[offset + 4]
+            if resolution & 0x80:
+                return float(2 ** (resolution & 0x7F))
+            return float(10 ** resolution)
+        offset += 4 + ((length + 3) & ~3)
+    return 1e6
+
+
+def format_mac(raw):
+    return ':'.join(f'{b:02x}' for b in raw)
+
+
+# Decode the link, network and transport headers of a single frame
+def decode_frame(timestamp, orig_len, linktype, data):
+    src_mac = dst_mac = None
+    if linktype == LINKTYPE_ETHERNET:
+        if len(data) < 14:
+            return None
+        dst_raw, src_raw, ethertype = ETH_HEADER.unpack_from(data)
+        src_mac = format_mac(src_raw)
+        dst_mac = format_mac(dst_raw)
+        offset = 14
+        while ethertype in ETH_P_VLAN and len(data) >= offset + 4:
+            ethertype = PORTS_HEADER.unpack_from(data, offset)[1]
+            offset += 4
+        if ethertype <= 1500:
+            # 802.3 frame carrying LLC, which on our switches is spanning tree
+            is_stp = dst_raw == STP_MAC or (len(data) > offset and data[offset] == 0x42)
+            return Packet(timestamp, orig_len, 'STP' if is_stp else 'LLC', None, None, None, src_mac, dst_mac,
+                          None, None, None, None)
+    elif linktype == LINKTYPE_LINUX_SLL:
+        if len(data) < 16:
+            return None
+        _, _, addr_len, addr, ethertype = SLL_HEADER.unpack_from(data)
+        src_mac = format_mac(addr[:min(addr_len, 8)])
+        offset = 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        if len(data) < 20:
+            return None
+        ethertype, _, _, _, _, addr_len, addr = SLL2_HEADER.unpack_from(data)
+        src_mac = format_mac(addr[:min(addr_len, 8)])
+        offset = 20
+    elif linktype in (LINKTYPE_RAW, 12):
+        if not data:
+            return None
+        ethertype = ETH_P_IP if data[0] >> 4 == 4 else ETH_P_IPV6
+        offset = 0
+    else:
+        return None
+
+    if ethertype == ETH_P_IP:
+        return decode_ipv4(timestamp, orig_len, data, offset, src_mac, dst_mac)
+    if ethertype == ETH_P_IPV6:
+        return decode_ipv6(timestamp, orig_len, data, offset, src_mac, dst_mac)
+    if ethertype == ETH_P_ARP:
+        protocol = 'ARP'
+    elif ethertype == ETH_P_LLDP:
+        protocol = 'LLDP'
+    else:
+        protocol = 'ETH'
+    return Packet(timestamp, orig_len, protocol, None, None, None, src_mac, dst_mac, None, None, None, None)
+
+
+def decode_ipv4(timestamp, orig_len, data, offset, src_mac, dst_mac):
+    if len(data) < offset + 20:
+        return None
+    version_ihl, _, total_length, _, flags_fragment, _, ip_proto, _, src_raw, dst_raw = IPV4_HEADER.unpack_from(data, offset)
+    header_length = (version_ihl & 0x0F) * 4
+    src_ip = socket.inet_ntoa(src_raw)
+    dst_ip = socket.inet_ntoa(dst_raw)
+    # Non-first fragments carry no transport header
+    if flags_fragment & 0x1FFF:
+        return Packet(timestamp, orig_len, 'IP', None, src_ip, dst_ip, src_mac, dst_mac, None, None, None, None)
+    return decode_transport(timestamp, orig_len, data, offset + header_length, total_length - header_length,
+                            ip_proto, 'ICMP', src_ip, dst_ip, src_mac, dst_mac)
+
+
+def decode_ipv6(timestamp, orig_len, data, offset, src_mac, dst_mac):
+    if len(data) < offset + 40:
+        return None
+    _, payload_length, next_header, _, _, _ = IPV6_HEADER.unpack_from(data, offset)
+    offset += 40
+    while next_header in IPV6_EXTENSION_HEADERS or next_header == 44:
+        if len(data) < offset + 8:
+            return None
+        header_length = 8 if next_header == 44 else (data[offset + 1] + 1) * 8
+        next_header = data[offset]
+        offset += header_length
+        payload_length -= header_length
+    # tshark exposes IPv6 addresses on the 'ipv6' layer, so the IP columns stay empty like before
+    return decode_transport(timestamp, orig_len, data, offset, payload_length, next_header, 'ICMPV6',
+                            None, None, src_mac, dst_mac)
+
+
+def decode_transport(timestamp, orig_len, data, offset, segment_length, ip_proto, icmp_name, src_ip, dst_ip,
+                     src_mac, dst_mac):
+    if ip_proto in (6, 17) and len(data) >= offset + 4:
+        src_port, dst_port = PORTS_HEADER.unpack_from(data, offset)
+        if ip_proto == 6:
+            transport = 'TCP'
+            header_length = (data[offset + 12] >> 4) * 4 if len(data) > offset + 12 else 20
+            payload_length = segment_length - header_length
+            protocol = tcp_application(src_port, dst_port, payload_length, data, offset + header_length)
+        else:
+            transport = 'UDP'
+            payload_length = segment_length - 8
+            protocol = UDP_APPLICATIONS.get(dst_port) or UDP_APPLICATIONS.get(src_port) or \
+                ('DATA' if payload_length > 0 else 'UDP')
+        return Packet(timestamp, orig_len, protocol, transport, src_ip, dst_ip, src_mac, dst_mac, None, None,
+                      src_port, dst_port)
+
+    if ip_proto in (1, 58):
+        protocol = icmp_name
+    elif ip_proto == 2:
+        protocol = 'IGMP'
+    else:
+        protocol = 'IP' if icmp_name == 'ICMP' else 'IPV6'
+    return Packet(timestamp, orig_len, protocol, None, src_ip, dst_ip, src_mac, dst_mac, None, None, None, None)
+
+
+def tcp_application(src_port, dst_port, payload_length, data, payload_offset):
+    if payload_length <= 0:
+        return 'TCP'
+    if src_port in OPENFLOW_PORTS or dst_port in OPENFLOW_PORTS:
+        version = data[payload_offset] if len(data) > payload_offset else None
+        return OPENFLOW_VERSIONS.get(version, 'OPENFLOW')
+    return TCP_APPLICATIONS.get(dst_port) or TCP_APPLICATIONS.get(src_port) or 'DATA'
+
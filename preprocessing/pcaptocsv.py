@@ -1,12 +1,119 @@
-import pyshark
+import argparse
 import csv
+import multiprocessing
 import os
 import sys
-from collections import defaultdict
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
 
-def analyze_pcap_folder(input_folder, output_folder, window_size=1):
+from aggregation import AGGREGATIONS, COLUMNS, iter_windows, iter_windows_multi, window_label
+from columnar import FORMAT_EXTENSIONS, OUTPUT_FORMATS, ColumnarFeatureWriter
+from manifest import FeatureManifest, capture_digest, capture_state
+from pcap_reader import ENGINES, SEGMENT_PATTERN, capture_segments, read_capture, read_packets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from instrumentation import metrics
+
+# Report progress from analyze_pcap every this many packets
+PROGRESS_INTERVAL = 50000
+# Number of window rows buffered before they are written out
+FLUSH_ROWS = 1000
+# The last segment of a capture modified less than this many seconds ago may
+# still be written by tcpdump, and is left for the next run
+SEGMENT_SETTLE_SECONDS = 10
+
+def analyze_pcap_folder(input_folder, output_folder, window_size=1, engine='native', workers=1, force=False,
+                        extra_window_sizes=(), aggregation='flow', file_format='csv'):
     os.makedirs(output_folder, exist_ok=True)
-    
+    window_sizes = [window_size] + [size for size in extra_window_sizes if size != window_size]
+    jobs = find_pcap_files(input_folder, output_folder, window_sizes, file_format)
+
+    # Captures still being written have their closed segments converted, and are
+    # converted again once tcpdump adds more
+    open_captures = [job for job in jobs if not capture_segments(job[0], SEGMENT_SETTLE_SECONDS)]
+    if open_captures:
+        print(f"\nSkipping {len(open_captures)} captures still being written")
+        jobs = [job for job in jobs if job not in open_captures]
+
+    # Skip captures whose features are already up to date, unless asked to redo everything
+    manifest = FeatureManifest(output_folder)
+    if not force:
+        pending = [job for job in jobs if not is_converted(manifest, job[0], job[1], engine, aggregation)]
+        manifest.save()
+        if len(pending) < len(jobs):
+            print(f"\nSkipping {len(jobs) - len(pending)} files already converted, {len(pending)} left")
+        jobs = pending
+
+    if workers > 1:
+        return analyze_pcap_parallel(jobs, engine, workers, manifest, aggregation)
+
+    failed = []
+    for input_file, outputs in jobs:
+        print(f"Analyzing file: {input_file}")
+
+        # Check if the file actually exists
+        if not capture_segments(input_file):
+            print(f"Error: file {input_file} does not exist.")
+            continue
+
+        # A failing capture is reported and the rest of the batch carries on
+        try:
+            stats = convert_pcap(input_file, outputs, engine, aggregation=aggregation)
+        except Exception as e:
+            print(f"Error converting {input_file}: {e}")
+            stats = None
+        record_conversion(manifest, input_file, outputs, engine, aggregation, stats)
+        if stats is None:
+            failed.append(input_file)
+
+    for input_file in failed:
+        print(f"Failed: {input_file}")
+    return failed
+
+# Settings an output file was produced with, as recorded in the manifest
+def output_settings(window_size, engine, aggregation):
+    return {'window_size': window_size, 'engine': engine, 'aggregation': aggregation}
+
+def is_converted(manifest, input_file, outputs, engine, aggregation):
+    segments = capture_segments(input_file, SEGMENT_SETTLE_SECONDS)
+    return all(manifest.is_up_to_date(input_file, output_file, output_settings(size, engine, aggregation), segments)
+               for size, output_file in outputs.items())
+
+# Convert one capture (all its closed segments) and fingerprint the source it was read from
+def convert_pcap(input_file, outputs, engine, progress=None, aggregation='flow'):
+    segments = capture_segments(input_file, SEGMENT_SETTLE_SECONDS)
+    if not segments:
+        print(f"Error: file {input_file} does not exist.")
+        return None
+    state = capture_state(segments)
+    stats = analyze_pcap_multi(input_file, outputs, engine, progress, aggregation, segments)
+    if stats is not None:
+        stats['source_state'] = state
+        with metrics.timer('pcap.hash'):
+            stats['sha256'] = capture_digest(segments)
+        if progress is not None and metrics.enabled:
+            stats['metrics'] = metrics.drain()  # Worker process: hand the metrics back to the parent
+    return stats
+
+def record_conversion(manifest, input_file, outputs, engine, aggregation, stats):
+    for size, output_file in outputs.items():
+        if stats is None:
+            manifest.forget(output_file)
+        else:
+            settings = output_settings(size, engine, aggregation)
+            manifest.record(input_file, output_file, settings, stats['source_state'], stats['sha256'])
+    manifest.save()
+
+# List (input pcap, {window size: output csv}) pairs for every capture under the input folder.
+# The first window size is written to the output folder itself, the others to
+# one subfolder per resolution (e.g. window_100ms/) so they never get mixed up.
+# The segments of a rotated and/or compressed capture (h1_traffic.pcap,
+# h1_traffic.pcap1.gz, ...) make up a single capture, named after the first one.
+def find_pcap_files(input_folder, output_folder, window_sizes=(1,), file_format='csv'):
+    jobs = []
+
     # Scan the input folder, including subfolders
     for root, _, files in os.walk(input_folder):
         # Get the relative path of the subfolder
@@ -18,133 +125,195 @@ def analyze_pcap_folder(input_folder, output_folder, window_size=1):
         
         print(f"\nExploring folder: {root}")
         
-        for filename in files:
-            if filename.endswith('.pcap'):
-                input_file = os.path.join(root, filename)
-                
-                # Create the output filename reflecting the subfolder structure
-                output_file = os.path.join(output_folder, f"{folder_id}_{os.path.splitext(filename)[0]}_features.csv")
-                
-                print(f"Analyzing file: {input_file}")
-                
-                # Check if the file actually exists
-                if not os.path.exists(input_file):
-                    print(f"Error: file {input_file} does not exist.")
+        captures = sorted({match.group('capture') for match in map(SEGMENT_PATTERN.match, files) if match})
+        for filename in captures:
+            input_file = os.path.join(root, filename)
+            
+            # Create the output filename reflecting the subfolder structure
+            output_name = f"{folder_id}_{os.path.splitext(filename)[0]}_features{FORMAT_EXTENSIONS[file_format]}"
+            outputs = {}
+            for i, size in enumerate(window_sizes):
+                folder = output_folder if i == 0 else os.path.join(output_folder, f"window_{window_label(size)}")
+                outputs[size] = os.path.join(folder, output_name)
+            jobs.append((input_file, outputs))
+
+    return jobs
+
+# Convert captures on a pool of worker processes, largest files first so the
+# long conversions start early and the small ones fill the gaps at the end
+def analyze_pcap_parallel(jobs, engine, workers, manifest, aggregation='flow'):
+    jobs = sorted(jobs, key=lambda job: sum(map(os.path.getsize, capture_segments(job[0]))), reverse=True)
+    print(f"\nConverting {len(jobs)} files with {workers} worker processes")
+
+    start = time.time()
+    failed = []
+    total_packets = 0
+    total_bytes = 0
+
+    with multiprocessing.Manager() as manager:
+        progress = manager.Queue()
+        reporter = threading.Thread(target=report_progress, args=(progress,), daemon=True)
+        reporter.start()
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(convert_pcap, input_file, outputs, engine, progress, aggregation): (input_file, outputs)
+                       for input_file, outputs in jobs}
+            for future in as_completed(futures):
+                input_file, outputs = futures[future]
+                # A failing capture is reported and the rest of the batch carries on
+                try:
+                    stats = future.result()
+                except Exception as e:
+                    print(f"Error converting {input_file}: {e}")
+                    stats = None
+                if stats is not None:
+                    metrics.merge(stats.pop('metrics', None))
+                record_conversion(manifest, input_file, outputs, engine, aggregation, stats)
+                if stats is None:
+                    failed.append(input_file)
                     continue
+                total_packets += stats['packets']
+                total_bytes += stats['bytes']
+
+        progress.put(None)
+        reporter.join()
+
+    elapsed = time.time() - start
+    print(f"\nConverted {len(jobs) - len(failed)}/{len(jobs)} files in {elapsed:.1f}s "
+          f"({format_rate(total_packets, total_bytes, elapsed)})")
+    for input_file in failed:
+        print(f"Failed: {input_file}")
+    return failed
+
+# Print the progress messages that worker processes send back
+def report_progress(progress):
+    while True:
+        message = progress.get()
+        if message is None:
+            return
+        pcap_file, packets, nbytes, elapsed, done = message
+        state = "done" if done else "running"
+        print(f"[{state}] {os.path.basename(pcap_file)}: {packets} packets in {elapsed:.1f}s "
+              f"({format_rate(packets, nbytes, elapsed)})")
 
-                analyze_pcap(input_file, output_file, window_size)
+def format_rate(packets, nbytes, elapsed):
+    elapsed = max(elapsed, 1e-9)
+    return f"{packets / elapsed:.0f} packets/s, {nbytes / elapsed / 1e6:.2f} MB/s"
 
-def analyze_pcap(pcap_file, output_csv, window_size=1):
+def analyze_pcap(pcap_file, output_csv, window_size=1, engine='native', progress=None, aggregation='flow'):
+    return analyze_pcap_multi(pcap_file, {window_size: output_csv}, engine, progress, aggregation)
+
+# Decode the capture once and write one feature file per window size in outputs.
+# segments: files of a rotated capture, read in order instead of pcap_file alone
+def analyze_pcap_multi(pcap_file, outputs, engine='native', progress=None, aggregation='flow', segments=None):
+    start = time.time()
     try:
-        print(f"Opening pcap file: {pcap_file}")
-        capture = pyshark.FileCapture(pcap_file)
-        print(f"Pcap file opened successfully: {pcap_file}")
+        if segments is None or segments == [pcap_file]:
+            print(f"Opening pcap file: {pcap_file} (engine: {engine})")
+            capture = read_packets(pcap_file, engine)
+        else:
+            print(f"Opening pcap file: {pcap_file} ({len(segments)} segments, engine: {engine})")
+            capture = read_capture(segments, engine)
     except Exception as e:
         print(f"Error opening file {pcap_file}: {e}")
         return
 
-    data = []
-    byte_count = 0
-    packet_count = 0
-    packet_sizes = []
-    timestamps = []
-    protocol_counts = defaultdict(int)
-    current_window = None
-    last_timestamp = None
-    delay_list = []
-
-    for packet in capture:
-        try:
-            timestamp = float(packet.sniff_timestamp)
-            length = int(packet.length)
-            protocol = packet.highest_layer
-            src_ip = packet.ip.src if hasattr(packet, 'ip') else None
-            dst_ip = packet.ip.dst if hasattr(packet, 'ip') else None
-            src_mac = packet.eth.src if hasattr(packet, 'eth') else None
-            dst_mac = packet.eth.dst if hasattr(packet, 'eth') else None
-            ingress_port = packet.openflow.in_port if hasattr(packet, 'openflow') and hasattr(packet.openflow, 'in_port') else None
-            egress_port = packet.openflow.out_port if hasattr(packet, 'openflow') and hasattr(packet.openflow, 'out_port') else None
-            
-            # Check if packet is UDP
-            src_port = None
-            dst_port = None
-            if hasattr(packet, 'udp'):
-                src_port = packet.udp.srcport
-                dst_port = packet.udp.dstport
-                protocol = 'UDP'
-                # print(f"UDP Packet found: {src_ip}:{src_port} -> {dst_ip}:{dst_port}")  # Additional debug log
-            elif hasattr(packet, 'tcp'):
-                src_port = packet.tcp.srcport
-                dst_port = packet.tcp.dstport
-
-            delay = (timestamp - last_timestamp) if last_timestamp is not None else 0
-            last_timestamp = timestamp
-
-            if current_window is None:
-                current_window = int(timestamp)
-
-            if int(timestamp) == current_window:
-                byte_count += length
-                packet_count += 1
-                packet_sizes.append(length)
-                timestamps.append(timestamp)
-                protocol_counts[protocol] += 1
-                delay_list.append(delay)
-            else:
-                # Compute and store window metrics
-                throughput = byte_count / window_size
-                avg_packet_size = sum(packet_sizes) / len(packet_sizes) if packet_sizes else 0
-                jitter = calculate_jitter(timestamps)
-                protocol_distribution = {k: v / packet_count for k, v in protocol_counts.items()}
-
-                data.append([current_window, throughput, jitter, avg_packet_size, packet_count, protocol_distribution, delay_list[-1],
-                             src_ip, dst_ip, src_mac, dst_mac, ingress_port, egress_port, src_port, dst_port, protocol])
-
-                # Reset variables for the next window
-                byte_count = length
-                packet_count = 1
-                packet_sizes = [length]
-                timestamps = [timestamp]
-                protocol_counts = defaultdict(int)
-                protocol_counts[protocol] += 1
-                delay_list = [delay]
-                current_window = int(timestamp)
-
-        except AttributeError:
-            print(f"Packet skipped due to missing or corrupted data in file {pcap_file}.")
-            continue
-        except Exception as e:
-            print(f"Error analyzing a packet in {pcap_file}: {e}")
-            continue
+    stats = {'packets': 0, 'bytes': 0}
+    # With metrics enabled, reading and decoding the packets, aggregating them
+    # into windows and writing the rows are timed separately
+    packets = count_packets(metrics.timed('pcap.decode', capture), stats, pcap_file, progress, start)
+    rows = 0
+    with ExitStack() as stack:
+        writers = {size: stack.enter_context(open_feature_writer(output_file)) for size, output_file in outputs.items()}
+        for size, row in metrics.timed('pcap.aggregate', iter_windows_multi(packets, list(outputs), pcap_file, aggregation)):
+            with metrics.timer('pcap.write'):
+                writers[size].write(row)
+            rows += 1
+        with metrics.timer('pcap.write'):
+            stack.close()  # Flush the last rows
 
-    # Process any remaining data after the loop
-    if packet_count > 0:
-        throughput = byte_count / window_size
-        avg_packet_size = sum(packet_sizes) / len(packet_sizes) if packet_sizes else 0
-        jitter = calculate_jitter(timestamps)
-        protocol_distribution = {k: v / packet_count for k, v in protocol_counts.items()}
-        data.append([current_window, throughput, jitter, avg_packet_size, packet_count, protocol_distribution, delay_list[-1],
-                     src_ip, dst_ip, src_mac, dst_mac, ingress_port, egress_port, src_port, dst_port, protocol])
-    capture.close()
-    save_to_csv(data, output_csv)
-
-def calculate_jitter(timestamps):
-    if len(timestamps) < 2:
-        return 0
-    diffs = [abs(timestamps[i] - timestamps[i - 1]) for i in range(1, len(timestamps))]
-    return sum(diffs) / len(diffs)
+    stats['seconds'] = time.time() - start
+    metrics.count('pcap.files')
+    metrics.count('pcap.packets', stats['packets'])
+    metrics.count('pcap.bytes', stats['bytes'])
+    metrics.count('pcap.rows', rows)
+    if progress is not None:
+        progress.put((pcap_file, stats['packets'], stats['bytes'], stats['seconds'], True))
+    return stats
+
+# Window rows of a capture, one at a time, for code that wants features without a CSV round-trip
+def iter_pcap_windows(pcap_file, window_size=1, engine='native', aggregation='flow'):
+    return iter_windows(read_packets(pcap_file, engine), window_size, pcap_file, aggregation)
+
+# Pass packets through while counting them and reporting progress
+def count_packets(packets, stats, pcap_file, progress, start):
+    for packet in packets:
+        stats['packets'] += 1
+        stats['bytes'] += packet.length
+        if progress is not None and stats['packets'] % PROGRESS_INTERVAL == 0:
+            progress.put((pcap_file, stats['packets'], stats['bytes'], time.time() - start, False))
+        yield packet
+
+# Pick the writer matching the extension of the output file
+def open_feature_writer(output_file):
+    extension = os.path.splitext(output_file)[1]
+    for file_format, format_extension in FORMAT_EXTENSIONS.items():
+        if file_format != 'csv' and extension == format_extension:
+            return ColumnarFeatureWriter(output_file, file_format)
+    return FeatureWriter(output_file)
+
+# Writes window rows to CSV in batches of FLUSH_ROWS as they are produced.
+# Rows go to a .tmp file that is renamed once complete, so an interrupted run
+# never leaves a truncated file behind under the final name.
+class FeatureWriter:
+    def __init__(self, output_csv):
+        self.output_csv = output_csv
+        self.tmp_csv = output_csv + '.tmp'
+        self.file = None
+        self.writer = None
+        self.batch = []
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.output_csv) or '.', exist_ok=True)
+        self.file = open(self.tmp_csv, mode='w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(COLUMNS)
+        return self
+
+    def write(self, row):
+        row = list(row)
+        row[5] = str(row[5])  # Convert protocol distribution dictionary to string
+        self.batch.append(row)
+        if len(self.batch) >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        self.writer.writerows(self.batch)
+        self.batch = []
+        self.file.flush()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.file.close()
+            os.remove(self.tmp_csv)
+            return False
+        self.flush()
+        self.file.close()
+        os.replace(self.tmp_csv, self.output_csv)
+        print(f"Data saved to '{self.output_csv}'")
+        return False
+
+# Window sizes given on the command line; whole seconds stay integers so 1s output is unchanged
+def parse_window_size(value):
+    size = float(value)
+    if size <= 0:
+        raise argparse.ArgumentTypeError(f"window size must be positive, got {value}")
+    return int(size) if size.is_integer() else size
 
 def save_to_csv(data, output_csv):
-    columns = ['Timestamp', 'Throughput (Bps)', 'Jitter (s)', 'Avg Packet Size (bytes)', 'Packet Count', 'Protocol Distribution',
-               'Delay (s)', 'Source IP', 'Destination IP', 'Source MAC', 'Destination MAC', 'Ingress Port', 'Egress Port',
-               'Source Port', 'Destination Port', 'Protocol']
-    with open(output_csv, mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(columns)
+    with FeatureWriter(output_csv) as writer:
         for row in data:
-            row[5] = str(row[5])  # Convert protocol distribution dictionary to string
-            writer.writerow(row)
-    print(f"Data saved to '{output_csv}'")
+            writer.write(row)
 
 if __name__ == "__main__":
     # Get the directory where this script is located
@@ -154,8 +323,29 @@ if __name__ == "__main__":
     input_base = os.path.join(current_dir, '..', 'traffic_records')
     output_folder = os.path.join(current_dir, '..', 'prediction')
     
-    if len(sys.argv) > 1:
-        subfolder = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Extract windowed traffic features from .pcap files")
+    parser.add_argument('subfolder', nargs='?', help="Only process this subfolder of traffic_records")
+    parser.add_argument('--engine', choices=ENGINES, default='native',
+                        help="Packet reader: 'native' parses pcap/pcapng directly, 'pyshark' dissects every packet with tshark")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes converting files in parallel")
+    parser.add_argument('--force', action='store_true', help="Convert every file, even those already up to date")
+    parser.add_argument('--window-size', type=parse_window_size, default=1,
+                        help="Window length in seconds, e.g. 0.1 or 10 (default: 1)")
+    parser.add_argument('--extra-window-sizes', type=parse_window_size, nargs='*', default=[],
+                        help="More window lengths computed in the same pass, each written to prediction/window_<size>/")
+    parser.add_argument('--aggregation', choices=AGGREGATIONS, default='flow',
+                        help="'flow' writes one row per flow and window, 'window' one row per window (legacy layout)")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='csv',
+                        help="Feature file format; parquet and feather are typed columnar files (requires pyarrow)")
+    parser.add_argument('--metrics', metavar='FILE',
+                        help="Time every stage and save the metrics: Prometheus text if FILE ends in .prom, else JSON lines")
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.enable(args.metrics)
+
+    if args.subfolder:
+        subfolder = args.subfolder
         input_folder = os.path.join(input_base, subfolder)
         if not os.path.exists(input_folder):
             print(f"Specified folder '{input_folder}' does not exist. Exiting.")
@@ -165,4 +355,7 @@ if __name__ == "__main__":
         input_folder = input_base
         print(f"Processing all folders in: {input_folder}")
     
-    analyze_pcap_folder(input_folder, output_folder)
+    analyze_pcap_folder(input_folder, output_folder, window_size=args.window_size, engine=args.engine,
+                        workers=args.workers, force=args.force, extra_window_sizes=args.extra_window_sizes,
+                        aggregation=args.aggregation, file_format=args.format)
+    metrics.finish()
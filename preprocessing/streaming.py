@@ -0,0 +1,180 @@
+import argparse
+import csv
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+
+from aggregation import AGGREGATIONS, COLUMNS, iter_windows
+from pcap_reader import read_packets, read_packets_live
+from pcaptocsv import parse_window_size
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from switch_ids import switch_id_from_filename
+
+# Window rows waiting for the prediction stage; capture readers block while it is full
+QUEUE_SIZE = 1024
+DEFAULT_PREDICTOR = '127.0.0.1:9900'
+# Columns sent to the prediction service, with the group columns
+MODEL_FEATURES = ['Throughput (Bps)', 'Jitter (s)', 'Delay (s)', 'Avg Packet Size (bytes)', 'Packet Count']
+
+
+# Yield the packets of a finished capture at the pace they were recorded,
+# speed times faster; speed 0 replays as fast as the packets can be read
+def replay_packets(packets, speed=1.0):
+    start = None
+    for packet in packets:
+        if speed > 0:
+            if start is None:
+                start = (time.monotonic(), packet.timestamp)
+            else:
+                delay = (packet.timestamp - start[1]) / speed - (time.monotonic() - start[0])
+                if delay > 0:
+                    time.sleep(delay)
+        yield packet
+
+
+# Aggregate the packets of one capture and queue every window row as it closes
+def produce_windows(pcap_file, packets, rows, window_size, aggregation):
+    switch_id = switch_id_from_filename(pcap_file)
+    try:
+        for row in iter_windows(packets, window_size, pcap_file, aggregation):
+            rows.put((switch_id, row))
+    except Exception as e:
+        print(f"Error streaming {pcap_file}: {e}")
+
+
+# Stream window rows of several captures to sink(switch_id, row) as the windows
+# close. Each capture is read and aggregated on its own thread, and the rows of
+# all of them go through one bounded queue: when the sink falls behind, the
+# readers wait instead of buffering without limit.
+# follow: tail captures still being written, otherwise replay them at speed.
+def stream_captures(pcap_files, sink, window_size=1, aggregation='flow', follow=False, speed=1.0,
+                    idle_timeout=None, queue_size=QUEUE_SIZE):
+    rows = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    producers = []
+    for pcap_file in pcap_files:
+        try:
+            if follow:
+                packets = read_packets_live(pcap_file, idle_timeout=idle_timeout, stop=stop)
+            else:
+                packets = replay_packets(read_packets(pcap_file), speed)
+        except Exception as e:
+            print(f"Error opening file {pcap_file}: {e}")
+            continue
+        thread = threading.Thread(target=produce_windows, args=(pcap_file, packets, rows, window_size, aggregation),
+                                  daemon=True)
+        thread.start()
+        producers.append(thread)
+
+    def close_queue():
+        for thread in producers:
+            thread.join()
+        rows.put(None)
+    threading.Thread(target=close_queue, daemon=True).start()
+
+    start = time.time()
+    count = 0
+    try:
+        while True:
+            item = rows.get()
+            if item is None:
+                break
+            sink(*item)
+            count += 1
+    except KeyboardInterrupt:
+        stop.set()
+    print(f"Streamed {count} windows from {len(producers)} captures in {time.time() - start:.1f}s")
+    return count
+
+
+def print_row(switch_id, row):
+    print(f"{switch_id} @ {row[0]}: {row[15]} {row[13]} -> {row[14]}, {row[1]:.1f} Bps, {row[4]} packets")
+
+
+# Appends rows to a feature CSV, flushed after every row so it can be followed
+# with `inference.py --tail` while it grows. Rows of several captures share the
+# file, so every row carries the Switch ID of its capture.
+class CsvSink:
+    def __init__(self, output_csv):
+        header = COLUMNS + ['Switch ID']
+        if os.path.exists(output_csv):
+            with open(output_csv, newline='') as f:
+                existing = next(csv.reader(f), None)
+            if existing is not None and existing != header:
+                raise ValueError(f"{output_csv} has other columns than the streamed rows, use a new file")
+        new_file = not os.path.exists(output_csv) or os.path.getsize(output_csv) == 0
+        self.file = open(output_csv, mode='a', newline='')
+        self.writer = csv.writer(self.file)
+        if new_file:
+            self.writer.writerow(header)
+
+    def __call__(self, switch_id, row):
+        row = list(row)
+        row[5] = str(row[5])  # Convert protocol distribution dictionary to string
+        self.writer.writerow(row + [switch_id])
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+# Sends every flow row to the prediction service of lstm/inference.py and prints
+# the answer. Waiting for each reply is what applies backpressure to the readers.
+class PredictorSink:
+    def __init__(self, address=DEFAULT_PREDICTOR):
+        host, port = address.rsplit(':', 1)
+        self.connection = socket.create_connection((host, int(port)))
+        self.reader = self.connection.makefile('r')
+
+    def __call__(self, switch_id, row):
+        if row[13] in (None, '') or row[14] in (None, ''):
+            return  # Windows without ports do not belong to any group
+        request = dict(zip(COLUMNS, row))
+        message = {name: request[name] for name in MODEL_FEATURES}
+        message.update({'Switch ID': switch_id, 'Source Port': row[13], 'Destination Port': row[14],
+                        'Protocol': row[15]})
+        self.connection.sendall((json.dumps(message) + '\n').encode())
+        reply = json.loads(self.reader.readline())
+        if reply.get('prediction') is not None:
+            print(f"{switch_id}|{row[13]}|{row[14]}|{row[15]} @ {row[0]}: next throughput "
+                  f"{reply['prediction']:.1f} Bps ({reply['latency_ms']:.2f} ms)")
+        elif 'error' in reply:
+            print(f"Prediction error for {switch_id} @ {row[0]}: {reply['error']}")
+
+    def close(self):
+        self.reader.close()
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream window features of captures to the prediction stage")
+    parser.add_argument('pcap_files', nargs='+', help="Captures to stream, e.g. the tcpdump outputs of traffic_gen.py")
+    parser.add_argument('--follow', action='store_true', help="Tail captures that are still being written")
+    parser.add_argument('--idle-timeout', type=float, help="With --follow, stop after this many seconds without new packets")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="Replay speed-up of finished captures; 1 is real time, 0 as fast as possible")
+    parser.add_argument('--window-size', type=parse_window_size, default=1, help="Window length in seconds (default: 1)")
+    parser.add_argument('--aggregation', choices=AGGREGATIONS, default='flow')
+    parser.add_argument('--predict', nargs='?', const=DEFAULT_PREDICTOR, metavar='HOST:PORT',
+                        help=f"Send rows to a running inference.py service (default: {DEFAULT_PREDICTOR})")
+    parser.add_argument('--output', help="Append rows to this feature CSV")
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE, help="Rows buffered before readers wait")
+    args = parser.parse_args()
+
+    if args.predict:
+        sink = PredictorSink(args.predict)
+    elif args.output:
+        sink = CsvSink(args.output)
+    else:
+        sink = print_row
+    try:
+        stream_captures(args.pcap_files, sink, args.window_size, args.aggregation, args.follow, args.speed,
+                        args.idle_timeout, args.queue_size)
+    finally:
+        if hasattr(sink, 'close'):
+            sink.close()